@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Gradient Checkpointing Policy Benchmark
+Measures forward/backward step time and peak memory for each checkpointing policy on the
+real model config, next to the memory planner's prediction
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+DEFAULT_POLICIES = ['all', 'none', 'full_attention', 'sliding_attention', 'moe_mlp']
+
+def parse_policy(value: str):
+    return json.loads(value) if value.lstrip().startswith('{') else value
+
+def main():
+    """Benchmark gradient checkpointing policies"""
+    parser = argparse.ArgumentParser(description="Measure step time and peak memory per gradient checkpointing policy")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON (model_path, batch_size, max_length)")
+    parser.add_argument("--policy", action="append", default=None,
+                        help="Policy to measure: all, none, moe_mlp, a layer type, or a JSON object; repeat to compare "
+                             "(default: the standard set plus the config policy)")
+    parser.add_argument("--lora", action="store_true", help="Measure with the LoRA trainer's adapters (only adapter gradients)")
+    parser.add_argument("--layers", type=int, default=None,
+                        help="Build a randomly initialized model with only the first N layers of the real config "
+                             "instead of loading the weights (fast, same per-layer shapes)")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--seq-len", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=3, help="Measured steps per policy (after one warmup step)")
+    parser.add_argument("--output", default=None,
+                        help="Report JSON path (default: <output_dir>/checkpointing_benchmark.json)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM
+    from vitalis.training.checkpoint_policy import measure_checkpoint_policies
+    from vitalis.utils.memory_planner import MemoryPlanner, GB, workload_from_config
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    mode = 'lora' if args.lora else 'full'
+    batch_size = args.batch_size or (config.get('lora_batch_size', 1) if args.lora else config['batch_size'])
+    seq_len = args.seq_len or (config.get('lora_max_length', 512) if args.lora else config['max_length'])
+
+    policies = {name: parse_policy(name) for name in args.policy or DEFAULT_POLICIES}
+    configured = config.get('gradient_checkpointing', True)
+    if not args.policy and not isinstance(configured, bool) and configured not in DEFAULT_POLICIES:
+        policies['configured'] = configured
+
+    model_config = AutoConfig.from_pretrained(config['model_path'], local_files_only=True, trust_remote_code=True)
+    if args.layers:
+        print(f"PROCESSING Building a {args.layers}-layer model from the real config (random weights)...")
+        model_config.num_hidden_layers = args.layers
+        if getattr(model_config, 'layer_types', None):
+            model_config.layer_types = model_config.layer_types[:args.layers]
+        if hasattr(model_config, 'quantization_config'):
+            del model_config.quantization_config
+        model = AutoModelForCausalLM.from_config(model_config, torch_dtype=torch.bfloat16)
+    else:
+        print("PROCESSING Loading model weights...")
+        model = AutoModelForCausalLM.from_pretrained(
+            config['model_path'],
+            local_files_only=True,
+            trust_remote_code=True,
+            torch_dtype=torch.bfloat16,
+            low_cpu_mem_usage=True
+        )
+    if torch.backends.mps.is_available():
+        model = model.to('mps')
+
+    if args.lora:
+        from peft import LoraConfig, get_peft_model, TaskType
+
+        model = get_peft_model(model, LoraConfig(
+            task_type=TaskType.CAUSAL_LM,
+            r=config.get('lora_r', 8),
+            lora_alpha=config.get('lora_alpha', 16),
+            lora_dropout=config.get('lora_dropout', 0.1),
+            target_modules=config.get('lora_target_modules', ["q_proj", "v_proj"]),
+            bias="none"
+        ))
+
+    print(f"PROCESSING Measuring {len(policies)} policies at batch {batch_size} x {seq_len} tokens, {args.steps} steps each...")
+    results = measure_checkpoint_policies(model, policies, batch_size, seq_len, steps=args.steps)
+
+    # Planner prediction for the same workload on the full-depth model
+    planner = MemoryPlanner(config['model_path'])
+    workload = workload_from_config(config, mode, batch_size=batch_size, seq_len=seq_len)
+    for result in results:
+        workload['gradient_checkpointing'] = result['policy']
+        result['predicted_activation_bytes'] = planner.plan(**workload)['components']['activations']
+
+    baseline = next((r for r in results if r['name'] == 'none'), results[0])
+    print(f"\nMETRICS {'policy':<20} {'checkpointed':<24} {'s/step':>8} {'tokens/s':>9} {'peak GB':>8} {'planned act GB':>15}")
+    for result in results:
+        slowdown = result['step_seconds'] / baseline['step_seconds'] - 1
+        print(f"   {result['name']:<20} {result['checkpointed']:<24} {result['step_seconds']:>8.2f} "
+              f"{result['tokens_per_second']:>9.0f} {result['peak_memory_bytes'] / GB:>8.2f} "
+              f"{result['predicted_activation_bytes'] / GB:>15.2f}   ({slowdown:+.0%} vs {baseline['name']})")
+    if args.layers:
+        print(f"\nIDEA Measured on {args.layers} of {planner.num_layers} layers; planned figures are for the full model")
+
+    output_path = Path(args.output or Path(config['output_dir']) / 'checkpointing_benchmark.json')
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump({'mode': mode, 'batch_size': batch_size, 'seq_len': seq_len, 'layers': args.layers or planner.num_layers,
+                   'results': results}, f, indent=2)
+    print(f"\nCOMPLETED Report saved: {output_path}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
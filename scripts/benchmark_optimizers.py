@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Optimizer Memory Benchmark
+Measures optimizer step time and optimizer-state footprint for each full fine-tuning
+optimizer on the real model config, next to the memory planner's prediction
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Benchmark memory-lean optimizers"""
+    from vitalis.training.lean_optimizers import OPTIMIZERS
+
+    parser = argparse.ArgumentParser(description="Measure step time and state memory per optimizer for full fine-tuning")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON (model_path, batch_size, max_length, output_dir)")
+    parser.add_argument("--optimizer", action="append", choices=OPTIMIZERS, default=None,
+                        help="Optimizer to measure; repeat to compare (default: all)")
+    parser.add_argument("--layers", type=int, default=2,
+                        help="Build a randomly initialized model with only the first N layers of the real config "
+                             "(0 loads the full model weights)")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--seq-len", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=3, help="Measured steps per optimizer (after one warmup step)")
+    parser.add_argument("--output", default=None,
+                        help="Report JSON path (default: <output_dir>/optimizer_benchmark.json)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM
+    from vitalis.training.lean_optimizers import measure_optimizers
+    from vitalis.utils.memory_planner import MemoryPlanner, GB, workload_from_config
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    names = args.optimizer or list(OPTIMIZERS)
+
+    model_config = AutoConfig.from_pretrained(config['model_path'], local_files_only=True, trust_remote_code=True)
+    if args.layers:
+        print(f"PROCESSING Building a {args.layers}-layer model from the real config (random weights)...")
+        model_config.num_hidden_layers = args.layers
+        if getattr(model_config, 'layer_types', None):
+            model_config.layer_types = model_config.layer_types[:args.layers]
+        if hasattr(model_config, 'quantization_config'):
+            del model_config.quantization_config
+        model = AutoModelForCausalLM.from_config(model_config, torch_dtype=torch.bfloat16)
+    else:
+        print("PROCESSING Loading model weights...")
+        model = AutoModelForCausalLM.from_pretrained(
+            config['model_path'],
+            local_files_only=True,
+            trust_remote_code=True,
+            torch_dtype=torch.bfloat16,
+            low_cpu_mem_usage=True
+        )
+    parameters = sum(p.numel() for p in model.parameters())
+
+    print(f"PROCESSING Measuring {len(names)} optimizers at batch {args.batch_size} x {args.seq_len} tokens, {args.steps} steps each...")
+    offload_dir = Path(config['output_dir']) / 'optimizer_benchmark_offload'
+    results = measure_optimizers(model, names, {**config, 'optimizer_offload_dir': str(offload_dir)},
+                                 args.batch_size, args.seq_len, steps=args.steps)
+
+    # Planner prediction of the optimizer state for the full-depth model
+    planner = MemoryPlanner(config['model_path'])
+    workload = workload_from_config(config, 'full')
+    for result in results:
+        workload['optimizer'] = result['optimizer']
+        result['predicted_state_bytes_full_model'] = planner.plan(**workload)['components']['optimizer_state']
+
+    print(f"\nMETRICS {'optimizer':<16} {'s/step':>8} {'state GB':>9} {'offloaded GB':>13} {'B/param':>8} {'planned GB (full)':>18}")
+    for result in results:
+        print(f"   {result['optimizer']:<16} {result['step_seconds']:>8.2f} {result['state_bytes'] / GB:>9.2f} "
+              f"{result['offloaded_bytes'] / GB:>13.2f} {result['state_bytes_per_parameter']:>8.2f} "
+              f"{result['predicted_state_bytes_full_model'] / GB:>18.2f}")
+    if args.layers:
+        print(f"\nIDEA Measured on {args.layers} of {planner.num_layers} layers ({parameters / 1e9:.2f}B parameters); "
+              f"planned figures are for the full model")
+
+    output_path = Path(args.output or Path(config['output_dir']) / 'optimizer_benchmark.json')
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump({'batch_size': args.batch_size, 'seq_len': args.seq_len, 'layers': args.layers or planner.num_layers,
+                   'parameters': parameters, 'results': results}, f, indent=2)
+    print(f"\nCOMPLETED Report saved: {output_path}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Token Cache Builder
+Renders and tokenizes the training corpus once so training runs start from a memory-mapped cache
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Build the token cache for the full or LoRA training configuration"""
+    parser = argparse.ArgumentParser(description="Build the pre-tokenized training cache")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON")
+    parser.add_argument("--lora", action="store_true",
+                        help="Build the cache for LoRA training (lora_max_length, default 512)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Preprocessing worker processes (default: config or all CPU cores)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Examples per preprocessing chunk (default: config or 256)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from transformers import AutoTokenizer
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    from vitalis.data.dataset import EmergencyReliefDataset
+
+    max_length = config.get('lora_max_length', 512) if args.lora else config['max_length']
+
+    cache_dir = config.get('token_cache_dir', str(Path(config['output_dir']) / 'token_cache'))
+
+    print("PROCESSING Loading tokenizer...")
+    tokenizer = AutoTokenizer.from_pretrained(
+        config['model_path'],
+        local_files_only=True,
+        trust_remote_code=True
+    )
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    print(f"PROCESSING Building token cache (max_length={max_length})...")
+    dataset = EmergencyReliefDataset(
+        data_path=config['data_path'],
+        tokenizer=tokenizer,
+        max_length=max_length,
+        backend='mmap',
+        cache_dir=cache_dir,
+        num_workers=args.workers if args.workers is not None else config.get('preprocessing_workers'),
+        chunk_size=args.chunk_size or config.get('preprocessing_chunk_size', 256),
+        rejects_path=config.get(
+            'preprocessing_rejects_path', str(Path(config['output_dir']) / 'preprocessing_rejects.jsonl')
+        )
+    )
+
+    print(f"COMPLETED Token cache ready: {len(dataset)} examples at {dataset.token_cache.cache_path}")
+    if 'token_cache_dir' not in config:
+        print(f"IDEA Set \"token_cache_dir\": \"{cache_dir}\" in {args.config} to train from this cache")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
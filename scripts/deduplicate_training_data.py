@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Training Data Deduplication
+Removes near-duplicate instruction/response pairs with MinHash LSH and reports the tokens saved
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Deduplicate the configured training data file"""
+    parser = argparse.ArgumentParser(description="Remove near-duplicate training examples")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON (data_path, model_path)")
+    parser.add_argument("--data", default=None, help="Training data file (default: config data_path)")
+    parser.add_argument("--output", default=None,
+                        help="Deduplicated output file (default: <data>.dedup.json next to the input)")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard similarity threshold")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash permutations")
+    parser.add_argument("--num-bands", type=int, default=16, help="LSH bands (must divide --num-perm)")
+    parser.add_argument("--shingle-size", type=int, default=5, help="Words per shingle")
+    parser.add_argument("--no-tokenizer", action="store_true",
+                        help="Count saved tokens by whitespace instead of loading the model tokenizer")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from vitalis.data.dedup import deduplicate_dataset, chat_token_counter
+
+    config = {}
+    if Path(args.config).exists():
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+
+    data_path = args.data or config.get('data_path')
+    if not data_path:
+        print("FAILED No training data file given (--data) and no data_path in the config")
+        return 1
+
+    data_file = Path(data_path)
+    output_path = args.output or str(data_file.with_name(f"{data_file.stem}.dedup.json"))
+    clusters_path = str(Path(output_path).with_suffix('.clusters.json'))
+
+    count_tokens = None
+    if not args.no_tokenizer and config.get('model_path'):
+        from transformers import AutoTokenizer
+        from vitalis.data.dataset import SYSTEM_PROMPT
+
+        print("PROCESSING Loading tokenizer...")
+        tokenizer = AutoTokenizer.from_pretrained(
+            config['model_path'],
+            local_files_only=True,
+            trust_remote_code=True
+        )
+        count_tokens = chat_token_counter(tokenizer, SYSTEM_PROMPT)
+
+    print(f"PROCESSING Deduplicating {data_path} (threshold {args.threshold})...")
+    stats = deduplicate_dataset(
+        data_path, output_path, clusters_path,
+        threshold=args.threshold, num_perm=args.num_perm, num_bands=args.num_bands,
+        shingle_size=args.shingle_size, count_tokens=count_tokens
+    )
+
+    print(f"COMPLETED Deduplicated data: {output_path}")
+    print(f"COMPLETED Clusters: {clusters_path}")
+    print(f"METRICS Examples: {stats['original_examples']} -> {stats['kept_examples']} "
+          f"({stats['removed_examples']} removed in {stats['clusters']} clusters)")
+    print(f"METRICS Tokens saved per epoch: {stats['tokens_saved']} of {stats['original_tokens']} "
+          f"({stats['token_count_method']})")
+    for category, counts in stats['categories'].items():
+        if counts['removed']:
+            print(f"METRICS   {category}: {counts['removed']}/{counts['examples']} removed")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
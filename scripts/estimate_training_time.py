@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Measured Training Time Estimate
+Times forward/backward and optimizer steps of the training configuration on this machine and
+extrapolates over the dataset's token lengths to an ETA, tokens/sec and peak memory with
+confidence bounds, for scheduling training windows on shared hardware
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Estimate training time for the full or LoRA training configuration"""
+    parser = argparse.ArgumentParser(description="Estimate training time, tokens/sec and peak memory from timed steps")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON")
+    parser.add_argument("--lora", action="store_true", help="Estimate the LoRA trainer's run instead of full fine-tuning")
+    parser.add_argument("--layers", type=int, default=None,
+                        help="Time randomly initialized proxies with the first N and 2N layers of the real config and "
+                             "extrapolate to full depth, instead of loading the weights")
+    parser.add_argument("--steps", type=int, default=5, help="Timed steps per probe length (after one warmup step)")
+    parser.add_argument("--lengths", type=int, default=4, help="Probe lengths across the micro-batch length distribution")
+    parser.add_argument("--confidence", type=float, default=0.9, help="Confidence level of the reported bounds")
+    parser.add_argument("--output", default=None,
+                        help="Report JSON path (default: <output_dir>/throughput_estimate.json)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from vitalis.training.throughput_estimator import dataset_token_lengths, estimate_from_config
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    mode = 'lora' if args.lora else 'full'
+
+    print(f"PROCESSING Tokenizing {config['data_path']} for the length distribution...")
+    lengths = dataset_token_lengths(config)
+    if not lengths:
+        print("FAILED No examples could be tokenized")
+        return 1
+
+    target = f"{args.layers}- and {2 * args.layers}-layer proxies" if args.layers else "the real model"
+    print(f"PROCESSING Timing {args.steps} steps at {args.lengths} lengths on {target}...")
+    report = estimate_from_config(config, mode, lengths, proxy_layers=args.layers, steps=args.steps,
+                                  num_lengths=args.lengths, confidence=args.confidence)
+
+    low, high = report['eta_bounds_hours']
+    print(f"\nMETRICS {mode} run: {report['train_examples']} training examples, {report['epochs']} epochs, "
+          f"{report['optimizer_steps']} optimizer steps ({report['batching_mode']} batching)")
+    print(f"   ETA: {report['eta_hours']:.1f} hours ({low:.1f}-{high:.1f} at {report['confidence']:.0%} confidence)")
+    print(f"   Tokens/sec: {report['tokens_per_second']:.0f} "
+          f"({report['tokens_per_second_bounds'][0]:.0f}-{report['tokens_per_second_bounds'][1]:.0f})")
+    print(f"   Peak memory: {report['peak_memory_gb']:.1f} GB "
+          f"({report['peak_memory_bounds_gb'][0]:.1f}-{report['peak_memory_bounds_gb'][1]:.1f}, "
+          f"incl. {report['reserve_gb']:.1f} GB planned optimizer state)")
+    if args.layers:
+        print(f"\nIDEA Extrapolated from {args.layers} and {2 * args.layers} of {report['num_layers']} layers "
+              f"with random weights")
+
+    output_path = Path(args.output or Path(config['output_dir']) / 'throughput_estimate.json')
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nCOMPLETED Report saved: {output_path}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
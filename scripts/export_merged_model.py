@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Merged Model Export
+Merges the emergency relief LoRA adapter into the base weights and writes a standalone
+sharded safetensors model, so serving runs without PEFT and its extra LoRA matmuls
+"""
+
+import sys
+import os
+import argparse
+import logging
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Merge, export and verify"""
+    parser = argparse.ArgumentParser(description="Merge a LoRA adapter into the base model and export it for serving")
+    parser.add_argument("--adapter", default="./models/emergency_relief_fine_tuned/emergency_relief_lora",
+                        help="Trained LoRA adapter directory")
+    parser.add_argument("--base-model", default=None,
+                        help="Base model directory (default: model_path from the adapter's training_config.json)")
+    parser.add_argument("--output", default="./models/emergency_relief_merged", help="Export directory")
+    parser.add_argument("--max-shard-size-gb", type=float, default=5.0, help="Maximum safetensors shard size")
+    parser.add_argument("--atol", type=float, default=0.1, help="Absolute logits tolerance")
+    parser.add_argument("--rtol", type=float, default=0.02, help="Relative logits tolerance")
+    parser.add_argument("--skip-verify", action="store_true", help="Do not compare logits with base model + adapter")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from vitalis.training.merge_export import export_merged_model
+
+    print(f"PROCESSING Merging {args.adapter} into its base model...")
+    try:
+        result = export_merged_model(
+            args.adapter, args.output, base_model_path=args.base_model,
+            max_shard_size=int(args.max_shard_size_gb * 1024**3), verify=not args.skip_verify,
+            atol=args.atol, rtol=args.rtol
+        )
+    except Exception as e:
+        print(f"FAILED Export failed: {e}")
+        return 1
+
+    print(f"COMPLETED Exported {result['total_bytes'] / 1024**3:.1f} GB in {len(result['files'])} files "
+          f"(experts: {result['experts']})")
+    print(f"FOLDER Merged model saved to: {result['output_dir']}")
+
+    if 'verification' in result:
+        check = result['verification']
+        print(f"METRICS Logits max |diff| {check['max_abs_diff']:.4f}, mean |diff| {check['mean_abs_diff']:.5f}, "
+              f"top-1 agreement {check['top1_agreement']:.1%}")
+        if not check['within_tolerance']:
+            print(f"FAILED {check['violation_fraction']:.3%} of logits exceed atol={check['atol']} + rtol={check['rtol']}")
+            return 1
+        print("COMPLETED Exported model matches base model + adapter within tolerance")
+
+    print("IDEA Serve it by pointing the base model path at the export and dropping PeftModel.from_pretrained")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
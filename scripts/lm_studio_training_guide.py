@@ -4,12 +4,16 @@ LM Studio Emergency Relief AI Training Guide
 Comprehensive setup and training workflow for GPT-OSS 20B emergency relief specialization
 """
 
+import sys
 import json
 import requests
 import time
 import os
 from pathlib import Path
 
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
 class LMStudioTrainingGuide:
     """
     Complete guide for training emergency relief AI using LM Studio
@@ -167,14 +171,14 @@ class LMStudioTrainingGuide:
         jsonl_path = "./data/emergency_relief_training.jsonl"
         
         try:
-            with open(self.training_data_path, 'r') as f:
-                data = json.load(f)
+            from vitalis.data.streaming import iter_training_examples
             
-            training_examples = data.get('training_data', [])
+            num_examples = 0
             
-            # Convert to JSONL format
+            # Convert to JSONL format, streaming one example at a time
             with open(jsonl_path, 'w') as f:
-                for example in training_examples:
+                for example in iter_training_examples(self.training_data_path):
+                    num_examples += 1
                     # Format for chat completion training
                     training_item = {
                         "messages": [
@@ -195,7 +199,7 @@ class LMStudioTrainingGuide:
                     f.write(json.dumps(training_item) + '\n')
             
             print(f"COMPLETED Created JSONL training file: {jsonl_path}")
-            print(f"   Contains {len(training_examples)} training conversations")
+            print(f"   Contains {num_examples} training conversations")
             
             print("\nCONFIG USE THIS FILE IN LM STUDIO:")
             print(f"   File path: {os.path.abspath(jsonl_path)}")
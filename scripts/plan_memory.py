@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Memory Planner
+Predicts peak RAM for training or serving GPT-OSS 20B from config.json and the
+safetensors index, without loading any weights
+"""
+
+import sys
+import os
+import json
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Print memory plans for the requested workload and the strategy that fits"""
+    parser = argparse.ArgumentParser(description="Predict peak memory before loading the model")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON (model_path, batch_size, max_length)")
+    parser.add_argument("--model-path", default=None, help="Model directory (default: config model_path)")
+    parser.add_argument("--mode", choices=["full", "lora", "serve"], default="full")
+    parser.add_argument("--dtype", action="append", default=None,
+                        help="Weight dtype to plan for; repeat to compare (default: bfloat16 and float32)")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--seq-len", type=int, default=None)
+    parser.add_argument("--lora-rank", type=int, default=None)
+    parser.add_argument("--lora-targets", default=None, help="Comma-separated LoRA target modules")
+    parser.add_argument("--no-gradient-checkpointing", action="store_true")
+    parser.add_argument("--checkpointing", default=None,
+                        help="Gradient checkpointing policy: all, none, moe_mlp, a layer type, or a JSON object "
+                             "(default: config gradient_checkpointing)")
+    parser.add_argument("--kv-cache-length", type=int, default=None,
+                        help="Context length held in the KV cache when serving (default: --seq-len)")
+    parser.add_argument("--budget-gb", type=float, default=None,
+                        help="Memory budget (default: available RAM, at most 85%% of total)")
+    parser.add_argument("--json", action="store_true", help="Print the plans as JSON")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    from vitalis.utils.memory_planner import (
+        MemoryPlanner, GB, available_memory_bytes, format_plan, select_strategy, workload_from_config
+    )
+
+    config = {}
+    if Path(args.config).exists():
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+
+    model_path = args.model_path or config.get('model_path', './models/gpt-oss-20b')
+    planner = MemoryPlanner(model_path)
+
+    default_seq_len = config.get('lora_max_length', 512) if args.mode == 'lora' else None
+    workload = workload_from_config(
+        config, args.mode,
+        batch_size=args.batch_size or (config.get('lora_batch_size', 1) if args.mode == 'lora' else None),
+        seq_len=args.seq_len or default_seq_len
+    )
+    if args.lora_rank is not None:
+        workload['lora_rank'] = args.lora_rank
+    if args.lora_targets:
+        workload['lora_targets'] = [t.strip() for t in args.lora_targets.split(',') if t.strip()]
+    if args.checkpointing:
+        policy = args.checkpointing
+        workload['gradient_checkpointing'] = json.loads(policy) if policy.lstrip().startswith('{') else policy
+    if args.no_gradient_checkpointing:
+        workload['gradient_checkpointing'] = False
+    if args.mode == 'serve':
+        workload = {k: workload[k] for k in ('mode', 'batch_size', 'seq_len')}
+        workload['kv_cache_length'] = args.kv_cache_length
+
+    dtypes = args.dtype or (['mxfp4', 'bfloat16'] if args.mode == 'serve' else ['bfloat16', 'float32'])
+    budget = int(args.budget_gb * GB) if args.budget_gb else available_memory_bytes()
+
+    strategies = [{'name': f"{args.mode} {dtype}", 'torch_dtype': dtype} for dtype in dtypes]
+    plans = [planner.plan(dtype=dtype, **workload) for dtype in dtypes]
+
+    chosen = select_strategy(planner, strategies, workload, budget)
+
+    if args.json:
+        print(json.dumps({'budget_bytes': budget, 'total_parameters': planner.total_parameters,
+                          'selected': chosen['name'] if chosen else None, 'plans': plans}, indent=2))
+        return 0 if chosen else 1
+
+    print(f"METRICS Model: {planner.total_parameters / 1e9:.1f}B parameters, "
+          f"checkpoint {planner.checkpoint_bytes() / GB:.1f} GB")
+    print(f"METRICS Memory budget: {budget / GB:.1f} GB")
+    for plan in plans:
+        lines = format_plan(plan)
+        print(f"\n{'FITS' if plan['peak_bytes'] <= budget else 'TOO LARGE'} {lines[0]}")
+        for line in lines[1:]:
+            print(line)
+
+    if chosen is None:
+        print("\nFAILED No configuration fits; reduce batch size or sequence length, use LoRA, "
+              "or enable gradient checkpointing")
+        return 1
+    print(f"\nCOMPLETED Selected strategy: {chosen['name']} ({chosen['plan']['peak_bytes'] / GB:.1f} GB)")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
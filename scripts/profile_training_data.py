@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Training Data Length Profiler
+Tokenizes the whole dataset with the real chat template and reports length histograms,
+truncation and padding waste, with a recommended max_length and batching mode
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Profile token lengths for the full or LoRA training configuration"""
+    parser = argparse.ArgumentParser(description="Profile token lengths and padding waste of the training data")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON")
+    parser.add_argument("--lora", action="store_true",
+                        help="Profile against the LoRA trainer settings (lora_max_length, default 512; lora_batch_size, default 1)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Preprocessing worker processes (default: config or all CPU cores)")
+    parser.add_argument("--bin-width", type=int, default=128, help="Histogram bin width in tokens")
+    parser.add_argument("--max-truncation", type=float, default=0.01,
+                        help="Largest acceptable fraction of truncated examples for the recommendation")
+    parser.add_argument("--output", default=None,
+                        help="Report JSON path (default: <output_dir>/length_profile.json)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from transformers import AutoTokenizer
+    from vitalis.data.streaming import iter_training_examples
+    from vitalis.data.dataset import SYSTEM_PROMPT
+    from vitalis.data.length_profile import collect_token_lengths, profile_dataset, format_histogram
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    if args.lora:
+        max_length, batch_size = config.get('lora_max_length', 512), config.get('lora_batch_size', 1)
+    else:
+        max_length, batch_size = config['max_length'], config['batch_size']
+
+    print("PROCESSING Loading tokenizer...")
+    tokenizer = AutoTokenizer.from_pretrained(
+        config['model_path'],
+        local_files_only=True,
+        trust_remote_code=True
+    )
+
+    print(f"PROCESSING Tokenizing {config['data_path']} with the chat template...")
+    collected = collect_token_lengths(
+        iter_training_examples(config['data_path']), tokenizer, SYSTEM_PROMPT,
+        num_workers=args.workers if args.workers is not None else config.get('preprocessing_workers'),
+        chunk_size=config.get('preprocessing_chunk_size', 256)
+    )
+    if not collected['lengths']:
+        print("FAILED No examples could be tokenized")
+        return 1
+
+    report = profile_dataset(
+        collected['lengths'], collected['categories'], max_length, batch_size,
+        bin_width=args.bin_width, max_truncation_rate=args.max_truncation
+    )
+    report['rejected_examples'] = collected['rejected']
+
+    overall = report['overall']
+    print(f"\nMETRICS Examples: {overall['examples']} ({collected['rejected']} rejected), tokens: {overall['tokens']}")
+    print(f"METRICS Length p50/p90/p99/max: {overall['p50']}/{overall['p90']}/{overall['p99']}/{overall['max']}")
+    for line in format_histogram(overall['histogram']):
+        print(f"   {line}")
+
+    for category, summary in report['categories'].items():
+        print(f"\nMETRICS {category}: {summary['examples']} examples, mean {summary['mean']:.0f}, "
+              f"p90 {summary['p90']}, max {summary['max']}, truncated {summary['truncation_rate']:.1%}")
+        for line in format_histogram(summary['histogram'], width=30):
+            print(f"   {line}")
+
+    configured = report['configured']
+    print(f"\nMETRICS At max_length {max_length} (batch size {batch_size}):")
+    print(f"   Truncation rate: {configured['truncation_rate']:.1%} "
+          f"({configured['truncated_tokens_lost']} tokens lost)")
+    for mode in ('fixed', 'bucketed', 'packed'):
+        print(f"   {mode:<9} pad fraction {configured['pad_fraction'][mode]:.1%}, "
+              f"{configured['real_tokens_per_step'][mode]:.0f} real tokens/step, "
+              f"{configured['steps_per_epoch'][mode]} steps/epoch")
+
+    recommendation = report['recommendation']
+    print(f"\nIDEA Recommended: \"max_length\": {recommendation['max_length']}, "
+          f"\"batching_mode\": \"{recommendation['batching_mode']}\", \"batch_size\": {recommendation['batch_size']}")
+    print(f"   {recommendation['real_tokens_per_step']:.0f} real tokens/step at the same "
+          f"{recommendation['token_budget_per_step']}-token step budget, "
+          f"pad fraction {recommendation['pad_fraction']:.1%}, truncation {recommendation['truncation_rate']:.1%}")
+
+    output_path = Path(args.output or Path(config['output_dir']) / 'length_profile.json')
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nCOMPLETED Report saved: {output_path}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+LoRA Hyperparameter Sweep
+Trains one adapter per configuration against a single loaded base model and prints a
+leaderboard of eval loss, tokens/sec and peak memory
+"""
+
+import sys
+import os
+import json
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Run a LoRA sweep and report the leaderboard"""
+    parser = argparse.ArgumentParser(description="LoRA hyperparameter sweep that loads the base model once")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON (shared by every trial)")
+    parser.add_argument("--sweep", required=True,
+                        help='Sweep JSON: {"base": {...}, "trials": [{"name": ..., "lora_r": 16}], '
+                             '"grid": {"lora_r": [8, 16], "lora_learning_rate": [1e-4, 2e-4]}}')
+    parser.add_argument("--output-dir", default=None, help="Sweep directory (default: <output_dir>/sweep)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    from vitalis.training.lora_sweep import expand_sweep, run_lora_sweep, format_leaderboard
+
+    with open(args.sweep, 'r') as f:
+        spec = json.load(f)
+
+    trials = expand_sweep(spec)
+    print(f"LAUNCH Sweeping {len(trials)} LoRA configurations on one base model...")
+    try:
+        leaderboard = run_lora_sweep(args.config, spec, args.output_dir)
+    except Exception as e:
+        print(f"FAILED Sweep failed: {e}")
+        return 1
+
+    print("\nMETRICS Leaderboard (by eval loss)")
+    for line in format_leaderboard(leaderboard):
+        print(f"   {line}")
+
+    with open(args.config, 'r') as f:
+        output_dir = args.output_dir or str(Path(json.load(f)['output_dir']) / 'sweep')
+    print(f"\nFOLDER Leaderboard saved to: {output_dir}/leaderboard.json")
+    return 0 if any(r['status'] == 'completed' for r in leaderboard) else 1
+
+if __name__ == "__main__":
+    exit(main())
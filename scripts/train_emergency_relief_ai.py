@@ -8,6 +8,7 @@ import sys
 import os
 import json
 import logging
+import argparse
 from pathlib import Path
 
 # Add src to path for imports
@@ -65,19 +66,21 @@ def check_prerequisites():
     print("COMPLETED Prerequisites check completed")
     return True
 
-def estimate_training_time():
-    """Estimate training time based on system and data"""
+def estimate_training_time(measure: bool = False, proxy_layers: int = 2):
+    """Estimate training time from the example count, or with measure from timed proxy steps"""
     try:
-        # Load training data to count examples
-        with open("./data/ENHANCED_EMERGENCY_RELIEF_TRAINING_DATA.json", 'r') as f:
-            data = json.load(f)
-        
-        num_examples = len(data.get('training_data', []))
-        
         # Load config for training parameters
         with open("./config/emergency_relief_training_config.json", 'r') as f:
             config = json.load(f)
         
+        if measure:
+            return measured_training_time(config, proxy_layers)
+        
+        from vitalis.data.streaming import count_examples
+        
+        # Count examples with a streaming pass instead of loading the corpus
+        num_examples = count_examples(config.get('data_path', "./data/ENHANCED_EMERGENCY_RELIEF_TRAINING_DATA.json"))
+        
         epochs = config.get('num_epochs', 3)
         batch_size = config.get('batch_size', 1)
         grad_accum = config.get('gradient_accumulation_steps', 4)
@@ -96,15 +99,41 @@ def estimate_training_time():
         print(f"   Steps per epoch: {steps_per_epoch}")
         print(f"   Total steps: {total_steps}")
         print(f"   Estimated time: {total_time_hours:.1f} hours")
+        print("IDEA Use --measure (or scripts/estimate_training_time.py) for a measured estimate")
         
-        return total_time_hours
+        return {'eta_hours': total_time_hours}
         
     except Exception as e:
         print(f"WARNING  Could not estimate training time: {e}")
         return None
 
+def measured_training_time(config, proxy_layers):
+    """Timed steps of randomly initialized proxy models, extrapolated to full depth"""
+    from vitalis.training.throughput_estimator import dataset_token_lengths, estimate_from_config
+    
+    print(f"PROCESSING Timing {proxy_layers}- and {2 * proxy_layers}-layer proxies of the model...")
+    report = estimate_from_config(config, 'full', dataset_token_lengths(config), proxy_layers=proxy_layers)
+    
+    low, high = report['eta_bounds_hours']
+    print(f"METRICS Training estimation:")
+    print(f"   Examples: {report['train_examples']}")
+    print(f"   Epochs: {report['epochs']}")
+    print(f"   Total steps: {report['optimizer_steps']}")
+    print(f"   Tokens/sec: {report['tokens_per_second']:.0f}")
+    print(f"   Peak memory: {report['peak_memory_gb']:.1f} GB")
+    print(f"   Estimated time: {report['eta_hours']:.1f} hours ({low:.1f}-{high:.1f})")
+    return report
+
 def main():
     """Main training launcher"""
+    parser = argparse.ArgumentParser(description="Launch the full fine-tuning pipeline")
+    parser.add_argument("--measure", action="store_true",
+                        help="Estimate training time from timed steps of layer-subset proxy models "
+                             "(tokenizes the corpus and builds the proxies before training)")
+    parser.add_argument("--proxy-layers", type=int, default=2,
+                        help="Layers of the smaller proxy for --measure (the larger has twice as many)")
+    args = parser.parse_args()
+    
     print("LAUNCH EMERGENCY RELIEF AI TRAINING LAUNCHER")
     print("=" * 60)
     
@@ -119,15 +148,18 @@ def main():
         return 1
     
     # Estimate training time
-    estimated_time = estimate_training_time()
+    estimated_time = estimate_training_time(args.measure, args.proxy_layers)
     
     # Confirm before starting
     print("\n" + "=" * 60)
     print("TARGET READY TO START TRAINING")
     print("=" * 60)
     
-    if estimated_time:
-        print(f"TIME  Estimated training time: {estimated_time:.1f} hours")
+    if estimated_time and 'eta_bounds_hours' in estimated_time:
+        low, high = estimated_time['eta_bounds_hours']
+        print(f"TIME  Estimated training time: {estimated_time['eta_hours']:.1f} hours ({low:.1f}-{high:.1f})")
+    elif estimated_time:
+        print(f"TIME  Estimated training time: {estimated_time['eta_hours']:.1f} hours")
     
     print("CHECKLIST What will happen:")
     print("   1. Load GPT-OSS 20B model")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Data-Parallel LoRA Training Launcher
+Runs LoRA training on several gloo ranks on one CPU server; the frozen base weights are
+memory-mapped from one shared file instead of being loaded by every rank
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Plan memory for N ranks, export the shared base weights once and launch the ranks"""
+    parser = argparse.ArgumentParser(description="CPU data-parallel LoRA training over gloo")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON")
+    parser.add_argument("--nproc", type=int, default=2, help="Number of data-parallel ranks")
+    parser.add_argument("--threads-per-rank", type=int, default=None,
+                        help="torch threads per rank (default: CPU cores / ranks)")
+    parser.add_argument("--master-port", type=int, default=None, help="Rendezvous port (default: a free port)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from vitalis.training.data_parallel import launch_data_parallel
+    from vitalis.utils.memory_planner import MemoryPlanner, GB, available_memory_bytes, workload_from_config
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    if config.get('packed_experts', False):
+        print("FAILED packed_experts is not supported with data-parallel training; "
+              "disable it or use train_lora_emergency_relief.py")
+        return 1
+
+    # Weights are shared; gradients, optimizer state and activations are per rank
+    if config.get('memory_plan', True):
+        planner = MemoryPlanner(config['model_path'])
+        plan = planner.plan(dtype='bfloat16', **workload_from_config(
+            config, 'lora', batch_size=config.get('lora_batch_size', 1), seq_len=config.get('lora_max_length', 512)
+        ))
+        shared = plan['components']['weights']
+        total = shared + args.nproc * (plan['peak_bytes'] - shared)
+        budget = int(config['memory_budget_gb'] * GB) if 'memory_budget_gb' in config else available_memory_bytes()
+        print(f"METRICS Memory plan: {shared / GB:.1f} GB shared weights + {args.nproc} x "
+              f"{(plan['peak_bytes'] - shared) / GB:.1f} GB per rank = {total / GB:.1f} GB of {budget / GB:.1f} GB")
+        if total > budget:
+            print("FAILED Predicted peak exceeds available memory; use fewer ranks")
+            return 1
+
+    print(f"LAUNCH Starting {args.nproc} data-parallel LoRA ranks...")
+    try:
+        result = launch_data_parallel(args.config, args.nproc, args.threads_per_rank, args.master_port)
+    except Exception as e:
+        print(f"FAILED Data-parallel training failed: {e}")
+        return 1
+
+    print(f"COMPLETED {result['num_processes']} ranks x {result['threads_per_rank']} threads "
+          f"finished in {result['seconds'] / 60:.1f} min")
+    print(f"FOLDER LoRA adapter saved to: {config['output_dir']}/emergency_relief_lora")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
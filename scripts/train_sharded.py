@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Sharded Full Fine-Tuning Launcher
+Runs EmergencyReliefTrainer on several gloo ranks on this machine with parameters, gradients
+and optimizer state partitioned ZeRO-3 style; for several hosts run train_emergency_relief_ai.py
+under torchrun with zero_sharding set in the training config
+"""
+
+import sys
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+def main():
+    """Plan per-rank memory and launch the sharded ranks"""
+    parser = argparse.ArgumentParser(description="ZeRO-3 sharded full fine-tuning over gloo")
+    parser.add_argument("--config", default="./config/emergency_relief_training_config.json",
+                        help="Training configuration JSON")
+    parser.add_argument("--nproc", type=int, default=2, help="Number of sharded ranks")
+    parser.add_argument("--threads-per-rank", type=int, default=None,
+                        help="torch threads per rank (default: CPU cores / ranks)")
+    parser.add_argument("--master-port", type=int, default=None, help="Rendezvous port (default: a free port)")
+    args = parser.parse_args()
+
+    # Change to project root directory
+    project_root = Path(__file__).parent.parent
+    os.chdir(project_root)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from vitalis.training.zero_sharding import launch_sharded_training
+    from vitalis.utils.memory_planner import MemoryPlanner, GB, available_memory_bytes, workload_from_config
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    # Weights, gradients and optimizer state are split across ranks; activations are per rank
+    if config.get('memory_plan', True):
+        planner = MemoryPlanner(config['model_path'])
+        plan = planner.plan(dtype='bfloat16', **workload_from_config(config, 'full'))
+        components = plan['components']
+        sharded = components['weights'] + components['gradients'] + components['optimizer_state']
+        per_rank = sharded / args.nproc + (plan['peak_bytes'] - sharded)
+        total = args.nproc * per_rank
+        budget = int(config['memory_budget_gb'] * GB) if 'memory_budget_gb' in config else available_memory_bytes()
+        print(f"METRICS Memory plan: {sharded / GB:.1f} GB sharded over {args.nproc} ranks + "
+              f"{(plan['peak_bytes'] - sharded) / GB:.1f} GB per rank = {total / GB:.1f} GB of {budget / GB:.1f} GB")
+        if total > budget:
+            print("FAILED Predicted peak exceeds available memory on this host; spread the ranks over more hosts")
+            return 1
+
+    print(f"LAUNCH Starting {args.nproc} sharded full fine-tuning ranks...")
+    try:
+        result = launch_sharded_training(args.config, args.nproc, args.threads_per_rank, args.master_port)
+    except Exception as e:
+        print(f"FAILED Sharded training failed: {e}")
+        return 1
+
+    print(f"COMPLETED {result['num_processes']} ranks x {result['threads_per_rank']} threads "
+          f"finished in {result['seconds'] / 60:.1f} min")
+    print(f"FOLDER Model saved to: {config['output_dir']}/emergency_relief_model")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
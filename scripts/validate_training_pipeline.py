@@ -11,6 +11,9 @@ import logging
 from pathlib import Path
 import importlib.util
 
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
 def check_python_environment():
     """Check Python environment and dependencies"""
     print(" Checking Python Environment...")
@@ -113,31 +116,45 @@ def check_training_data():
         return False
     
     try:
-        with open(data_file, 'r') as f:
-            data = json.load(f)
+        from vitalis.data.streaming import iter_training_examples, read_metadata
+        
+        metadata = read_metadata(str(data_file))
+        required_keys = ['instruction', 'response']
         
-        training_examples = data.get('training_data', [])
-        metadata = data.get('metadata', {})
+        # Single streaming pass: bounded memory regardless of corpus size
+        num_examples = 0
+        total_instruction_length = 0
+        total_response_length = 0
+        
+        for example in iter_training_examples(str(data_file)):
+            if num_examples == 0:
+                for key in required_keys:
+                    if key in example:
+                        print(f"COMPLETED Example structure: {key}")
+                    else:
+                        print(f"FAILED Missing key in examples: {key}")
+                        return False
+            
+            num_examples += 1
+            total_instruction_length += len(example.get('instruction', ''))
+            total_response_length += len(example.get('response', ''))
         
         print(f"COMPLETED Training data loaded")
-        print(f"METRICS Examples: {len(training_examples)}")
+        print(f"METRICS Examples: {num_examples}")
         print(f"METRICS Categories: {len(metadata.get('categories', []))}")
         
-        # Check data structure
-        if training_examples:
-            example = training_examples[0]
-            required_keys = ['instruction', 'response']
-            
-            for key in required_keys:
-                if key in example:
-                    print(f"COMPLETED Example structure: {key}")
-                else:
-                    print(f"FAILED Missing key in examples: {key}")
-                    return False
+        # Present when the file was produced by scripts/deduplicate_training_data.py
+        dedup = metadata.get('deduplication')
+        if dedup:
+            print(f"METRICS Deduplicated: {dedup['removed_examples']} near-duplicates removed "
+                  f"from {dedup['original_examples']}, {dedup['tokens_saved']} tokens saved")
+            for category, counts in dedup.get('categories', {}).items():
+                if counts['removed']:
+                    print(f"METRICS   {category}: {counts['removed']}/{counts['examples']} removed")
         
         # Estimate training data quality
-        avg_instruction_length = sum(len(ex.get('instruction', '')) for ex in training_examples[:10]) / min(10, len(training_examples))
-        avg_response_length = sum(len(ex.get('response', '')) for ex in training_examples[:10]) / min(10, len(training_examples))
+        avg_instruction_length = total_instruction_length / max(num_examples, 1)
+        avg_response_length = total_response_length / max(num_examples, 1)
         
         print(f"METRICS Avg instruction length: {avg_instruction_length:.0f} chars")
         print(f"METRICS Avg response length: {avg_response_length:.0f} chars")
@@ -147,8 +164,8 @@ def check_training_data():
         
         return True
         
-    except json.JSONDecodeError:
-        print("FAILED Training data is not valid JSON")
+    except ValueError as e:
+        print(f"FAILED Training data is not valid JSON: {e}")
         return False
     except Exception as e:
         print(f"FAILED Error checking training data: {e}")
@@ -309,6 +326,98 @@ def check_training_scripts():
     
     return True
 
+def check_chunked_loss():
+    """Check that the chunked loss matches the reference loss on a tiny model"""
+    print("\nTEST Checking Chunked Loss Equivalence...")
+    
+    try:
+        from vitalis.training.chunked_loss import verify_chunked_loss
+        
+        result = verify_chunked_loss()
+        print(f"METRICS Reference loss: {result['reference_loss']:.6f}")
+        print(f"METRICS Chunked loss: {result['chunked_loss']:.6f}")
+        print(f"METRICS Max lm_head gradient difference: {result['grad_max_abs_diff']:.2e}")
+        
+        if result['loss_abs_diff'] > 1e-4 or result['grad_max_abs_diff'] > 1e-5:
+            print("FAILED Chunked loss does not match the reference implementation")
+            return False
+        
+        print("COMPLETED Chunked loss matches the reference implementation")
+        return True
+        
+    except Exception as e:
+        print(f"FAILED Error checking chunked loss: {e}")
+        return False
+
+def check_prefix_cache():
+    """Check that training on cached prefix activations matches the full forward pass on a tiny model"""
+    print("\nTEST Checking Prefix Activation Cache Equivalence...")
+    
+    try:
+        from vitalis.training.prefix_cache import verify_prefix_cache
+        
+        result = verify_prefix_cache()
+        print(f"METRICS Full forward loss: {result['reference_loss']:.6f}")
+        print(f"METRICS Cached prefix loss: {result['cached_loss']:.6f}")
+        print(f"METRICS Max suffix gradient difference: {result['grad_max_abs_diff']:.2e}")
+        
+        if result['loss_abs_diff'] > 1e-4 or result['grad_max_abs_diff'] > 1e-5:
+            print("FAILED Cached prefix activations do not reproduce the full forward pass")
+            return False
+        
+        print("COMPLETED Cached prefix activations reproduce the full forward pass")
+        return True
+        
+    except Exception as e:
+        print(f"FAILED Error checking prefix cache: {e}")
+        return False
+
+def check_packed_experts():
+    """Check that packed MXFP4 experts match dequantized experts on a tiny config"""
+    print("\nTEST Checking Packed MXFP4 Experts...")
+    
+    try:
+        from vitalis.training.mxfp4_experts import verify_packed_experts
+        
+        result = verify_packed_experts()
+        print(f"METRICS Max output difference: {result['output_max_abs_diff']:.2e}")
+        print(f"METRICS Max input gradient difference: {result['grad_max_abs_diff']:.2e}")
+        print(f"METRICS MXFP4 round-trip difference: {result['roundtrip_max_abs_diff']:.2e}")
+        
+        if max(result.values()) > 1e-5:
+            print("FAILED Packed experts do not match dequantized experts")
+            return False
+        
+        print("COMPLETED Packed experts match dequantized experts")
+        return True
+        
+    except Exception as e:
+        print(f"FAILED Error checking packed experts: {e}")
+        return False
+
+def check_sharded_training():
+    """Check that sharded training on localhost gloo ranks reproduces unsharded losses on a tiny config"""
+    print("\nTEST Checking ZeRO-3 Sharded Training...")
+    
+    try:
+        from vitalis.training.zero_sharding import verify_sharded_training
+        
+        result = verify_sharded_training()
+        print(f"METRICS Unsharded losses: {', '.join(f'{loss:.6f}' for loss in result['reference_losses'])}")
+        print(f"METRICS Sharded losses ({result['world_size']} ranks): {', '.join(f'{loss:.6f}' for loss in result['sharded_losses'])}")
+        print(f"METRICS Parameters held per rank: {result['shard_fraction']:.1%}")
+        
+        if result['loss_max_abs_diff'] > 1e-5:
+            print("FAILED Sharded training does not reproduce the unsharded losses")
+            return False
+        
+        print("COMPLETED Sharded training reproduces the unsharded losses")
+        return True
+        
+    except Exception as e:
+        print(f"FAILED Error checking sharded training: {e}")
+        return False
+
 def main():
     """Main validation function"""
     print("SEARCH EMERGENCY RELIEF AI TRAINING PIPELINE VALIDATION")
@@ -327,7 +436,11 @@ def main():
         ("Configuration", check_configuration),
         ("System Resources", check_system_resources),
         ("Output Directories", check_output_directories),
-        ("Training Scripts", check_training_scripts)
+        ("Training Scripts", check_training_scripts),
+        ("Chunked Loss", check_chunked_loss),
+        ("Prefix Activation Cache", check_prefix_cache),
+        ("Packed MXFP4 Experts", check_packed_experts),
+        ("Sharded Training", check_sharded_training)
     ]
     
     passed_checks = 0
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Length-Aware Batching
+Groups examples of similar token length into batches and pads each batch only to its
+longest sequence instead of the configured max_length
+"""
+
+import math
+import torch
+from torch.utils.data import Sampler, Subset
+from typing import Dict, Iterator, List, Optional
+
+
+def subset_lengths(dataset) -> List[int]:
+    """Token lengths for a dataset or a (possibly nested) random_split Subset of one"""
+    if isinstance(dataset, Subset):
+        base_lengths = subset_lengths(dataset.dataset)
+        return [base_lengths[i] for i in dataset.indices]
+    return [int(length) for length in dataset.lengths]
+
+
+def subset_categories(dataset) -> List[str]:
+    """Metadata category of every example in a dataset or a (possibly nested) Subset of one"""
+    if isinstance(dataset, Subset):
+        base_categories = subset_categories(dataset.dataset)
+        return [base_categories[i] for i in dataset.indices]
+    return list(dataset.categories)
+
+
+def _round_up(value: int, multiple: Optional[int]) -> int:
+    if not multiple:
+        return value
+    return int(math.ceil(value / multiple) * multiple)
+
+
+class LengthGroupedBatchSampler(Sampler):
+    """
+    Batch sampler that shuffles examples, sorts them by length inside large
+    "megabatch" windows and then shuffles the resulting batches
+
+    Batches stay random across the epoch while each one holds sequences of
+    similar length, so dynamic padding has little left to pad
+    """
+
+    def __init__(self, lengths: List[int], batch_size: int, shuffle: bool = True,
+                 megabatch_multiplier: int = 50, drop_last: bool = False, seed: int = 42):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.megabatch_size = batch_size * megabatch_multiplier
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _plan_batches(self, epoch: int) -> List[List[int]]:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+
+        num_examples = len(self.lengths)
+        if self.shuffle:
+            indices = torch.randperm(num_examples, generator=generator).tolist()
+        else:
+            indices = list(range(num_examples))
+
+        batches = []
+        for start in range(0, num_examples, self.megabatch_size):
+            megabatch = sorted(indices[start:start + self.megabatch_size],
+                               key=lambda i: self.lengths[i], reverse=True)
+            for batch_start in range(0, len(megabatch), self.batch_size):
+                batches.append(megabatch[batch_start:batch_start + self.batch_size])
+
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=generator).tolist()
+            batches = [batches[i] for i in order]
+
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._plan_batches(self.epoch)
+        # Advance on our own in case the dataloader wrapper never calls set_epoch
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return int(math.ceil(len(self.lengths) / self.batch_size))
+
+    def padding_stats(self, max_length: int, pad_to_multiple_of: Optional[int] = None) -> Dict[str, float]:
+        """
+        Compare the tokens processed per epoch under fixed max_length padding with
+        the tokens processed by this sampler plus dynamic padding
+        """
+        batches = self._plan_batches(0)
+        real_tokens = sum(min(self.lengths[i], max_length) for batch in batches for i in batch)
+        fixed_tokens = sum(len(batch) for batch in batches) * max_length
+        dynamic_tokens = sum(
+            len(batch) * min(_round_up(max(self.lengths[i] for i in batch), pad_to_multiple_of), max_length)
+            for batch in batches if batch
+        )
+
+        return {
+            'real_tokens': real_tokens,
+            'fixed_padded_tokens': fixed_tokens,
+            'dynamic_padded_tokens': dynamic_tokens,
+            'fixed_pad_fraction': 1 - real_tokens / fixed_tokens if fixed_tokens else 0.0,
+            'dynamic_pad_fraction': 1 - real_tokens / dynamic_tokens if dynamic_tokens else 0.0,
+            'padding_eliminated': 1 - dynamic_tokens / fixed_tokens if fixed_tokens else 0.0,
+        }
+
+
+class GroupedBatchSampler(Sampler):
+    """
+    Batches that never mix groups (e.g. the adapter each example trains)
+
+    Each group is batched by its own LengthGroupedBatchSampler (or in random order when
+    no lengths are given) and the batches of all groups are shuffled together, so every
+    group keeps appearing throughout the epoch
+    """
+
+    def __init__(self, groups: List[int], batch_size: int, lengths: Optional[List[int]] = None,
+                 shuffle: bool = True, seed: int = 42):
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        lengths = list(lengths) if lengths is not None else [0] * len(groups)
+        self.members: Dict[int, List[int]] = {}
+        for position, group in enumerate(groups):
+            self.members.setdefault(group, []).append(position)
+        self.samplers = {
+            group: LengthGroupedBatchSampler([lengths[i] for i in positions], batch_size, shuffle=shuffle, seed=seed + group)
+            for group, positions in self.members.items()
+        }
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _plan_batches(self, epoch: int) -> List[List[int]]:
+        batches = []
+        for group, sampler in self.samplers.items():
+            positions = self.members[group]
+            batches.extend([positions[i] for i in batch] for batch in sampler._plan_batches(epoch))
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + epoch)
+            order = torch.randperm(len(batches), generator=generator).tolist()
+            batches = [batches[i] for i in order]
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._plan_batches(self.epoch)
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        return sum(len(sampler) for sampler in self.samplers.values())
+
+
+class DynamicPaddingCollator:
+    """
+    Pads a batch of unpadded examples to its longest sequence
+    Padded label positions are set to -100 so they never contribute to the loss
+    """
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: Optional[int] = 8,
+                 label_pad_token_id: int = -100, padding_side: str = 'right'):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.label_pad_token_id = label_pad_token_id
+        self.padding_side = padding_side
+
+    def __call__(self, features: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        batch_size = len(features)
+        max_length = _round_up(max(len(f['input_ids']) for f in features), self.pad_to_multiple_of)
+
+        input_ids = torch.full((batch_size, max_length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, max_length), dtype=torch.long)
+        labels = torch.full((batch_size, max_length), self.label_pad_token_id, dtype=torch.long)
+
+        for row, feature in enumerate(features):
+            length = len(feature['input_ids'])
+            if self.padding_side == 'left':
+                span = slice(max_length - length, max_length)
+            else:
+                span = slice(0, length)
+
+            input_ids[row, span] = torch.as_tensor(feature['input_ids'], dtype=torch.long)
+            attention_mask[row, span] = torch.as_tensor(feature.get('attention_mask', 1), dtype=torch.long)
+            labels[row, span] = torch.as_tensor(feature.get('labels', feature['input_ids']), dtype=torch.long)
+
+        labels.masked_fill_(attention_mask == 0, self.label_pad_token_id)
+
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'labels': labels
+        }
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Emergency Relief Training Dataset
+Single map-style dataset shared by the full fine-tuning and LoRA trainers, backed by
+either in-memory preprocessed examples or the memory-mapped token cache
+"""
+
+import logging
+from torch.utils.data import Dataset
+from typing import Dict, Iterable, List, Optional
+
+from vitalis.data.dedup import example_category, example_hash
+from vitalis.data.preprocessing import PreprocessingEngine, build_encoding
+from vitalis.data.streaming import iter_training_examples
+from vitalis.data.token_cache import load_or_build_token_cache
+
+SYSTEM_PROMPT = (
+    "You are an expert emergency relief coordinator. Provide detailed, "
+    "actionable guidance for disaster response, resource coordination, "
+    "and emergency management. Always prioritize safety and follow "
+    "established protocols."
+)
+
+# Map-style backends; 'streaming' is served by StreamingEmergencyReliefDataset instead
+BACKENDS = ('memory', 'mmap')
+
+
+class InMemoryBackend:
+    """
+    Encoded examples held in process memory
+    Exposes the same lengths/source_indices/token_ids/prompt_length interface as TokenCache
+    """
+
+    def __init__(self, examples: Iterable[Dict], tokenizer, system_prompt: str, max_length: int,
+                 compute_prompt_lengths: bool = False, **preprocessing_args):
+        engine = PreprocessingEngine(
+            tokenizer, system_prompt, max_length, compute_prompt_lengths=compute_prompt_lengths,
+            **preprocessing_args
+        )
+        self.records = engine.run(examples)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def lengths(self) -> List[int]:
+        return [len(record['input_ids']) for record in self.records]
+
+    @property
+    def source_indices(self) -> List[int]:
+        return [record['index'] for record in self.records]
+
+    def token_ids(self, idx: int) -> List[int]:
+        return self.records[idx]['input_ids']
+
+    def prompt_length(self, idx: int) -> int:
+        return self.records[idx]['prompt_length']
+
+
+class EmergencyReliefDataset(Dataset):
+    """
+    Custom dataset for emergency relief training data
+    Handles conversation format and proper tokenization
+
+    backend='memory' preprocesses every example in parallel into process memory;
+    backend='mmap' renders and tokenizes once into the token cache under cache_dir
+    and memory-maps it. Items are fixed-length when pad_to_max_length is set and
+    unpadded (for the padding and packing collators) otherwise
+    """
+
+    SYSTEM_PROMPT = SYSTEM_PROMPT
+
+    def __init__(self, data_path: str, tokenizer, max_length: int = 1024, backend: Optional[str] = None,
+                 cache_dir: Optional[str] = None, pad_to_max_length: bool = True,
+                 assistant_only_loss: bool = False, system_prompt: str = SYSTEM_PROMPT,
+                 num_workers: Optional[int] = None, chunk_size: int = 256, rejects_path: Optional[str] = None):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.pad_to_max_length = pad_to_max_length
+        self.assistant_only_loss = assistant_only_loss
+        self.system_prompt = system_prompt
+        self.backend_name = backend or ('mmap' if cache_dir else 'memory')
+        if self.backend_name not in BACKENDS:
+            raise ValueError(f"Unknown dataset backend '{self.backend_name}', expected one of {BACKENDS}")
+
+        # Load training data (JSON document or JSONL, read incrementally)
+        examples = list(iter_training_examples(data_path))
+        preprocessing_args = {'num_workers': num_workers, 'chunk_size': chunk_size, 'rejects_path': rejects_path}
+
+        if self.backend_name == 'mmap':
+            if not cache_dir:
+                raise ValueError("The 'mmap' backend needs a cache_dir")
+            self.backend = load_or_build_token_cache(
+                data_path, examples, tokenizer, system_prompt, max_length, cache_dir, **preprocessing_args
+            )
+        else:
+            self.backend = InMemoryBackend(
+                examples, tokenizer, system_prompt, max_length,
+                compute_prompt_lengths=assistant_only_loss, **preprocessing_args
+            )
+
+        # Metadata category of every encoded example (rejected examples have no row)
+        self.categories = [example_category(examples[int(i)]) for i in self.backend.source_indices]
+        # Content hash of every encoded example, matched against incremental training manifests
+        self.content_hashes = [example_hash(examples[int(i)]) for i in self.backend.source_indices]
+
+        logging.info(f"Loaded {len(self)} training examples ({self.backend_name} backend)")
+
+    @property
+    def token_cache(self):
+        """The TokenCache behind the 'mmap' backend, else None"""
+        return self.backend if self.backend_name == 'mmap' else None
+
+    def __len__(self):
+        return len(self.backend)
+
+    @property
+    def lengths(self) -> List[int]:
+        """Token length of every example after truncation, used for length-aware batching"""
+        lengths = self.backend.lengths
+        return lengths.tolist() if hasattr(lengths, 'tolist') else lengths
+
+    def __getitem__(self, idx):
+        return build_encoding(
+            self.backend.token_ids(idx), self.tokenizer.pad_token_id, self.max_length,
+            self.pad_to_max_length, self.tokenizer.padding_side,
+            self.backend.prompt_length(idx) if self.assistant_only_loss else None
+        )
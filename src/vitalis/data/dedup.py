@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Detection for Training Corpora
+Shingled MinHash signatures with banded LSH find near-identical instruction/response pairs
+in sub-quadratic time; each cluster keeps its first example and the rest are dropped
+"""
+
+import re
+import json
+import hashlib
+import logging
+import time
+import numpy as np
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from vitalis.data.streaming import iter_training_examples, read_metadata
+
+# Universal hashing modulo a Mersenne prime, truncated to 32 bits (as in datasketch)
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def example_category(example: Dict) -> str:
+    """Category of an example from its metadata, falling back to a top-level field"""
+    metadata = example.get('metadata') or {}
+    return metadata.get('category') or example.get('category') or 'uncategorized'
+
+
+def example_hash(example: Dict) -> str:
+    """Content hash of an example, independent of key order and of its position in the file"""
+    encoded = json.dumps(example, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def shingles(text: str, size: int = 5) -> List[str]:
+    """Word n-gram shingles of the case-folded, punctuation-stripped text"""
+    words = _WHITESPACE.split(_NON_WORD.sub(' ', text.lower()).strip())
+    words = [word for word in words if word]
+    if len(words) <= size:
+        return [' '.join(words)]
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+class MinHasher:
+    """Fixed set of num_perm hash permutations shared by every signature"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = generator.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, tokens: Iterable[str]) -> np.ndarray:
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(t.encode('utf-8'), digest_size=4).digest(), 'little') for t in tokens],
+            dtype=np.uint64
+        )
+        if hashes.size == 0:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint32)
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, num_bands: int,
+                        find: Optional[Callable[[int], int]] = None) -> Iterable[Tuple[int, int]]:
+    """
+    Pairs of rows that collide in at least one band
+    Each band of rows_per_band minhash values is bucketed by its bytes, so only
+    examples sharing a bucket are ever compared. find maps a row to its cluster as the
+    caller links pairs; rows already in one cluster are not paired again
+    """
+    find = find or (lambda index: index)
+    num_examples, num_perm = signatures.shape
+    rows_per_band = num_perm // num_bands
+    for band in range(num_bands):
+        buckets = defaultdict(list)
+        band_values = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        for index in range(num_examples):
+            buckets[band_values[index].tobytes()].append(index)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            # Each member is compared with one member of every cluster already in the bucket and
+            # stops at the first it joins, so a bucket of duplicates costs one comparison per member
+            # while a dissimilar member still starts its own cluster for the others
+            representatives = []
+            for index in members:
+                for representative in representatives:
+                    if find(representative) != find(index):
+                        yield representative, index
+                    if find(representative) == find(index):
+                        break
+                else:
+                    representatives.append(index)
+
+
+class _UnionFind:
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, x: int, y: int):
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x != root_y:
+            # The lower index stays the root so clusters keep their first occurrence
+            self.parent[max(root_x, root_y)] = min(root_x, root_y)
+
+
+def find_near_duplicates(examples: Iterable[Dict], threshold: float = 0.8, num_perm: int = 128,
+                         num_bands: int = 16, shingle_size: int = 5, seed: int = 1) -> Dict:
+    """
+    Cluster near-duplicate examples
+
+    Candidates come from banded LSH; a pair is linked when its estimated Jaccard
+    similarity is at least threshold. Returns the clusters (first index kept) and
+    per-example categories, with only the signatures held in memory
+    """
+    if num_perm % num_bands:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by num_bands ({num_bands})")
+
+    hasher = MinHasher(num_perm, seed)
+    signatures, categories = [], []
+    for example in examples:
+        text = f"{example.get('instruction', '')}\n{example.get('response', '')}"
+        signatures.append(hasher.signature(shingles(text, shingle_size)))
+        categories.append(example_category(example))
+
+    signatures = np.stack(signatures) if signatures else np.zeros((0, num_perm), dtype=np.uint32)
+    union_find = _UnionFind(len(signatures))
+    similarities = {}
+    num_candidates = 0
+    for first, other in lsh_candidate_pairs(signatures, num_bands, union_find.find):
+        num_candidates += 1
+        similarity = float(np.mean(signatures[first] == signatures[other]))
+        if similarity >= threshold:
+            union_find.union(first, other)
+            similarities[other] = max(similarities.get(other, 0.0), similarity)
+
+    members = defaultdict(list)
+    for index in range(len(signatures)):
+        members[union_find.find(index)].append(index)
+
+    clusters = [
+        {
+            'kept': root,
+            'removed': indices[1:],
+            'category': categories[root],
+            'min_similarity': min(similarities.get(i, 1.0) for i in indices[1:]),
+        }
+        for root, indices in sorted(members.items()) if len(indices) > 1
+    ]
+
+    return {
+        'clusters': clusters,
+        'categories': categories,
+        'num_examples': len(signatures),
+        'num_candidates': num_candidates,
+    }
+
+
+def _whitespace_tokens(example: Dict) -> int:
+    return len(f"{example.get('instruction', '')} {example.get('response', '')}".split())
+
+
+def chat_token_counter(tokenizer, system_prompt: str) -> Callable[[Dict], int]:
+    """Token count of an example rendered with the real chat template"""
+    from vitalis.data.preprocessing import render_conversation
+
+    def count(example: Dict) -> int:
+        return len(tokenizer(render_conversation(tokenizer, system_prompt, example))['input_ids'])
+
+    return count
+
+
+def deduplicate_dataset(data_path: str, output_path: str, clusters_path: Optional[str] = None,
+                        threshold: float = 0.8, num_perm: int = 128, num_bands: int = 16,
+                        shingle_size: int = 5, count_tokens: Optional[Callable[[Dict], int]] = None) -> Dict:
+    """
+    Write a deduplicated copy of the training data and a clusters file
+
+    The output keeps the standard {"metadata", "training_data"} layout; metadata gains a
+    "deduplication" entry with totals, tokens saved and per-category counts. Two streaming
+    passes over the source keep memory bounded by the signatures
+    """
+    start_time = time.time()
+    result = find_near_duplicates(
+        iter_training_examples(data_path), threshold=threshold, num_perm=num_perm,
+        num_bands=num_bands, shingle_size=shingle_size
+    )
+    removed = {index for cluster in result['clusters'] for index in cluster['removed']}
+    token_method = 'chat_template' if count_tokens is not None else 'whitespace'
+    count_tokens = count_tokens or _whitespace_tokens
+
+    category_examples = Counter(result['categories'])
+    category_removed = Counter()
+    tokens_total, tokens_saved = 0, 0
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+
+    with open(tmp_path, 'w') as f:
+        f.write('{\n  "training_data": [')
+        written = 0
+        for index, example in enumerate(iter_training_examples(data_path)):
+            num_tokens = count_tokens(example)
+            tokens_total += num_tokens
+            if index in removed:
+                tokens_saved += num_tokens
+                category_removed[result['categories'][index]] += 1
+                continue
+            f.write((',\n    ' if written else '\n    ') + json.dumps(example, ensure_ascii=False))
+            written += 1
+
+        metadata = read_metadata(data_path)
+        metadata['deduplication'] = {
+            'method': 'minhash_lsh',
+            'source': str(data_path),
+            'threshold': threshold,
+            'num_perm': num_perm,
+            'num_bands': num_bands,
+            'shingle_size': shingle_size,
+            'original_examples': result['num_examples'],
+            'kept_examples': written,
+            'removed_examples': len(removed),
+            'clusters': len(result['clusters']),
+            'token_count_method': token_method,
+            'original_tokens': tokens_total,
+            'tokens_saved': tokens_saved,
+            'categories': {
+                category: {'examples': count, 'removed': category_removed.get(category, 0)}
+                for category, count in sorted(category_examples.items())
+            },
+        }
+        f.write('\n  ],\n  "metadata": ' + json.dumps(metadata, indent=2, ensure_ascii=False).replace('\n', '\n  ') + '\n}\n')
+
+    tmp_path.replace(output_path)
+
+    if clusters_path:
+        with open(clusters_path, 'w') as f:
+            json.dump({'threshold': threshold, 'clusters': result['clusters']}, f, indent=2)
+
+    stats = metadata['deduplication']
+    logging.info(
+        f"COMPLETED Deduplicated {stats['original_examples']} examples in {time.time() - start_time:.2f}s: "
+        f"{stats['removed_examples']} near-duplicates in {stats['clusters']} clusters removed, "
+        f"{tokens_saved} {token_method} tokens saved ({result['num_candidates']} LSH candidate pairs)"
+    )
+    return stats
+
+
+def deduplicated_data_path(data_path: str, output_dir: str, threshold: float = 0.8, num_perm: int = 128,
+                           num_bands: int = 16, shingle_size: int = 5,
+                           count_tokens: Optional[Callable[[Dict], int]] = None) -> str:
+    """
+    Path of the deduplicated copy of data_path for these settings, building it if missing
+    The file name is keyed by the source content and settings, so edits trigger a rebuild
+    """
+    digest = hashlib.sha256()
+    with open(data_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    digest.update(json.dumps([threshold, num_perm, num_bands, shingle_size]).encode('utf-8'))
+    key = digest.hexdigest()[:16]
+
+    output_dir = Path(output_dir)
+    output_path = output_dir / f"{Path(data_path).stem}.dedup-{key}.json"
+    if output_path.exists():
+        logging.info(f"Using deduplicated training data: {output_path}")
+    else:
+        deduplicate_dataset(
+            data_path, str(output_path), str(output_dir / f"{Path(data_path).stem}.dedup-{key}.clusters.json"),
+            threshold=threshold, num_perm=num_perm, num_bands=num_bands,
+            shingle_size=shingle_size, count_tokens=count_tokens
+        )
+    return str(output_path)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Token-Length and Padding-Waste Profiler
+Measures the real chat-template token lengths of a training corpus and compares the padding
+cost of fixed padding, length bucketing and packing to recommend max_length and batching mode
+"""
+
+import math
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from vitalis.data.batching import LengthGroupedBatchSampler
+from vitalis.data.dedup import example_category
+from vitalis.data.packing import pack_sequences
+from vitalis.data.preprocessing import PreprocessingEngine
+
+# Long enough that tokenization never truncates, so truncation can be measured
+UNTRUNCATED_LENGTH = 1 << 20
+
+BATCHING_MODES = ('fixed', 'bucketed', 'packed')
+
+
+def collect_token_lengths(examples: Iterable[Dict], tokenizer, system_prompt: str,
+                          num_workers: Optional[int] = None, chunk_size: int = 256) -> Dict[str, List]:
+    """Untruncated token length and category of every example rendered with the chat template"""
+    engine = PreprocessingEngine(
+        tokenizer, system_prompt, UNTRUNCATED_LENGTH, num_workers=num_workers, chunk_size=chunk_size
+    )
+    lengths, categories = [], []
+    for record in engine.iter_records(examples):
+        lengths.append(len(record['input_ids']))
+        categories.append(example_category(record))
+    return {'lengths': lengths, 'categories': categories, 'rejected': engine.stats.get('rejected', 0)}
+
+
+def percentile(values: Sequence[int], q: float) -> int:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q / 100 * len(ordered))) - 1)]
+
+
+def length_histogram(lengths: Sequence[int], bin_width: int) -> List[Dict]:
+    """Counts per [start, end) token bin, from zero up to the longest example"""
+    if not lengths:
+        return []
+    counts = defaultdict(int)
+    for length in lengths:
+        counts[length // bin_width] += 1
+    return [
+        {'start': b * bin_width, 'end': (b + 1) * bin_width, 'count': counts.get(b, 0)}
+        for b in range(max(counts) + 1)
+    ]
+
+
+def padding_profile(lengths: Sequence[int], max_length: int, batch_size: int,
+                    pad_to_multiple_of: Optional[int] = 8) -> Dict:
+    """
+    Truncation and pad-token fractions at one max_length
+
+    Fixed padding and bucketing both run batch_size examples per step; packing runs
+    batch_size rows of max_length tokens, each holding several examples
+    """
+    truncated = [min(length, max_length) for length in lengths]
+    num_truncated = sum(1 for length in lengths if length > max_length)
+    real_tokens = sum(truncated)
+
+    sampler = LengthGroupedBatchSampler(truncated, batch_size, shuffle=True)
+    bucketed = sampler.padding_stats(max_length, pad_to_multiple_of)
+    num_batches = len(sampler)
+
+    rows = pack_sequences(truncated, max_length)
+    packed_tokens = len(rows) * max_length
+    packed_steps = int(math.ceil(len(rows) / batch_size))
+
+    return {
+        'max_length': max_length,
+        'batch_size': batch_size,
+        'truncation_rate': num_truncated / len(lengths) if lengths else 0.0,
+        'truncated_tokens_lost': sum(lengths) - real_tokens,
+        'real_tokens': real_tokens,
+        'pad_fraction': {
+            'fixed': bucketed['fixed_pad_fraction'],
+            'bucketed': bucketed['dynamic_pad_fraction'],
+            'packed': 1 - real_tokens / packed_tokens if packed_tokens else 0.0,
+        },
+        'steps_per_epoch': {
+            'fixed': num_batches,
+            'bucketed': num_batches,
+            'packed': packed_steps,
+        },
+        'real_tokens_per_step': {
+            'fixed': real_tokens / num_batches if num_batches else 0.0,
+            'bucketed': real_tokens / num_batches if num_batches else 0.0,
+            'packed': real_tokens / packed_steps if packed_steps else 0.0,
+        },
+    }
+
+
+def _round_up(value: int, multiple: int) -> int:
+    return int(math.ceil(value / multiple) * multiple)
+
+
+def candidate_max_lengths(lengths: Sequence[int], configured: int, multiple: int = 64) -> List[int]:
+    """Powers of two and high percentiles of the observed lengths, plus the configured value"""
+    longest = _round_up(max(lengths), multiple) if lengths else configured
+    candidates = {configured}
+    candidates.update(1 << p for p in range(7, 18) if (1 << p) <= longest)
+    candidates.update(_round_up(percentile(lengths, q), multiple) for q in (90, 95, 99, 100))
+    return sorted(c for c in candidates if c > 0)
+
+
+def recommend_configuration(lengths: Sequence[int], configured_max_length: int, configured_batch_size: int,
+                            max_truncation_rate: float = 0.01, pad_to_multiple_of: Optional[int] = 8) -> Dict:
+    """
+    Pick the max_length and batching mode with the most real tokens per optimizer micro-step
+
+    The per-step token budget is held at what the configuration already pays for
+    (batch_size x max_length), so a shorter max_length buys more rows per step. Candidates
+    that truncate more than max_truncation_rate of examples are only used if nothing else fits;
+    ties between fixed padding and bucketing go to the one with fewer pad tokens
+    """
+    token_budget = configured_batch_size * configured_max_length
+    profiles = []
+    for max_length in candidate_max_lengths(lengths, configured_max_length):
+        batch_size = max(1, token_budget // max_length)
+        profiles.append(padding_profile(lengths, max_length, batch_size, pad_to_multiple_of))
+
+    eligible = [p for p in profiles if p['truncation_rate'] <= max_truncation_rate]
+    if not eligible:
+        lowest = min(p['truncation_rate'] for p in profiles)
+        eligible = [p for p in profiles if p['truncation_rate'] == lowest]
+
+    best = max(
+        ((p, mode) for p in eligible for mode in BATCHING_MODES),
+        key=lambda item: (item[0]['real_tokens_per_step'][item[1]], -item[0]['pad_fraction'][item[1]])
+    )
+    profile, mode = best
+
+    return {
+        'max_length': profile['max_length'],
+        'batching_mode': mode,
+        'batch_size': profile['batch_size'],
+        'token_budget_per_step': token_budget,
+        'real_tokens_per_step': profile['real_tokens_per_step'][mode],
+        'pad_fraction': profile['pad_fraction'][mode],
+        'truncation_rate': profile['truncation_rate'],
+        'max_truncation_rate': max_truncation_rate,
+        'candidates': profiles,
+    }
+
+
+def profile_dataset(lengths: Sequence[int], categories: Sequence[str], max_length: int, batch_size: int,
+                    bin_width: int = 128, max_truncation_rate: float = 0.01) -> Dict:
+    """Full report: overall and per-category length statistics, padding waste and recommendation"""
+    by_category = defaultdict(list)
+    for length, category in zip(lengths, categories):
+        by_category[category].append(length)
+
+    def summary(values: Sequence[int]) -> Dict:
+        return {
+            'examples': len(values),
+            'tokens': sum(values),
+            'mean': sum(values) / len(values) if values else 0.0,
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values) if values else 0,
+            'truncation_rate': sum(1 for v in values if v > max_length) / len(values) if values else 0.0,
+            'histogram': length_histogram(values, bin_width),
+        }
+
+    report = {
+        'overall': summary(lengths),
+        'categories': {category: summary(values) for category, values in sorted(by_category.items())},
+        'configured': padding_profile(lengths, max_length, batch_size),
+        'recommendation': recommend_configuration(lengths, max_length, batch_size, max_truncation_rate),
+    }
+    logging.info(
+        f"COMPLETED Profiled {len(lengths)} examples: recommended max_length "
+        f"{report['recommendation']['max_length']} with '{report['recommendation']['batching_mode']}' batching"
+    )
+    return report
+
+
+def format_histogram(histogram: List[Dict], width: int = 40) -> List[str]:
+    """Text bar chart lines for a length histogram"""
+    peak = max((b['count'] for b in histogram), default=0)
+    lines = []
+    for b in histogram:
+        bar = '#' * (int(round(b['count'] / peak * width)) if peak else 0)
+        lines.append(f"{b['start']:>7}-{b['end']:<7} {b['count']:>7} {bar}")
+    return lines
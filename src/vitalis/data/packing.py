@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Sequence Packing
+Concatenates several rendered conversations into one max_length row and builds the
+position ids and per-document attention masks that keep them independent
+"""
+
+import math
+import logging
+import torch
+from torch.utils.data import Dataset
+from typing import Dict, List, Optional, Sequence
+
+from vitalis.data.batching import subset_lengths
+
+
+def pack_sequences(lengths: Sequence[int], max_length: int) -> List[List[int]]:
+    """
+    Best-fit-decreasing bin packing of sequence indices into rows of max_length tokens
+    Open rows are bucketed by remaining space, so each placement costs at most max_length lookups
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    rows: List[List[int]] = []
+    rows_by_space: List[List[int]] = [[] for _ in range(max_length + 1)]
+
+    for idx in order:
+        length = min(int(lengths[idx]), max_length)
+        row_id = None
+        for space in range(length, max_length + 1):
+            if rows_by_space[space]:
+                row_id = rows_by_space[space].pop()
+                remaining = space - length
+                break
+
+        if row_id is None:
+            row_id = len(rows)
+            rows.append([])
+            remaining = max_length - length
+
+        rows[row_id].append(idx)
+        rows_by_space[remaining].append(row_id)
+
+    return rows
+
+
+class PackedDataset(Dataset):
+    """
+    Packs unpadded examples from a source dataset into rows of at most max_length tokens
+
+    Each row carries position ids that restart at zero for every document and a
+    document id per token; the first label of every document is masked so no
+    token is trained to predict across a document boundary
+    """
+
+    def __init__(self, source_dataset, max_length: int):
+        self.source_dataset = source_dataset
+        self.max_length = max_length
+        self.lengths_per_example = subset_lengths(source_dataset)
+        self.rows = pack_sequences(self.lengths_per_example, max_length)
+
+        real_tokens = sum(min(length, max_length) for length in self.lengths_per_example)
+        self.fill_rate = real_tokens / (len(self.rows) * max_length) if self.rows else 0.0
+        logging.info(
+            f"Packed {len(self.lengths_per_example)} examples into {len(self.rows)} rows "
+            f"of {max_length} tokens ({self.fill_rate:.1%} filled)"
+        )
+
+    @property
+    def lengths(self) -> List[int]:
+        return [sum(self.lengths_per_example[i] for i in row) for row in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        input_ids, labels, position_ids, document_ids = [], [], [], []
+
+        for document, source_idx in enumerate(self.rows[idx]):
+            example = self.source_dataset[source_idx]
+            example_ids = torch.as_tensor(example['input_ids'], dtype=torch.long)[:self.max_length]
+            example_labels = torch.as_tensor(example.get('labels', example_ids), dtype=torch.long)[:self.max_length].clone()
+            example_labels[0] = -100
+
+            input_ids.append(example_ids)
+            labels.append(example_labels)
+            position_ids.append(torch.arange(example_ids.shape[0], dtype=torch.long))
+            document_ids.append(torch.full_like(example_ids, document))
+
+        return {
+            'input_ids': torch.cat(input_ids),
+            'labels': torch.cat(labels),
+            'position_ids': torch.cat(position_ids),
+            'document_ids': torch.cat(document_ids)
+        }
+
+
+def build_document_attention_masks(document_ids: torch.Tensor, layer_types: Sequence[str],
+                                   sliding_window: Optional[int], dtype: torch.dtype) -> Dict[str, torch.Tensor]:
+    """
+    Build one additive 4D mask (batch, 1, query, key) per attention layer type
+
+    A query attends to a key only when both belong to the same document and the key
+    is not in the future; sliding_attention layers additionally restrict the key to
+    the last sliding_window positions. Padding positions (document id -1) attend
+    only to themselves so their softmax rows stay finite
+    """
+    seq_len = document_ids.shape[1]
+    positions = torch.arange(seq_len, device=document_ids.device)
+
+    same_document = document_ids[:, :, None] == document_ids[:, None, :]
+    causal = positions[None, :, None] >= positions[None, None, :]
+    is_padding = (document_ids < 0)[:, :, None]
+    diagonal = torch.eye(seq_len, dtype=torch.bool, device=document_ids.device)[None]
+
+    allowed = (same_document & causal & ~is_padding) | (is_padding & diagonal)
+
+    masks = {}
+    for layer_type in sorted(set(layer_types)):
+        layer_allowed = allowed
+        if layer_type == 'sliding_attention' and sliding_window:
+            in_window = (positions[None, :, None] - positions[None, None, :]) < sliding_window
+            layer_allowed = allowed & in_window
+
+        mask = torch.zeros(layer_allowed.shape, dtype=dtype)
+        mask.masked_fill_(~layer_allowed, torch.finfo(dtype).min)
+        masks[layer_type] = mask[:, None, :, :]
+
+    return masks
+
+
+class PackedCollator:
+    """
+    Collates PackedDataset rows into model inputs
+
+    The attention mask is passed as a dict keyed by layer type, which GPT-OSS uses
+    directly instead of building its own causal and sliding-window masks
+    """
+
+    def __init__(self, pad_token_id: int, layer_types: Sequence[str], sliding_window: Optional[int],
+                 mask_dtype: torch.dtype = torch.bfloat16, pad_to_multiple_of: Optional[int] = 8):
+        self.pad_token_id = pad_token_id
+        self.layer_types = list(layer_types) or ['full_attention']
+        self.sliding_window = sliding_window
+        self.mask_dtype = mask_dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: List[Dict[str, torch.Tensor]]) -> Dict[str, object]:
+        batch_size = len(features)
+        max_length = max(len(f['input_ids']) for f in features)
+        if self.pad_to_multiple_of:
+            max_length = int(math.ceil(max_length / self.pad_to_multiple_of) * self.pad_to_multiple_of)
+
+        input_ids = torch.full((batch_size, max_length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, max_length), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, max_length), dtype=torch.long)
+        document_ids = torch.full((batch_size, max_length), -1, dtype=torch.long)
+
+        for row, feature in enumerate(features):
+            length = len(feature['input_ids'])
+            input_ids[row, :length] = feature['input_ids']
+            labels[row, :length] = feature['labels']
+            position_ids[row, :length] = feature['position_ids']
+            document_ids[row, :length] = feature['document_ids']
+
+        attention_mask = build_document_attention_masks(
+            document_ids, self.layer_types, self.sliding_window, self.mask_dtype
+        )
+
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'position_ids': position_ids,
+            'labels': labels
+        }
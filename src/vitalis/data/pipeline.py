@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Training Data Pipeline
+Builds the train/validation datasets, collator and batch sampler from a training config,
+so the full fine-tuning and LoRA trainers share one data path
+"""
+
+import logging
+import torch
+from pathlib import Path
+from transformers import DataCollatorForLanguageModeling
+from typing import Dict, Optional, Tuple
+
+from vitalis.data.batching import LengthGroupedBatchSampler, DynamicPaddingCollator, subset_lengths
+from vitalis.data.dataset import EmergencyReliefDataset, SYSTEM_PROMPT
+from vitalis.data.dedup import deduplicated_data_path, chat_token_counter
+from vitalis.data.packing import PackedDataset, PackedCollator
+from vitalis.data.streaming import StreamingEmergencyReliefDataset
+
+
+def resolve_backend(config: Dict) -> str:
+    """
+    config['data_backend'] ('memory', 'mmap' or 'streaming'), defaulting to the
+    older switches: streaming=true, then token_cache_dir, then in-memory
+    """
+    if config.get('data_backend'):
+        return config['data_backend']
+    if config.get('streaming', False):
+        return 'streaming'
+    return 'mmap' if config.get('token_cache_dir') else 'memory'
+
+
+def training_data_path(config: Dict, tokenizer) -> str:
+    """config['data_path'], or its near-duplicate-free copy when deduplicate is enabled"""
+    if not config.get('deduplicate', False):
+        return config['data_path']
+
+    return deduplicated_data_path(
+        config['data_path'],
+        config.get('dedup_dir', str(Path(config['output_dir']) / 'dedup')),
+        threshold=config.get('dedup_threshold', 0.8),
+        num_perm=config.get('dedup_num_perm', 128),
+        num_bands=config.get('dedup_num_bands', 16),
+        count_tokens=chat_token_counter(tokenizer, SYSTEM_PROMPT)
+    )
+
+
+def build_datasets(config: Dict, tokenizer, max_length: int) -> Tuple[Optional[EmergencyReliefDataset], object, object]:
+    """
+    Return (dataset, train_dataset, val_dataset) for the configured backend and batching mode
+    dataset is None for the streaming backend, which splits the stream itself
+    """
+    backend = resolve_backend(config)
+    batching_mode = config.get('batching_mode', 'bucketed')
+    assistant_only_loss = config.get('supervise', 'all') == 'assistant'
+    data_path = training_data_path(config, tokenizer)
+
+    if backend == 'streaming':
+        common_args = dict(
+            data_path=data_path,
+            tokenizer=tokenizer,
+            system_prompt=SYSTEM_PROMPT,
+            max_length=max_length,
+            assistant_only_loss=assistant_only_loss
+        )
+        train_dataset = StreamingEmergencyReliefDataset(
+            split='train', shuffle_buffer=config.get('shuffle_buffer', 1000), **common_args
+        )
+        val_dataset = StreamingEmergencyReliefDataset(split='validation', **common_args)
+        if batching_mode != 'bucketed':
+            logging.warning("Streaming datasets use per-batch dynamic padding; batching_mode is ignored")
+        return None, train_dataset, val_dataset
+
+    dataset = EmergencyReliefDataset(
+        data_path=data_path,
+        tokenizer=tokenizer,
+        max_length=max_length,
+        backend=backend,
+        cache_dir=config.get('token_cache_dir', str(Path(config['output_dir']) / 'token_cache')),
+        pad_to_max_length=batching_mode == 'fixed',
+        assistant_only_loss=assistant_only_loss,
+        num_workers=config.get('preprocessing_workers'),
+        chunk_size=config.get('preprocessing_chunk_size', 256),
+        rejects_path=config.get(
+            'preprocessing_rejects_path',
+            str(Path(config['output_dir']) / 'preprocessing_rejects.jsonl')
+        )
+    )
+
+    # Split into train/validation; seeded so every data-parallel rank gets the same split
+    train_size = int(0.9 * len(dataset))
+    val_size = len(dataset) - train_size
+    train_dataset, val_dataset = torch.utils.data.random_split(
+        dataset, [train_size, val_size], generator=torch.Generator().manual_seed(config.get('split_seed', 42))
+    )
+
+    if batching_mode == 'packed':
+        train_dataset = PackedDataset(train_dataset, max_length)
+        val_dataset = PackedDataset(val_dataset, max_length)
+        logging.info(f"Packing: {train_size} train examples -> {len(train_dataset)} packed rows")
+
+    return dataset, train_dataset, val_dataset
+
+
+def build_batching(config: Dict, tokenizer, model, train_dataset, max_length: int, batch_size: int, seed: int = 42):
+    """
+    Select the collator and train batch sampler for config['batching_mode']
+    'fixed' pads every example to max_length, 'bucketed' groups similar
+    lengths and pads each batch only to its longest sequence, 'packed'
+    concatenates several conversations per max_length row
+    """
+    batching_mode = config.get('batching_mode', 'bucketed')
+    streaming = resolve_backend(config) == 'streaming'
+    if streaming:
+        # Lengths of a stream are unknown up front; pad each batch dynamically
+        batching_mode = 'fixed'
+
+    if batching_mode == 'packed':
+        # Per-document masks for every attention layer type in the model config
+        data_collator = PackedCollator(
+            pad_token_id=tokenizer.pad_token_id,
+            layer_types=getattr(model.config, 'layer_types', None) or [],
+            sliding_window=getattr(model.config, 'sliding_window', None),
+            mask_dtype=next(model.parameters()).dtype
+        )
+        return data_collator, None
+
+    if batching_mode == 'fixed' and config.get('supervise', 'all') == 'all' and not streaming:
+        data_collator = DataCollatorForLanguageModeling(
+            tokenizer=tokenizer,
+            mlm=False,
+            pad_to_multiple_of=8
+        )
+        return data_collator, None
+
+    # Keeps the dataset's labels, so prompt tokens masked for assistant-only loss stay masked
+    data_collator = DynamicPaddingCollator(
+        pad_token_id=tokenizer.pad_token_id,
+        pad_to_multiple_of=8,
+        padding_side=tokenizer.padding_side
+    )
+    if batching_mode == 'fixed':
+        return data_collator, None
+
+    train_batch_sampler = LengthGroupedBatchSampler(
+        subset_lengths(train_dataset),
+        batch_size=batch_size,
+        seed=seed
+    )
+
+    stats = train_batch_sampler.padding_stats(max_length, pad_to_multiple_of=8)
+    logging.info(f"Length-bucketed batching stats: {stats}")
+    print(f"METRICS Padding fraction {stats['fixed_pad_fraction']:.1%} -> {stats['dynamic_pad_fraction']:.1%} "
+          f"({stats['padding_eliminated']:.1%} of processed tokens eliminated)")
+
+    return data_collator, train_batch_sampler
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Parallel Preprocessing Engine
+Renders the chat template and batch-encodes examples with the fast tokenizer across a
+process pool, keeping input order and writing rejected examples to a rejects file
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import multiprocessing
+import torch
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def render_conversation(tokenizer, system_prompt: str, example: Dict) -> str:
+    """Render one instruction/response pair with the tokenizer chat template"""
+    conversation = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": example.get('instruction', '')},
+        {"role": "assistant", "content": example.get('response', '')}
+    ]
+    return tokenizer.apply_chat_template(
+        conversation,
+        tokenize=False,
+        add_generation_prompt=False
+    )
+
+
+def render_prompt(tokenizer, system_prompt: str, example: Dict) -> str:
+    """Render the system and user turns up to the start of the assistant reply"""
+    conversation = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": example.get('instruction', '')}
+    ]
+    return tokenizer.apply_chat_template(
+        conversation,
+        tokenize=False,
+        add_generation_prompt=True
+    )
+
+
+def mask_prompt_labels(labels: torch.Tensor, prompt_length: int, offset: int = 0) -> torch.Tensor:
+    """
+    Set the labels of the system/user prompt tokens to -100 so only the reply is supervised
+    offset is the number of left-padding tokens before the first real token
+    """
+    labels[offset:offset + prompt_length] = -100
+    return labels
+
+
+class SystemPromptPrefix:
+    """
+    Rendered and tokenized system-prompt prefix shared by every conversation
+
+    Every example starts with the same rendered system turn, so its token ids are
+    computed once and only the text after it is tokenized per example. A probe
+    conversation is encoded both ways up front; if splitting at the prefix changes
+    the tokenization the prefix is disabled and texts are encoded whole
+    """
+
+    def __init__(self, tokenizer, system_prompt: str):
+        self.text, self.ids, self.enabled = '', [], False
+        try:
+            self.text = tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_prompt}],
+                tokenize=False,
+                add_generation_prompt=False
+            )
+            self.ids = tokenizer(self.text, add_special_tokens=False)['input_ids']
+
+            probe = render_conversation(tokenizer, system_prompt, {
+                'instruction': 'How do you coordinate an evacuation?',
+                'response': 'Establish incident command first.'
+            })
+            self.enabled = probe.startswith(self.text) and \
+                self._split_encode(tokenizer, [probe]) == tokenizer([probe])['input_ids']
+        except Exception as e:
+            logging.warning(f"System prompt prefix caching disabled: {e}")
+
+    def _split_encode(self, tokenizer, texts: List[str]) -> List[List[int]]:
+        suffixes = tokenizer([text[len(self.text):] for text in texts], add_special_tokens=False)['input_ids']
+        return [self.ids + ids for ids in suffixes]
+
+    def encode(self, tokenizer, texts: List[str], max_length: int) -> List[List[int]]:
+        """Token ids of each text truncated to max_length, reusing the prefix ids where possible"""
+        if not self.enabled or not all(text.startswith(self.text) for text in texts):
+            return tokenizer(texts, truncation=True, max_length=max_length)['input_ids']
+        return [ids[:max_length] for ids in self._split_encode(tokenizer, texts)]
+
+
+# Per-process state installed by _init_worker; also used directly when running in-process
+_WORKER_STATE: Dict = {}
+
+
+def _init_worker(tokenizer, system_prompt: str, max_length: int, compute_prompt_lengths: bool,
+                 prefix: Optional[SystemPromptPrefix] = None):
+    # Each worker is already one of many processes; keep the Rust tokenizer single-threaded
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    _WORKER_STATE.update(
+        tokenizer=tokenizer,
+        system_prompt=system_prompt,
+        max_length=max_length,
+        compute_prompt_lengths=compute_prompt_lengths,
+        prefix=prefix,
+    )
+
+
+def _encode(texts: List[str]) -> List[List[int]]:
+    tokenizer = _WORKER_STATE['tokenizer']
+    if _WORKER_STATE['prefix'] is not None:
+        return _WORKER_STATE['prefix'].encode(tokenizer, texts, _WORKER_STATE['max_length'])
+    return tokenizer(texts, truncation=True, max_length=_WORKER_STATE['max_length'])['input_ids']
+
+
+def _process_chunk(task: Tuple[int, int, List[Dict]]) -> Dict:
+    """Render and encode one chunk; returns records and rejects tagged with source indices"""
+    chunk_index, start_index, examples = task
+    tokenizer = _WORKER_STATE['tokenizer']
+    system_prompt = _WORKER_STATE['system_prompt']
+    start_time = time.perf_counter()
+
+    rendered, rejects = [], []
+    for offset, example in enumerate(examples):
+        source_index = start_index + offset
+        try:
+            if not isinstance(example, dict):
+                raise TypeError(f"expected an object, got {type(example).__name__}")
+            text = render_conversation(tokenizer, system_prompt, example)
+            prompt = render_prompt(tokenizer, system_prompt, example) if _WORKER_STATE['compute_prompt_lengths'] else None
+            rendered.append((source_index, example, text, prompt))
+        except Exception as e:
+            rejects.append({'index': source_index, 'stage': 'render', 'error': str(e), 'example': example})
+
+    texts = [item[2] for item in rendered]
+    try:
+        encoded = _encode(texts) if texts else []
+    except Exception:
+        # Isolate the failing example(s) instead of rejecting the whole chunk
+        encoded = []
+        for item in list(rendered):
+            try:
+                encoded.extend(_encode([item[2]]))
+            except Exception as e:
+                rendered.remove(item)
+                rejects.append({'index': item[0], 'stage': 'encode', 'error': str(e), 'example': item[1]})
+
+    prompt_lengths = [None] * len(rendered)
+    if _WORKER_STATE['compute_prompt_lengths'] and rendered:
+        prompt_lengths = [len(ids) for ids in _encode([item[3] for item in rendered])]
+
+    records = [
+        {
+            'index': item[0],
+            'text': item[2],
+            'input_ids': input_ids,
+            'prompt_length': prompt_length,
+            'metadata': item[1].get('metadata', {}),
+        }
+        for item, input_ids, prompt_length in zip(rendered, encoded, prompt_lengths)
+    ]
+
+    return {
+        'chunk_index': chunk_index,
+        'records': records,
+        'rejects': rejects,
+        'num_examples': len(examples),
+        'num_tokens': sum(len(record['input_ids']) for record in records),
+        'elapsed': time.perf_counter() - start_time,
+    }
+
+
+def _iter_chunks(examples: Iterable[Dict], chunk_size: int) -> Iterator[Tuple[int, int, List[Dict]]]:
+    iterator = iter(examples)
+    chunk_index, start_index = 0, 0
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk_index, start_index, chunk
+        chunk_index += 1
+        start_index += len(chunk)
+
+
+def _ordered_results(pool, chunks: Iterator, window: int) -> Iterator[Dict]:
+    """
+    Ordered results with at most `window` chunks in flight
+    Unlike Pool.imap, the input is not drained up front, so streamed corpora stay bounded
+    """
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(_process_chunk, (chunk,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def build_encoding(input_ids, pad_token_id: int, max_length: int, pad_to_max_length: bool = True,
+                   padding_side: str = 'right', prompt_length: Optional[int] = None) -> Dict[str, torch.Tensor]:
+    """
+    Turn pre-tokenized ids into a training item
+    Fixed-length items match tokenizer(padding='max_length'); unpadded items are left
+    to a padding collator. A prompt_length masks the prompt labels for assistant-only loss
+    """
+    ids = torch.as_tensor(input_ids, dtype=torch.long)
+    length = ids.shape[0]
+
+    if not pad_to_max_length:
+        labels = ids.clone()
+        if prompt_length is not None:
+            mask_prompt_labels(labels, prompt_length)
+        return {'input_ids': ids, 'labels': labels}
+
+    offset = max_length - length if padding_side == 'left' else 0
+    padded_ids = torch.full((max_length,), pad_token_id, dtype=torch.long)
+    padded_ids[offset:offset + length] = ids
+    attention_mask = torch.zeros(max_length, dtype=torch.long)
+    attention_mask[offset:offset + length] = 1
+
+    labels = padded_ids.clone()
+    if prompt_length is not None:
+        labels.masked_fill_(attention_mask == 0, -100)
+        mask_prompt_labels(labels, prompt_length, offset)
+
+    return {
+        'input_ids': padded_ids,
+        'attention_mask': attention_mask,
+        'labels': labels
+    }
+
+
+class PreprocessingEngine:
+    """
+    Fans chat-template rendering and fast-tokenizer batch encoding out across processes
+
+    Chunks are processed in a bounded ordered window, so records come back in input order.
+    Each record keeps its source index; failed examples go to rejects_path as JSONL
+    """
+
+    def __init__(self, tokenizer, system_prompt: str, max_length: int, num_workers: Optional[int] = None,
+                 chunk_size: int = 256, rejects_path: Optional[str] = None, compute_prompt_lengths: bool = False,
+                 prefix: Optional[SystemPromptPrefix] = None):
+        self.tokenizer = tokenizer
+        self.system_prompt = system_prompt
+        self.max_length = max_length
+        self.num_workers = num_workers if num_workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.rejects_path = rejects_path
+        self.compute_prompt_lengths = compute_prompt_lengths
+        self.prefix = prefix if prefix is not None else SystemPromptPrefix(tokenizer, system_prompt)
+        self.stats: Dict = {}
+
+    def _worker_args(self):
+        return (self.tokenizer, self.system_prompt, self.max_length, self.compute_prompt_lengths, self.prefix)
+
+    def iter_records(self, examples: Iterable[Dict], total: Optional[int] = None) -> Iterator[Dict]:
+        """Yield processed records in input order, logging per-chunk throughput"""
+        if total is None and hasattr(examples, '__len__'):
+            total = len(examples)
+        num_chunks = math.ceil(total / self.chunk_size) if total is not None else None
+        workers = self.num_workers if num_chunks is None else min(self.num_workers, num_chunks)
+
+        rejects_file = None
+        if self.rejects_path:
+            Path(self.rejects_path).parent.mkdir(parents=True, exist_ok=True)
+            rejects_file = open(self.rejects_path, 'w')
+
+        self.stats = {'examples': 0, 'records': 0, 'rejected': 0, 'tokens': 0, 'workers': max(workers, 1)}
+        start_time = time.perf_counter()
+        pool = None
+
+        try:
+            chunks = _iter_chunks(examples, self.chunk_size)
+            if workers > 1:
+                pool = multiprocessing.get_context('spawn').Pool(
+                    workers, initializer=_init_worker, initargs=self._worker_args()
+                )
+                results = _ordered_results(pool, chunks, window=workers * 2)
+            else:
+                _init_worker(*self._worker_args())
+                results = map(_process_chunk, chunks)
+
+            for result in results:
+                self.stats['examples'] += result['num_examples']
+                self.stats['records'] += len(result['records'])
+                self.stats['rejected'] += len(result['rejects'])
+                self.stats['tokens'] += result['num_tokens']
+
+                elapsed = max(result['elapsed'], 1e-9)
+                logging.info(
+                    f"Preprocessed chunk {result['chunk_index'] + 1}"
+                    f"{f'/{num_chunks}' if num_chunks else ''}: {result['num_examples']} examples in "
+                    f"{elapsed:.2f}s ({result['num_examples'] / elapsed:.0f} examples/s, "
+                    f"{result['num_tokens'] / elapsed:.0f} tokens/s), {len(result['rejects'])} rejected"
+                )
+
+                if rejects_file is not None:
+                    for reject in result['rejects']:
+                        rejects_file.write(json.dumps(reject, default=str) + '\n')
+
+                yield from result['records']
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if rejects_file is not None:
+                rejects_file.close()
+
+        wall_time = max(time.perf_counter() - start_time, 1e-9)
+        self.stats['wall_time'] = wall_time
+        logging.info(
+            f"COMPLETED Preprocessed {self.stats['examples']} examples with {self.stats['workers']} worker(s) "
+            f"in {wall_time:.2f}s ({self.stats['examples'] / wall_time:.0f} examples/s); "
+            f"{self.stats['rejected']} rejected"
+            + (f", see {self.rejects_path}" if self.rejects_path and self.stats['rejected'] else "")
+        )
+
+    def run(self, examples: Iterable[Dict], total: Optional[int] = None) -> List[Dict]:
+        return list(self.iter_records(examples, total))
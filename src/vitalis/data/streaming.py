@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Streaming Training Data Ingestion
+Yields training examples lazily from JSONL/NDJSON files and from large JSON documents,
+so corpora of millions of transcripts can be validated and trained on in bounded memory
+"""
+
+import json
+import random
+import logging
+import torch
+from pathlib import Path
+from torch.utils.data import IterableDataset, get_worker_info
+from typing import Any, Dict, Iterator, Optional
+
+from vitalis.data.preprocessing import render_conversation, render_prompt, build_encoding, SystemPromptPrefix
+
+JSONL_SUFFIXES = {'.jsonl', '.ndjson'}
+WHITESPACE = ' \t\r\n'
+
+
+class _JsonStreamReader:
+    """
+    Incremental reader over a JSON document
+    Values are decoded one at a time with raw_decode and the buffer is refilled
+    whenever a value runs past its end, so only the current value is held in memory
+    """
+
+    def __init__(self, handle, chunk_size: int = 1 << 16):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.handle.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' in JSON stream, found '{found or 'end of file'}'")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number that ends exactly at the buffer boundary may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self) -> Iterator[Any]:
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f"Expected ',' or ']' in JSON array, found '{separator or 'end of file'}'")
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield each key of a top-level object; the caller must consume its value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f"Expected ',' or '}}' in JSON object, found '{separator or 'end of file'}'")
+
+
+def _normalize_example(record: Dict) -> Dict:
+    """Accept chat-format records ({"messages": [...]}) alongside instruction/response records"""
+    if 'messages' in record and 'instruction' not in record:
+        example = {k: v for k, v in record.items() if k != 'messages'}
+        for message in record['messages']:
+            if message.get('role') == 'user':
+                example['instruction'] = message.get('content', '')
+            elif message.get('role') == 'assistant':
+                example['response'] = message.get('content', '')
+        return example
+    return record
+
+
+def iter_training_examples(data_path: str, key: str = 'training_data') -> Iterator[Dict]:
+    """
+    Lazily yield training examples from
+    - JSONL/NDJSON files, one example per line
+    - a top-level JSON array of examples
+    - a JSON object holding the examples under `key` (the standard training data layout)
+    """
+    path = Path(data_path)
+
+    with open(path, 'r') as f:
+        if path.suffix.lower() in JSONL_SUFFIXES:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield _normalize_example(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}:{line_number}: invalid JSON line: {e}") from e
+            return
+
+        reader = _JsonStreamReader(f)
+        first = reader.peek()
+        if first == '[':
+            for record in reader.iter_array():
+                yield _normalize_example(record)
+            return
+
+        for object_key in reader.iter_object():
+            if object_key == key:
+                for record in reader.iter_array():
+                    yield _normalize_example(record)
+                return
+            reader.decode_value()
+
+
+def read_metadata(data_path: str, key: str = 'training_data') -> Dict:
+    """Read the top-level metadata object, skipping over examples one at a time"""
+    path = Path(data_path)
+    if path.suffix.lower() in JSONL_SUFFIXES:
+        return {}
+
+    with open(path, 'r') as f:
+        reader = _JsonStreamReader(f)
+        if reader.peek() != '{':
+            return {}
+        for object_key in reader.iter_object():
+            if object_key == 'metadata':
+                return reader.decode_value()
+            if object_key == key:
+                for _ in reader.iter_array():
+                    pass
+            else:
+                reader.decode_value()
+    return {}
+
+
+def count_examples(data_path: str) -> int:
+    """Count examples with a single streaming pass"""
+    return sum(1 for _ in iter_training_examples(data_path))
+
+
+class StreamingEmergencyReliefDataset(IterableDataset):
+    """
+    Iterable training dataset that renders and tokenizes examples as they are read
+
+    Examples are split deterministically: every holdout_every-th example goes to the
+    validation split. DataLoader workers each take a disjoint stride of the stream.
+    Items are unpadded and rely on a padding collator
+    """
+
+    def __init__(self, data_path: str, tokenizer, system_prompt: str, max_length: int = 1024,
+                 split: str = 'train', holdout_every: int = 10, assistant_only_loss: bool = False,
+                 shuffle_buffer: int = 0, seed: int = 42):
+        self.data_path = data_path
+        self.tokenizer = tokenizer
+        self.system_prompt = system_prompt
+        self.max_length = max_length
+        self.split = split
+        self.holdout_every = holdout_every
+        self.assistant_only_loss = assistant_only_loss
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        self._length = None
+        self.prefix = SystemPromptPrefix(tokenizer, system_prompt)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _in_split(self, index: int) -> bool:
+        is_validation = index % self.holdout_every == self.holdout_every - 1
+        return is_validation == (self.split == 'validation')
+
+    def _iter_split(self) -> Iterator[Dict]:
+        for index, example in enumerate(iter_training_examples(self.data_path)):
+            if self._in_split(index):
+                yield example
+
+    def __len__(self):
+        # One streaming pass, cached; lets the Trainer size epochs without max_steps
+        if self._length is None:
+            self._length = sum(1 for _ in self._iter_split())
+        return self._length
+
+    def _encode(self, example: Dict) -> Optional[Dict[str, torch.Tensor]]:
+        try:
+            text = render_conversation(self.tokenizer, self.system_prompt, example)
+        except Exception as e:
+            logging.warning(f"Failed to process example: {e}")
+            return None
+
+        input_ids = self.prefix.encode(self.tokenizer, [text], self.max_length)[0]
+        prompt_length = None
+        if self.assistant_only_loss:
+            prompt = render_prompt(self.tokenizer, self.system_prompt, example)
+            prompt_length = len(self.prefix.encode(self.tokenizer, [prompt], self.max_length)[0])
+
+        return build_encoding(
+            input_ids, self.tokenizer.pad_token_id, self.max_length,
+            pad_to_max_length=False, prompt_length=prompt_length
+        )
+
+    def __iter__(self) -> Iterator[Dict[str, torch.Tensor]]:
+        worker = get_worker_info()
+        num_workers = worker.num_workers if worker else 1
+        worker_id = worker.id if worker else 0
+
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        buffer = []
+
+        for position, example in enumerate(self._iter_split()):
+            if position % num_workers != worker_id:
+                continue
+            item = self._encode(example)
+            if item is None:
+                continue
+
+            if self.shuffle_buffer <= 0:
+                yield item
+                continue
+
+            # Reservoir-style shuffle buffer: bounded memory, approximate shuffling
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+            else:
+                slot = rng.randrange(self.shuffle_buffer)
+                yield buffer[slot]
+                buffer[slot] = item
+
+        rng.shuffle(buffer)
+        yield from buffer
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Pre-tokenized Token Cache
+Renders and tokenizes the training corpus once and stores flat token/offset arrays on disk
+Datasets memory-map the cache so later runs and DataLoader workers share the same pages
+"""
+
+import os
+import json
+import hashlib
+import logging
+import shutil
+import time
+import numpy as np
+import torch
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from vitalis.data.preprocessing import PreprocessingEngine, build_encoding
+
+# Bump whenever the on-disk layout changes so stale caches are rebuilt
+CACHE_FORMAT_VERSION = 2
+
+TOKENS_FILE = "tokens.npy"
+OFFSETS_FILE = "offsets.npy"
+INDICES_FILE = "source_indices.npy"
+PROMPT_LENGTHS_FILE = "prompt_lengths.npy"
+META_FILE = "meta.json"
+
+
+def _sha256_file(path: str, block_size: int = 1 << 20) -> str:
+    """Hash a file in fixed-size blocks so large corpora never load whole"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Stable hash of the tokenizer vocabulary, merges and special tokens
+    Fast tokenizers serialize their full state; slow ones fall back to the vocab
+    """
+    digest = hashlib.sha256()
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        digest.update(backend.to_str().encode('utf-8'))
+    else:
+        for token, token_id in sorted(tokenizer.get_vocab().items()):
+            digest.update(f"{token}\t{token_id}\n".encode('utf-8'))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def compute_cache_key(tokenizer, system_prompt: str, max_length: int, data_path: str) -> str:
+    """Cache key covering everything that changes the tokenized output"""
+    parts = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'tokenizer': tokenizer_fingerprint(tokenizer),
+        'chat_template': getattr(tokenizer, 'chat_template', None) or '',
+        'system_prompt': system_prompt,
+        'max_length': max_length,
+        'data': _sha256_file(data_path),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def build_token_cache(examples: List[Dict], tokenizer, system_prompt: str, max_length: int,
+                      cache_path: Path, num_workers: Optional[int] = None, chunk_size: int = 256,
+                      rejects_path: Optional[str] = None) -> int:
+    """
+    Render and tokenize every example once and write the flat arrays to cache_path
+    Returns the number of cached examples
+    """
+    cache_path = Path(cache_path)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp-{os.getpid()}")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    start_time = time.time()
+    token_chunks = []
+    lengths = []
+    prompt_lengths = []
+    source_indices = []
+
+    engine = PreprocessingEngine(
+        tokenizer, system_prompt, max_length,
+        num_workers=num_workers, chunk_size=chunk_size,
+        rejects_path=rejects_path, compute_prompt_lengths=True
+    )
+    for record in engine.iter_records(examples):
+        token_chunks.append(np.asarray(record['input_ids'], dtype=np.int32))
+        lengths.append(len(record['input_ids']))
+        prompt_lengths.append(record['prompt_length'])
+        source_indices.append(record['index'])
+
+    tokens = np.concatenate(token_chunks) if token_chunks else np.zeros(0, dtype=np.int32)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    np.save(tmp_path / TOKENS_FILE, tokens)
+    np.save(tmp_path / OFFSETS_FILE, offsets)
+    np.save(tmp_path / INDICES_FILE, np.asarray(source_indices, dtype=np.int64))
+    np.save(tmp_path / PROMPT_LENGTHS_FILE, np.asarray(prompt_lengths, dtype=np.int32))
+    with open(tmp_path / META_FILE, 'w') as f:
+        json.dump({
+            'format_version': CACHE_FORMAT_VERSION,
+            'num_examples': len(lengths),
+            'num_tokens': int(tokens.shape[0]),
+            'max_length': max_length,
+            'created_at': int(time.time()),
+        }, f, indent=2)
+
+    # Publish atomically; a concurrent builder that finished first wins
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not (cache_path / META_FILE).exists():
+            raise
+
+    logging.info(
+        f"COMPLETED Token cache built: {len(lengths)} examples, {tokens.shape[0]} tokens "
+        f"in {time.time() - start_time:.2f}s -> {cache_path}"
+    )
+    return len(lengths)
+
+
+class TokenCache:
+    """
+    Read-only view of a built token cache
+    Arrays are memory-mapped lazily so each DataLoader worker maps the file itself
+    instead of receiving a pickled copy
+    """
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = Path(cache_path)
+        with open(self.cache_path / META_FILE, 'r') as f:
+            self.meta = json.load(f)
+        self._tokens = None
+        self._offsets = None
+        self._prompt_lengths = None
+
+    def _ensure_open(self):
+        if self._tokens is None:
+            self._tokens = np.load(self.cache_path / TOKENS_FILE, mmap_mode='r')
+            self._offsets = np.load(self.cache_path / OFFSETS_FILE, mmap_mode='r')
+            self._prompt_lengths = np.load(self.cache_path / PROMPT_LENGTHS_FILE, mmap_mode='r')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tokens'] = None
+        state['_offsets'] = None
+        state['_prompt_lengths'] = None
+        return state
+
+    def __len__(self):
+        return self.meta['num_examples']
+
+    @property
+    def source_indices(self) -> np.ndarray:
+        """Index of each cached row in the original training_data list"""
+        return np.load(self.cache_path / INDICES_FILE, mmap_mode='r')
+
+    @property
+    def lengths(self) -> np.ndarray:
+        self._ensure_open()
+        return np.diff(self._offsets)
+
+    def prompt_length(self, idx: int) -> int:
+        """Number of leading system/user prompt tokens in example idx"""
+        self._ensure_open()
+        return int(self._prompt_lengths[idx])
+
+    def token_ids(self, idx: int) -> np.ndarray:
+        self._ensure_open()
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        return self._tokens[start:end]
+
+    def encoding(self, idx: int, pad_token_id: int, max_length: int, pad_to_max_length: bool = True,
+                 padding_side: str = 'right', assistant_only_loss: bool = False) -> Dict[str, torch.Tensor]:
+        """Return a training item; fixed-length items match tokenizer(padding='max_length')"""
+        return build_encoding(
+            self.token_ids(idx), pad_token_id, max_length, pad_to_max_length, padding_side,
+            self.prompt_length(idx) if assistant_only_loss else None
+        )
+
+
+def load_or_build_token_cache(data_path: str, examples: List[Dict], tokenizer, system_prompt: str,
+                              max_length: int, cache_dir: str, num_workers: Optional[int] = None,
+                              chunk_size: int = 256, rejects_path: Optional[str] = None) -> TokenCache:
+    """Open the cache matching this tokenizer/template/prompt/max_length, building it if missing"""
+    key = compute_cache_key(tokenizer, system_prompt, max_length, data_path)
+    cache_path = Path(cache_dir) / key[:16]
+
+    if (cache_path / META_FILE).exists():
+        logging.info(f"Using token cache: {cache_path}")
+    else:
+        logging.info(f"Building token cache: {cache_path}")
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        build_token_cache(
+            examples, tokenizer, system_prompt, max_length, cache_path,
+            num_workers=num_workers, chunk_size=chunk_size, rejects_path=rejects_path
+        )
+
+    return TokenCache(cache_path)
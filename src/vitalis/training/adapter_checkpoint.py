@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Adapter-Only Checkpointing
+Saves LoRA adapter weights, optimizer/scheduler and RNG state instead of going through the
+generic Trainer save path, keeps the best adapter in RAM and swaps it in when training ends
+"""
+
+import json
+import logging
+import torch
+from pathlib import Path
+from typing import Dict, List, Optional
+from transformers.trainer_callback import TrainerCallback
+from peft import get_peft_model_state_dict, set_peft_model_state_dict
+from safetensors.torch import load_file
+
+from vitalis.training.async_checkpoint import (
+    AsyncCheckpointWriter, CHECKPOINT_PREFIX, rng_state, snapshot_state, trainer_state_json
+)
+
+# File names match the Trainer checkpoint layout so trainer.train(resume_from_checkpoint=...)
+# restores the adapter, optimizer, scheduler, RNG and trainer state without the base weights
+ADAPTER_WEIGHTS_NAME = "adapter_model"
+ADAPTER_CONFIG_FILE = "adapter_config.json"
+OPTIMIZER_FILE = "optimizer.pt"
+SCHEDULER_FILE = "scheduler.pt"
+RNG_STATE_FILE = "rng_state.pth"
+TRAINER_STATE_FILE = "trainer_state.json"
+BEST_ADAPTER_FILE = "best_adapter.safetensors"
+BEST_META_FILE = "best_adapter.json"
+BEST_OPTIMIZER_FILE = "best_optimizer.pt"
+
+
+def adapter_state_dict(model, adapter_names: Optional[List[str]] = None) -> Dict[str, torch.Tensor]:
+    """
+    Adapter weights of the active adapter, or of several named adapters with each key
+    prefixed by '<adapter>/'
+    """
+    if not adapter_names:
+        return get_peft_model_state_dict(model)
+    return {
+        f"{name}/{key}": value
+        for name in adapter_names
+        for key, value in get_peft_model_state_dict(model, adapter_name=name).items()
+    }
+
+
+def load_adapter_state_dict(model, state: Dict[str, torch.Tensor], adapter_names: Optional[List[str]] = None):
+    """Inverse of adapter_state_dict"""
+    if not adapter_names:
+        set_peft_model_state_dict(model, state)
+        return
+    for name in adapter_names:
+        prefix = f"{name}/"
+        set_peft_model_state_dict(
+            model, {key[len(prefix):]: value for key, value in state.items() if key.startswith(prefix)},
+            adapter_name=name
+        )
+
+
+def adapter_state_to_cpu(model, adapter_names: Optional[List[str]] = None) -> Dict[str, torch.Tensor]:
+    """Detached CPU copy of the trainable adapter weights"""
+    return {k: v.detach().to('cpu', copy=True).contiguous() for k, v in adapter_state_dict(model, adapter_names).items()}
+
+
+def adapter_config_json(model, adapter_names: Optional[List[str]] = None) -> str:
+    """adapter_config.json contents as PeftConfig.save_pretrained writes them; {adapter: config} for several"""
+    if adapter_names:
+        config = {name: model.peft_config[name].to_dict() for name in adapter_names}
+    else:
+        config = model.peft_config[model.active_adapter].to_dict()
+    return json.dumps(config, indent=2, sort_keys=True, default=lambda value: sorted(value) if isinstance(value, set) else str(value))
+
+
+class AdapterCheckpointCallback(TrainerCallback):
+    """
+    Writes checkpoint-<step> directories holding only what changes during LoRA training
+
+    Use with save_strategy='no' and load_best_model_at_end=False: this callback takes
+    over both. After each evaluation an improved adapter is copied into host memory;
+    on_train_end copies it back into the model, so no checkpoint is reloaded from disk.
+    With adapter_names, all named adapters are kept and saved together. With
+    keep_best_optimizer the optimizer state of the best step is kept alongside, so the
+    restored adapter can be saved with the moments that belong to it
+    """
+
+    def __init__(self, output_dir: str, save_steps: int, save_total_limit: Optional[int] = None,
+                 metric_for_best_model: str = 'eval_loss', greater_is_better: bool = False,
+                 writer: Optional[AsyncCheckpointWriter] = None, adapter_names: Optional[List[str]] = None,
+                 keep_best_optimizer: bool = False):
+        self.output_dir = Path(output_dir)
+        self.adapter_names = adapter_names
+        self.save_steps = save_steps
+        self.save_total_limit = save_total_limit
+        # Adapter checkpoints are small; with no shared writer one is created for this callback
+        self.writer = writer or AsyncCheckpointWriter(output_dir, save_total_limit=save_total_limit)
+        self.metric_for_best_model = metric_for_best_model
+        self.greater_is_better = greater_is_better
+        self.best_state: Optional[Dict[str, torch.Tensor]] = None
+        self.best_metric: Optional[float] = None
+        self.best_step: Optional[int] = None
+        self.keep_best_optimizer = keep_best_optimizer
+        self.best_optimizer_state: Optional[Dict] = None
+        self._save_due = False
+
+    def _is_better(self, value: float) -> bool:
+        if self.best_metric is None:
+            return True
+        return value > self.best_metric if self.greater_is_better else value < self.best_metric
+
+    def restore_best(self, checkpoint_dir: str):
+        """Pick the best adapter seen before an interruption back up when resuming"""
+        meta_path = Path(checkpoint_dir) / BEST_META_FILE
+        if not meta_path.exists():
+            return
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        self.best_state = load_file(str(Path(checkpoint_dir) / BEST_ADAPTER_FILE))
+        self.best_metric = meta['best_metric']
+        self.best_step = meta['best_step']
+        optimizer_path = Path(checkpoint_dir) / BEST_OPTIMIZER_FILE
+        if self.keep_best_optimizer and optimizer_path.exists():
+            self.best_optimizer_state = torch.load(optimizer_path, map_location='cpu', weights_only=False)
+        logging.info(f"Restored best adapter from step {self.best_step} ({self.metric_for_best_model}={self.best_metric:.4f})")
+
+    def on_evaluate(self, args, state, control, metrics=None, model=None, **kwargs):
+        if not metrics or self.metric_for_best_model not in metrics or model is None:
+            return
+        value = metrics[self.metric_for_best_model]
+        if self._is_better(value):
+            self.best_state = adapter_state_to_cpu(model, self.adapter_names)
+            self.best_metric = value
+            self.best_step = state.global_step
+            optimizer = kwargs.get('optimizer')
+            if self.keep_best_optimizer and optimizer is not None:
+                self.best_optimizer_state = snapshot_state(optimizer.state_dict())
+            logging.info(f"New best adapter at step {state.global_step}: {self.metric_for_best_model}={value:.4f} (kept in RAM)")
+        if self._save_due:
+            self._save_due = False
+            self.save(state, model, kwargs.get('optimizer'), kwargs.get('lr_scheduler'))
+
+    def on_step_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if not (self.save_steps and state.global_step % self.save_steps == 0 and args.should_save):
+            return
+        if control.should_evaluate:
+            # Evaluation runs right after this event; save once the best adapter is up to date
+            self._save_due = True
+        else:
+            self.save(state, model, optimizer, lr_scheduler)
+
+    def on_train_end(self, args, state, control, model=None, **kwargs):
+        self.writer.wait()
+        if self.best_state is None or model is None:
+            return
+        load_adapter_state_dict(model, self.best_state, self.adapter_names)
+        logging.info(
+            f"COMPLETED Restored best adapter from step {self.best_step} "
+            f"({self.metric_for_best_model}={self.best_metric:.4f}) from memory"
+        )
+
+    def save(self, state, model, optimizer=None, lr_scheduler=None) -> Path:
+        """Snapshot one checkpoint and hand it to the background writer"""
+        objects = {RNG_STATE_FILE: rng_state()}
+        if optimizer is not None:
+            objects[OPTIMIZER_FILE] = optimizer.state_dict()
+        if lr_scheduler is not None:
+            objects[SCHEDULER_FILE] = lr_scheduler.state_dict()
+        text_files = {
+            ADAPTER_CONFIG_FILE: adapter_config_json(model, self.adapter_names),
+            TRAINER_STATE_FILE: trainer_state_json(state),
+        }
+
+        extra_tensors = {}
+        if self.best_state is not None:
+            extra_tensors[BEST_ADAPTER_FILE] = self.best_state
+            text_files[BEST_META_FILE] = json.dumps({
+                'best_metric': self.best_metric, 'best_step': self.best_step, 'metric': self.metric_for_best_model
+            }, indent=2)
+        if self.best_optimizer_state is not None:
+            objects[BEST_OPTIMIZER_FILE] = self.best_optimizer_state
+
+        return self.writer.submit(
+            f"{CHECKPOINT_PREFIX}{state.global_step}",
+            adapter_state_dict(model, self.adapter_names),
+            weights_name=ADAPTER_WEIGHTS_NAME,
+            objects=objects,
+            text_files=text_files,
+            extra_tensors=extra_tensors
+        )
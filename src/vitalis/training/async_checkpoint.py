@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Asynchronous Checkpoint Writer
+Snapshots tensors to host memory on the training thread and writes safetensors shards,
+optimizer/scheduler state and metadata on a background thread with an atomic rename
+"""
+
+import os
+import json
+import random
+import dataclasses
+import shutil
+import logging
+import queue
+import threading
+import time
+import numpy as np
+import torch
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from safetensors.torch import save_file
+
+CHECKPOINT_PREFIX = "checkpoint-"
+DEFAULT_SHARD_SIZE = 5 * 1024**3
+
+
+def snapshot_tensor(tensor: torch.Tensor) -> torch.Tensor:
+    """Host-memory copy that later optimizer steps cannot modify"""
+    return tensor.detach().to('cpu', copy=True).contiguous()
+
+
+def snapshot_state(obj: Any) -> Any:
+    """Copy every tensor in a nested state_dict (optimizer, scheduler) to host memory"""
+    if isinstance(obj, torch.Tensor):
+        return snapshot_tensor(obj)
+    if isinstance(obj, dict):
+        return {k: snapshot_state(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_state(v) for v in obj)
+    return obj
+
+
+def shard_state_dict(tensors: Dict[str, torch.Tensor], max_shard_size: int) -> List[Dict[str, torch.Tensor]]:
+    """Split a state dict into shards of at most max_shard_size bytes (a larger tensor gets its own shard)"""
+    shards, current, current_size = [], {}, 0
+    for name, tensor in tensors.items():
+        size = tensor.numel() * tensor.element_size()
+        if current and current_size + size > max_shard_size:
+            shards.append(current)
+            current, current_size = {}, 0
+        current[name] = tensor
+        current_size += size
+    if current or not shards:
+        shards.append(current)
+    return shards
+
+
+def save_sharded_safetensors(directory: Path, weights_name: str, tensors: Dict[str, torch.Tensor],
+                             max_shard_size: int) -> List[str]:
+    """
+    Write <weights_name>.safetensors, or numbered shards plus <weights_name>.safetensors.index.json
+    when the tensors exceed max_shard_size; returns the file names written
+    """
+    directory = Path(directory)
+    shards = shard_state_dict(tensors, max_shard_size)
+    if len(shards) == 1:
+        save_file(shards[0], str(directory / f"{weights_name}.safetensors"), metadata={'format': 'pt'})
+        return [f"{weights_name}.safetensors"]
+
+    weight_map, total_size, filenames = {}, 0, []
+    for i, shard in enumerate(shards, 1):
+        filename = f"{weights_name}-{i:05d}-of-{len(shards):05d}.safetensors"
+        save_file(shard, str(directory / filename), metadata={'format': 'pt'})
+        filenames.append(filename)
+        for key, tensor in shard.items():
+            weight_map[key] = filename
+            total_size += tensor.numel() * tensor.element_size()
+    with open(directory / f"{weights_name}.safetensors.index.json", 'w') as f:
+        json.dump({'metadata': {'total_size': total_size}, 'weight_map': weight_map}, f, indent=2)
+    return filenames + [f"{weights_name}.safetensors.index.json"]
+
+
+def rng_state() -> Dict:
+    """Python, NumPy and torch RNG state in the layout Trainer reads from rng_state.pth"""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'cpu': torch.random.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.random.get_rng_state_all()
+    if torch.backends.mps.is_available():
+        state['mps'] = torch.mps.get_rng_state()
+    return state
+
+
+def trainer_state_json(state) -> str:
+    """TrainerState serialized exactly as TrainerState.save_to_json writes it"""
+    return json.dumps(dataclasses.asdict(state), indent=2, sort_keys=True) + "\n"
+
+
+def sorted_checkpoints(output_dir: str) -> List[Path]:
+    """Checkpoint directories under output_dir, oldest step first"""
+    output_dir = Path(output_dir)
+    if not output_dir.exists():
+        return []
+    checkpoints = [
+        path for path in output_dir.iterdir()
+        if path.is_dir() and path.name.startswith(CHECKPOINT_PREFIX) and path.name[len(CHECKPOINT_PREFIX):].isdigit()
+    ]
+    return sorted(checkpoints, key=lambda path: int(path.name[len(CHECKPOINT_PREFIX):]))
+
+
+def latest_checkpoint(output_dir: str) -> Optional[str]:
+    checkpoints = sorted_checkpoints(output_dir)
+    return str(checkpoints[-1]) if checkpoints else None
+
+
+def rotate_checkpoints(output_dir: str, save_total_limit: Optional[int], protect: Optional[List[str]] = None):
+    """Delete the oldest checkpoints beyond save_total_limit, never one listed in protect"""
+    if not save_total_limit:
+        return
+    protected = {Path(p).resolve() for p in (protect or []) if p}
+    checkpoints = sorted_checkpoints(output_dir)
+    excess = len(checkpoints) - save_total_limit
+    for old in checkpoints:
+        if excess <= 0:
+            break
+        if old.resolve() in protected:
+            continue
+        shutil.rmtree(old, ignore_errors=True)
+        excess -= 1
+
+
+class AsyncCheckpointWriter:
+    """
+    Background writer for checkpoint directories
+
+    submit() snapshots everything to host memory and returns as soon as the copy is
+    done; a daemon thread serializes the snapshot into a temporary directory, renames it
+    into place and applies save_total_limit. max_pending bounds how many snapshots can
+    exist at once, so a slow disk applies backpressure instead of exhausting RAM.
+    Errors raised on the writer thread are re-raised by the next submit() or wait()
+    """
+
+    def __init__(self, output_dir: str, save_total_limit: Optional[int] = None,
+                 max_shard_size: int = DEFAULT_SHARD_SIZE, max_pending: int = 1):
+        self.output_dir = Path(output_dir)
+        self.save_total_limit = save_total_limit
+        self.max_shard_size = max_shard_size
+        self.max_pending = max(1, max_pending)
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(self.max_pending)
+        self._pending = 0
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'checkpoints_written': 0,
+            'bytes_written': 0,
+            'write_seconds': 0.0,
+            'last_write_mb_s': 0.0,
+            'snapshot_seconds': 0.0,
+            'blocked_seconds': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name="vitalis-checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Checkpoints snapshotted but not yet on disk"""
+        with self._lock:
+            return self._pending
+
+    def metrics(self) -> Dict[str, float]:
+        """Values merged into the Trainer's log entries"""
+        with self._lock:
+            total_mb_s = self.stats['bytes_written'] / 1e6 / self.stats['write_seconds'] if self.stats['write_seconds'] else 0.0
+            return {
+                'checkpoint_queue_depth': self._pending,
+                'checkpoint_write_mb_s': round(self.stats['last_write_mb_s'], 1),
+                'checkpoint_avg_write_mb_s': round(total_mb_s, 1),
+                'checkpoint_blocked_seconds': round(self.stats['blocked_seconds'], 2),
+            }
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Background checkpoint write failed: {error}") from error
+
+    def submit(self, name: str, tensors: Dict[str, torch.Tensor], weights_name: str = "model",
+               objects: Optional[Dict[str, Any]] = None, text_files: Optional[Dict[str, str]] = None,
+               extra_tensors: Optional[Dict[str, Dict[str, torch.Tensor]]] = None,
+               protect: Optional[List[str]] = None) -> Path:
+        """
+        Queue output_dir/name for writing
+
+        tensors are written as <weights_name>.safetensors, or as numbered shards with a
+        <weights_name>.safetensors.index.json when they exceed max_shard_size. extra_tensors
+        are single safetensors files, objects are torch.save()d under their file name and
+        text_files are written verbatim. Tensors and objects are copied to host memory
+        before this returns
+        """
+        self._raise_pending_error()
+
+        wait_start = time.time()
+        if not self._slots.acquire(blocking=False):
+            logging.warning("WARNING Checkpoint writer is still busy, waiting for a free slot")
+            self._slots.acquire()
+        blocked = time.time() - wait_start
+
+        snapshot_start = time.time()
+        job = {
+            'name': name,
+            'weights_name': weights_name,
+            'tensors': {k: snapshot_tensor(v) for k, v in tensors.items()},
+            'extra_tensors': {
+                filename: {k: snapshot_tensor(v) for k, v in extra.items()}
+                for filename, extra in (extra_tensors or {}).items()
+            },
+            'objects': snapshot_state(objects or {}),
+            'text_files': dict(text_files or {}),
+            'protect': list(protect or []),
+        }
+        snapshot_seconds = time.time() - snapshot_start
+        with self._lock:
+            self._pending += 1
+            self.stats['blocked_seconds'] += blocked
+            self.stats['snapshot_seconds'] += snapshot_seconds
+
+        self._queue.put(job)
+        logging.info(
+            f"SAVE Checkpoint {name} snapshotted in {snapshot_seconds:.2f}s, "
+            f"writing in background (queue depth {self.queue_depth})"
+        )
+        return self.output_dir / name
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            try:
+                self._write(job)
+            except BaseException as e:
+                logging.error(f"FAILED Checkpoint {job['name']} could not be written: {e}")
+                self._error = e
+            finally:
+                job.clear()
+                with self._lock:
+                    self._pending -= 1
+                self._slots.release()
+                self._queue.task_done()
+
+    def _write(self, job: Dict):
+        start_time = time.time()
+        final_dir = self.output_dir / job['name']
+        tmp_dir = self.output_dir / f".{job['name']}.tmp-{os.getpid()}"
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+
+        self._write_tensors(tmp_dir, job['weights_name'], job['tensors'])
+        for filename, extra in job['extra_tensors'].items():
+            save_file(extra, str(tmp_dir / filename), metadata={'format': 'pt'})
+        for filename, obj in job['objects'].items():
+            torch.save(obj, tmp_dir / filename)
+        for filename, text in job['text_files'].items():
+            with open(tmp_dir / filename, 'w') as f:
+                f.write(text)
+
+        size = sum(f.stat().st_size for f in tmp_dir.iterdir())
+        if final_dir.exists():
+            shutil.rmtree(final_dir)
+        os.replace(tmp_dir, final_dir)
+        rotate_checkpoints(self.output_dir, self.save_total_limit, job['protect'] + [str(final_dir)])
+
+        elapsed = max(time.time() - start_time, 1e-6)
+        with self._lock:
+            self.stats['checkpoints_written'] += 1
+            self.stats['bytes_written'] += size
+            self.stats['write_seconds'] += elapsed
+            self.stats['last_write_mb_s'] = size / 1e6 / elapsed
+        logging.info(
+            f"SAVE Checkpoint {job['name']} written: {size / 1e9:.2f} GB in {elapsed:.1f}s "
+            f"({size / 1e6 / elapsed:.0f} MB/s)"
+        )
+
+    def _write_tensors(self, directory: Path, weights_name: str, tensors: Dict[str, torch.Tensor]):
+        save_sharded_safetensors(directory, weights_name, tensors, self.max_shard_size)
+
+    def wait(self):
+        """Block until every submitted checkpoint is on disk"""
+        self._queue.join()
+        self._raise_pending_error()
+
+    def close(self):
+        """Finish outstanding writes and stop the writer thread"""
+        if self._thread.is_alive():
+            self._queue.join()
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_pending_error()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Batch Size Autotuner
+Runs short probe steps at increasing micro-batch sizes and sequence lengths, watches peak
+memory and tokens/sec, and picks the micro-batch / gradient-accumulation split with the
+highest throughput that fits in memory at the configured effective batch size
+"""
+
+import gc
+import time
+import logging
+import statistics
+import torch
+from typing import Dict, List, Optional, Sequence
+
+from vitalis.training.checkpoint_policy import PeakMemorySampler
+from vitalis.training.chunked_loss import compute_chunked_causal_lm_loss
+from vitalis.utils.memory_planner import GB, MemoryPlanner, available_memory_bytes, workload_from_config
+
+
+def micro_batch_candidates(effective_batch: int, max_micro_batch: Optional[int] = None) -> List[int]:
+    """Divisors of the effective batch, ascending, so every split has a whole accumulation count"""
+    limit = min(effective_batch, max_micro_batch or effective_batch)
+    return [size for size in range(1, limit + 1) if effective_batch % size == 0]
+
+
+def probe_lengths(lengths: Optional[Sequence[int]], max_length: int) -> List[int]:
+    """
+    Sequence lengths to probe: the median training length (rounded up to a multiple of 8,
+    as the collators pad) for throughput, and max_length for the memory worst case
+    """
+    if not lengths:
+        return [max_length]
+    median = min(max_length, -(-int(statistics.median(lengths)) // 8) * 8)
+    return sorted({median, max_length})
+
+
+def synchronize_device(device: torch.device):
+    if device.type == 'mps':
+        torch.mps.synchronize()
+    elif device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def release_device_memory(device: torch.device):
+    gc.collect()
+    if device.type == 'mps':
+        torch.mps.empty_cache()
+    elif device.type == 'cuda':
+        torch.cuda.empty_cache()
+
+
+def probe_step(model, batch_size: int, seq_len: int, steps: int = 2, loss_mode: str = 'standard',
+               loss_chunk_size: int = 256) -> Dict:
+    """
+    Median forward/backward time and peak memory for random token batches of one shape
+
+    Gradients are discarded after every step and the optimizer is not stepped, so the
+    weights are unchanged by probing
+    """
+    device = next(model.parameters()).device
+    vocab_size = model.config.vocab_size
+    step_times = []
+    with PeakMemorySampler() as sampler:
+        for step in range(steps + 1):
+            input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+            inputs = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids), 'labels': input_ids}
+            start_time = time.time()
+            if loss_mode == 'chunked':
+                loss = compute_chunked_causal_lm_loss(model, inputs, loss_chunk_size)
+            else:
+                loss = model(**inputs, use_cache=False).loss
+            loss.backward()
+            synchronize_device(device)
+            if step:
+                # The first step includes one-off allocations
+                step_times.append(time.time() - start_time)
+            model.zero_grad(set_to_none=True)
+            del loss
+
+    seconds = sorted(step_times)[len(step_times) // 2]
+    return {
+        'micro_batch_size': batch_size,
+        'seq_len': seq_len,
+        'step_seconds': seconds,
+        'tokens_per_second': batch_size * seq_len / seconds,
+        'peak_memory_bytes': sampler.peak,
+    }
+
+
+def autotune_batch_size(model, effective_batch: int, seq_lens: Sequence[int], memory_limit: int,
+                        reserve_bytes: int = 0, steps: int = 2, max_micro_batch: Optional[int] = None,
+                        loss_mode: str = 'standard', loss_chunk_size: int = 256) -> Dict:
+    """
+    Micro-batch size and gradient accumulation for effective_batch with the best throughput
+
+    Micro-batch sizes are probed in ascending order, each at ascending seq_lens; a size
+    fits when its peak memory at the longest length plus reserve_bytes (state that is not
+    allocated yet, such as optimizer moments) stays within memory_limit, and probing stops
+    at the first size that does not fit. Throughput is taken at the shortest probed length
+    """
+    device = next(model.parameters()).device
+    seq_lens = sorted(seq_lens)
+    was_training = model.training
+    model.train()
+
+    probes, fitting = [], []
+    for batch_size in micro_batch_candidates(effective_batch, max_micro_batch):
+        results = []
+        try:
+            for seq_len in seq_lens:
+                results.append(probe_step(model, batch_size, seq_len, steps, loss_mode, loss_chunk_size))
+                if results[-1]['peak_memory_bytes'] + reserve_bytes > memory_limit:
+                    break
+        except RuntimeError as e:
+            # Allocation failures end the search like an over-budget peak
+            logging.warning(f"WARNING Probe at micro-batch {batch_size} failed: {str(e)[:100]}")
+            results.append({'micro_batch_size': batch_size, 'seq_len': seq_len, 'error': str(e)[:200]})
+        finally:
+            model.zero_grad(set_to_none=True)
+            release_device_memory(device)
+        probes.extend(results)
+
+        fits = len(results) == len(seq_lens) and 'error' not in results[-1] and \
+            results[-1]['peak_memory_bytes'] + reserve_bytes <= memory_limit
+        for result in results:
+            if 'error' not in result:
+                logging.info(f"METRICS Probe micro-batch {batch_size} x {result['seq_len']}: "
+                             f"{result['tokens_per_second']:.0f} tokens/s, peak {result['peak_memory_bytes'] / GB:.2f} GB")
+        if not fits:
+            break
+        fitting.append({'micro_batch_size': batch_size, 'tokens_per_second': results[0]['tokens_per_second'],
+                        'peak_memory_bytes': results[-1]['peak_memory_bytes']})
+
+    model.train(was_training)
+    if fitting:
+        best = max(fitting, key=lambda choice: choice['tokens_per_second'])
+    else:
+        logging.warning("WARNING No probed micro-batch size fits the memory limit; keeping micro-batch 1")
+        best = {'micro_batch_size': 1, 'tokens_per_second': None, 'peak_memory_bytes': None}
+
+    return {
+        'micro_batch_size': best['micro_batch_size'],
+        'gradient_accumulation_steps': effective_batch // best['micro_batch_size'],
+        'effective_batch_size': effective_batch,
+        'tokens_per_second': best['tokens_per_second'],
+        'peak_memory_gb': best['peak_memory_bytes'] / GB if best['peak_memory_bytes'] else None,
+        'memory_limit_gb': memory_limit / GB,
+        'reserve_gb': reserve_bytes / GB,
+        'probes': probes,
+    }
+
+
+def autotune_from_config(model, config: Dict, mode: str, effective_batch: int, max_length: int,
+                         lengths: Optional[Sequence[int]] = None) -> Dict:
+    """
+    autotune_batch_size with the memory limit and reserve taken from the training config
+
+    The limit is memory_budget_gb, or the memory in use now plus what is still available.
+    The reserve is the planner's optimizer-state estimate, which is allocated only by the
+    first optimizer step and so is not part of any probe
+    """
+    if 'memory_budget_gb' in config:
+        memory_limit = int(config['memory_budget_gb'] * GB)
+    else:
+        memory_limit = PeakMemorySampler.current() + available_memory_bytes()
+
+    reserve_bytes = 0
+    try:
+        planner = MemoryPlanner(config['model_path'])
+        dtype = 'mxfp4' if mode == 'lora' and config.get('packed_experts', False) else 'bfloat16'
+        plan = planner.plan(dtype=dtype, **workload_from_config(config, mode, batch_size=1, seq_len=max_length))
+        reserve_bytes = int(plan['components']['optimizer_state'])
+    except Exception as e:
+        logging.warning(f"WARNING Memory planner unavailable, probing without an optimizer reserve: {e}")
+
+    seq_lens = probe_lengths(lengths, max_length)
+    logging.info(f"PROCESSING Autotuning micro-batch size for effective batch {effective_batch} "
+                 f"at lengths {seq_lens}, limit {memory_limit / GB:.1f} GB")
+    result = autotune_batch_size(
+        model, effective_batch, seq_lens, memory_limit,
+        reserve_bytes=reserve_bytes,
+        steps=config.get('autotune_steps', 2),
+        max_micro_batch=config.get('autotune_max_micro_batch'),
+        loss_mode=config.get('loss_mode', 'standard'),
+        loss_chunk_size=config.get('loss_chunk_size', 256),
+    )
+    logging.info(f"COMPLETED Autotune: micro-batch {result['micro_batch_size']} x "
+                 f"{result['gradient_accumulation_steps']} accumulation steps")
+    return result
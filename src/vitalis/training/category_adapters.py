@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Per-Category LoRA Adapters
+Trains one named LoRA adapter per data category (or category group) in a single run:
+every batch holds one adapter's examples and the adapter is switched before its forward,
+so all adapters share the loaded base model
+"""
+
+import re
+import json
+import logging
+from pathlib import Path
+from torch.utils.data import Dataset
+from typing import Dict, List, Union
+
+from vitalis.training.vitalis_trainer import VitalisTrainer
+
+# Written next to the adapters: adapter name -> categories, example counts and eval loss
+MANIFEST_FILE = "adapters.json"
+
+
+def adapter_name(label: str) -> str:
+    """A PEFT adapter / directory name for a category label"""
+    return re.sub(r'\W+', '_', label.strip().lower()).strip('_') or 'uncategorized'
+
+
+def resolve_adapter_groups(spec: Union[bool, Dict[str, List[str]]], categories: List[str]) -> Dict[str, List[str]]:
+    """
+    Adapter name -> categories it trains on
+
+    spec true gives one adapter per category present in the data; a dict names the
+    groups explicitly ({"fire": ["wildfire", "structure fire"], "flood": ["flood"]}).
+    Examples whose category is in no group are left out of training
+    """
+    present = sorted(set(categories))
+    if spec is True:
+        groups = {}
+        for category in present:
+            groups.setdefault(adapter_name(category), []).append(category)
+        return groups
+    if not isinstance(spec, dict) or not spec:
+        raise ValueError("category_adapters must be true or a non-empty {adapter: [categories]} object")
+
+    groups, seen = {}, {}
+    for name, members in spec.items():
+        members = [members] if isinstance(members, str) else list(members)
+        for category in members:
+            if category in seen:
+                raise ValueError(f"Category '{category}' is in both '{seen[category]}' and '{name}'")
+            seen[category] = name
+        groups[adapter_name(name)] = members
+    unknown = sorted(set(seen) - set(present))
+    if unknown:
+        logging.warning(f"WARNING category_adapters lists categories with no examples: {unknown}")
+    return groups
+
+
+def adapter_assignments(categories: List[str], groups: Dict[str, List[str]]) -> List[int]:
+    """Index into list(groups) for every example, -1 when its category has no adapter"""
+    index = {category: i for i, members in enumerate(groups.values()) for category in members}
+    return [index.get(category, -1) for category in categories]
+
+
+def attach_category_adapters(model, lora_config, names: List[str]):
+    """PeftModel holding one adapter per name, all with the same LoRA configuration"""
+    from peft import get_peft_model
+
+    peft_model = get_peft_model(model, lora_config, adapter_name=names[0])
+    for name in names[1:]:
+        peft_model.add_adapter(name, lora_config)
+    peft_model.set_adapter(names[0])
+    return peft_model
+
+
+def mark_adapters_trainable(model, names: List[str]):
+    """
+    Make the LoRA weights of every named adapter trainable
+
+    set_adapter freezes the inactive adapters; the optimizer has to be built with all of
+    them, and frozen ones then simply get no gradient (and no update) for that batch
+    """
+    markers = tuple(f".{name}." for name in names)
+    for param_name, param in model.named_parameters():
+        if 'lora_' in param_name and any(marker in param_name for marker in markers):
+            param.requires_grad_(True)
+
+
+class AdapterTaggedDataset(Dataset):
+    """Dataset items with the index of the adapter that trains on them"""
+
+    def __init__(self, dataset, assignments: List[int]):
+        self.dataset = dataset
+        self.assignments = assignments
+
+    def __len__(self):
+        return len(self.dataset)
+
+    @property
+    def lengths(self):
+        return self.dataset.lengths
+
+    @property
+    def categories(self):
+        return self.dataset.categories
+
+    def __getitem__(self, idx):
+        item = dict(self.dataset[idx])
+        item['adapter_index'] = self.assignments[idx]
+        return item
+
+
+class AdapterRoutingCollator:
+    """
+    Wraps a collator: removes the per-item adapter index and adds the batch's adapter
+    name, which MultiAdapterTrainer activates before the forward
+    """
+
+    def __init__(self, collator, names: List[str]):
+        self.collator = collator
+        self.names = names
+
+    def __call__(self, features):
+        indices = {feature['adapter_index'] for feature in features}
+        if len(indices) != 1:
+            raise ValueError(f"Batch mixes examples of several adapters: {sorted(indices)}")
+        features = [{k: v for k, v in feature.items() if k != 'adapter_index'} for feature in features]
+        batch = self.collator(features)
+        batch['adapter_name'] = self.names[indices.pop()]
+        return batch
+
+
+class MultiAdapterTrainer(VitalisTrainer):
+    """
+    VitalisTrainer that switches the active LoRA adapter to each batch's adapter_name
+
+    The optimizer is created with the weights of every adapter; AdamW skips the ones that
+    got no gradient, so each adapter only moves on its own batches
+    """
+
+    def __init__(self, *args, adapter_names: List[str], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.adapter_names = adapter_names
+
+    def create_optimizer(self):
+        mark_adapters_trainable(self.model, self.adapter_names)
+        return super().create_optimizer()
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        name = inputs.pop('adapter_name')
+        peft_model = self.accelerator.unwrap_model(model)
+        if peft_model.active_adapter != name:
+            peft_model.set_adapter(name)
+        return super().compute_loss(model, inputs, return_outputs=return_outputs, num_items_in_batch=num_items_in_batch)
+
+
+def write_manifest(output_dir: Path, groups: Dict[str, List[str]], counts: Dict[str, Dict[str, int]],
+                   metrics: Dict[str, Dict[str, float]]) -> Path:
+    """adapters.json describing every saved adapter"""
+    manifest = {
+        name: {'categories': members, **counts.get(name, {}), **metrics.get(name, {})}
+        for name, members in groups.items()
+    }
+    path = Path(output_dir) / MANIFEST_FILE
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return path
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Selective Gradient Checkpointing
+Chooses per decoder layer whether to recompute the whole layer, only its MoE MLP, or nothing,
+so cheap sliding-window layers need not be recomputed as often as full-attention and expert blocks
+"""
+
+import time
+import logging
+import functools
+import threading
+from typing import Dict, List, Optional, Sequence, Union
+
+# Per-layer modes
+CHECKPOINT_LAYER = 'layer'
+CHECKPOINT_MOE_MLP = 'moe_mlp'
+
+PolicySpec = Union[bool, str, Dict, None]
+
+
+def resolve_checkpoint_policy(policy: PolicySpec, layer_types: Sequence[str]) -> List[Optional[str]]:
+    """
+    Checkpoint mode for each decoder layer: 'layer', 'moe_mlp' or None
+
+    policy is the training config's gradient_checkpointing value:
+      true / "all"          every layer (the previous behaviour)
+      false / "none"        no layer
+      "moe_mlp"             only the MoE MLP of every layer
+      a layer_types entry   every layer of that type, e.g. "full_attention"
+      {"layers": [...], "layer_types": [...], "target": "layer" | "moe_mlp"}
+                            the union of the listed indices (negative indices count from
+                            the end) and layer types; all layers when neither key is given
+    """
+    num_layers = len(layer_types)
+    if policy is None or policy is True or policy == 'all':
+        return [CHECKPOINT_LAYER] * num_layers
+    if policy is False or policy == 'none':
+        return [None] * num_layers
+    if policy == CHECKPOINT_MOE_MLP:
+        return [CHECKPOINT_MOE_MLP] * num_layers
+    if isinstance(policy, str):
+        if policy not in set(layer_types):
+            raise ValueError(
+                f"Unknown gradient checkpointing policy '{policy}', expected all, none, moe_mlp "
+                f"or one of the layer types {sorted(set(layer_types))}"
+            )
+        policy = {'layer_types': [policy]}
+    if not isinstance(policy, dict):
+        raise ValueError(f"Gradient checkpointing policy must be a bool, string or object, got {policy!r}")
+
+    target = policy.get('target', CHECKPOINT_LAYER)
+    if target not in (CHECKPOINT_LAYER, CHECKPOINT_MOE_MLP):
+        raise ValueError(f"Unknown checkpoint target '{target}', expected 'layer' or 'moe_mlp'")
+
+    unknown_types = set(policy.get('layer_types', [])) - set(layer_types)
+    if unknown_types:
+        raise ValueError(f"Unknown layer types {sorted(unknown_types)}, model has {sorted(set(layer_types))}")
+
+    selected = set()
+    for index in policy.get('layers', []):
+        if not -num_layers <= index < num_layers:
+            raise ValueError(f"Layer index {index} out of range for {num_layers} layers")
+        selected.add(index % num_layers)
+    selected.update(i for i, layer_type in enumerate(layer_types) if layer_type in policy.get('layer_types', []))
+    if 'layers' not in policy and 'layer_types' not in policy:
+        selected = set(range(num_layers))
+
+    return [target if i in selected else None for i in range(num_layers)]
+
+
+def describe_checkpoint_modes(modes: Sequence[Optional[str]]) -> str:
+    layers = sum(mode == CHECKPOINT_LAYER for mode in modes)
+    mlps = sum(mode == CHECKPOINT_MOE_MLP for mode in modes)
+    parts = []
+    if layers:
+        parts.append(f"{layers}/{len(modes)} layers")
+    if mlps:
+        parts.append(f"{mlps}/{len(modes)} MoE MLPs")
+    return ', '.join(parts) if parts else 'off'
+
+
+def _decoder_layers(model):
+    """The decoder layer ModuleList of a causal LM, also when wrapped by PEFT"""
+    import torch.nn as nn
+
+    for name, module in model.named_modules():
+        if name.split('.')[-1] == 'layers' and isinstance(module, nn.ModuleList):
+            return module
+    raise ValueError("Could not find the decoder layers of the model")
+
+
+def _checkpointed_forward(forward):
+    import torch
+    from torch.utils.checkpoint import checkpoint
+
+    @functools.wraps(forward)
+    def wrapped(*args, **kwargs):
+        if torch.is_grad_enabled():
+            return checkpoint(forward, *args, use_reentrant=False, **kwargs)
+        return forward(*args, **kwargs)
+
+    return wrapped
+
+
+def _restore_mlp_forwards(layers):
+    for layer in layers:
+        mlp = getattr(layer, 'mlp', None)
+        if mlp is not None and 'forward' in vars(mlp) and hasattr(mlp, '_vitalis_checkpointed'):
+            del mlp.forward
+            del mlp._vitalis_checkpointed
+
+
+def apply_checkpoint_policy(model, policy: PolicySpec) -> List[Optional[str]]:
+    """
+    Enable gradient checkpointing on the layers the policy selects
+
+    Whole layers use the model's own gradient checkpointing (non-reentrant), switched off
+    again for unselected layers; MoE MLPs get a checkpointed forward. Calling this again
+    replaces the previous policy. Returns the per-layer modes
+    """
+    layers = _decoder_layers(model)
+    layer_types = getattr(model.config, 'layer_types', None) or ['full_attention'] * len(layers)
+    modes = resolve_checkpoint_policy(policy, layer_types)
+
+    _restore_mlp_forwards(layers)
+    if CHECKPOINT_LAYER in modes:
+        model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+        for layer, mode in zip(layers, modes):
+            if hasattr(layer, 'gradient_checkpointing'):
+                layer.gradient_checkpointing = mode == CHECKPOINT_LAYER
+    elif getattr(model, 'is_gradient_checkpointing', False):
+        model.gradient_checkpointing_disable()
+
+    for layer, mode in zip(layers, modes):
+        if mode == CHECKPOINT_MOE_MLP:
+            layer.mlp.forward = _checkpointed_forward(layer.mlp.forward)
+            layer.mlp._vitalis_checkpointed = True
+
+    if any(modes):
+        # The KV cache is useless during training and conflicts with recomputation
+        model.config.use_cache = False
+    logging.info(f"Gradient checkpointing policy {policy!r}: {describe_checkpoint_modes(modes)}")
+    return modes
+
+
+class PeakMemorySampler:
+    """
+    Background sampler for peak process memory during a measured region
+
+    CUDA peaks come from the allocator; elsewhere RSS is sampled every interval seconds,
+    plus MPS allocations on Apple Silicon where they are not part of RSS
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self.baseline = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current() -> int:
+        import psutil
+        import torch
+
+        used = psutil.Process().memory_info().rss
+        if torch.backends.mps.is_available():
+            used += torch.mps.current_allocated_memory()
+        return used
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        import torch
+
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+            self.baseline = torch.cuda.memory_allocated()
+        else:
+            self.baseline = self.peak = self.current()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        import torch
+
+        if torch.cuda.is_available():
+            self.peak = torch.cuda.max_memory_allocated()
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, self.current())
+        return False
+
+    @property
+    def peak_delta(self) -> int:
+        """Peak above the memory in use when the region started"""
+        return max(self.peak - self.baseline, 0)
+
+
+def measure_checkpoint_policies(model, policies: Dict[str, PolicySpec], batch_size: int, seq_len: int,
+                                steps: int = 3, warmup: int = 1) -> List[Dict]:
+    """
+    Forward/backward step time and peak memory for each policy on random token batches
+
+    Weights and trainable parameters are whatever the model already has, so the numbers
+    include gradients for a full model and only adapter gradients for a PEFT model
+    """
+    import gc
+    import torch
+
+    device = next(model.parameters()).device
+    vocab_size = model.config.vocab_size
+    model.train()
+
+    results = []
+    for name, policy in policies.items():
+        modes = apply_checkpoint_policy(model, policy)
+        step_times = []
+        gc.collect()
+        with PeakMemorySampler() as sampler:
+            for step in range(warmup + steps):
+                input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+                start_time = time.time()
+                loss = model(input_ids=input_ids, labels=input_ids, use_cache=False).loss
+                loss.backward()
+                if device.type == 'mps':
+                    torch.mps.synchronize()
+                elif device.type == 'cuda':
+                    torch.cuda.synchronize()
+                if step >= warmup:
+                    step_times.append(time.time() - start_time)
+                model.zero_grad(set_to_none=True)
+                del loss
+
+        step_times.sort()
+        result = {
+            'name': name,
+            'policy': policy,
+            'checkpointed': describe_checkpoint_modes(modes),
+            'step_seconds': step_times[len(step_times) // 2],
+            'tokens_per_second': batch_size * seq_len / step_times[len(step_times) // 2],
+            'peak_memory_bytes': sampler.peak_delta,
+        }
+        logging.info(
+            f"METRICS {name}: {result['step_seconds']:.2f}s/step, "
+            f"peak +{result['peak_memory_bytes'] / 1024**3:.2f} GB ({result['checkpointed']})"
+        )
+        results.append(result)
+    return results
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Chunked Cross-Entropy for Large-Vocabulary Language Models
+Runs the lm_head projection and cross-entropy in sequence chunks over supervised positions only,
+so the full (batch, sequence, 201k vocab) logits tensor is never materialized
+"""
+
+import contextlib
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from typing import Dict, Optional
+
+IGNORE_INDEX = -100
+
+
+def _chunk_loss_sum(hidden_chunk: torch.Tensor, weight: torch.Tensor, bias: Optional[torch.Tensor],
+                    labels_chunk: torch.Tensor) -> torch.Tensor:
+    logits = F.linear(hidden_chunk, weight, bias).float()
+    return F.cross_entropy(logits, labels_chunk, reduction='sum')
+
+
+def chunked_cross_entropy(hidden_states: torch.Tensor, lm_head: nn.Linear, labels: torch.Tensor,
+                          chunk_size: int = 256, num_items_in_batch: Optional[int] = None) -> torch.Tensor:
+    """
+    Causal LM loss equivalent to the Hugging Face reference loss
+
+    hidden_states are the final-norm outputs (batch, seq, hidden). Labels are shifted
+    left by one, positions labelled -100 are dropped before the projection, and each
+    chunk of chunk_size positions is projected and reduced under activation
+    checkpointing, so its logits are recomputed in backward instead of kept alive
+    """
+    shift_labels = F.pad(labels, (0, 1), value=IGNORE_INDEX)[..., 1:]
+    flat_labels = shift_labels.reshape(-1)
+    flat_hidden = hidden_states.reshape(-1, hidden_states.shape[-1])
+
+    supervised = (flat_labels != IGNORE_INDEX).nonzero(as_tuple=True)[0]
+    selected_hidden = flat_hidden.index_select(0, supervised)
+    selected_labels = flat_labels.index_select(0, supervised)
+
+    total = hidden_states.new_zeros((), dtype=torch.float32)
+    for start in range(0, selected_labels.shape[0], chunk_size):
+        hidden_chunk = selected_hidden[start:start + chunk_size]
+        labels_chunk = selected_labels[start:start + chunk_size]
+        if torch.is_grad_enabled():
+            total = total + checkpoint(
+                _chunk_loss_sum, hidden_chunk, lm_head.weight, lm_head.bias, labels_chunk,
+                use_reentrant=False
+            )
+        else:
+            total = total + _chunk_loss_sum(hidden_chunk, lm_head.weight, lm_head.bias, labels_chunk)
+
+    if num_items_in_batch is not None:
+        if torch.is_tensor(num_items_in_batch):
+            num_items_in_batch = num_items_in_batch.to(total.device)
+        return total / num_items_in_batch
+    # Mean over supervised positions; an all-ignored batch yields 0 instead of NaN
+    return total / max(selected_labels.shape[0], 1)
+
+
+def _unwrap_causal_lm(model: nn.Module) -> nn.Module:
+    """Return the *ForCausalLM module underneath DDP and PEFT wrappers"""
+    while hasattr(model, 'module'):
+        model = model.module
+    if hasattr(model, 'get_base_model'):
+        model = model.get_base_model()
+    return model
+
+
+@contextlib.contextmanager
+def lm_head_bypass(model: nn.Module):
+    """
+    Temporarily swap the lm_head for an identity so the model's own forward
+    (through any DDP/PEFT wrappers) returns final hidden states as its logits
+    """
+    causal_lm = _unwrap_causal_lm(model)
+    lm_head = causal_lm.lm_head
+    causal_lm.lm_head = nn.Identity()
+    try:
+        yield lm_head
+    finally:
+        causal_lm.lm_head = lm_head
+
+
+def compute_chunked_causal_lm_loss(model: nn.Module, inputs: Dict[str, torch.Tensor], chunk_size: int = 256,
+                                   num_items_in_batch: Optional[int] = None) -> torch.Tensor:
+    """Forward the model without its lm_head and compute the chunked loss on the labelled positions"""
+    model_inputs = {k: v for k, v in inputs.items() if k != 'labels'}
+    with lm_head_bypass(model) as lm_head:
+        outputs = model(**model_inputs, use_cache=False)
+    return chunked_cross_entropy(outputs.logits, lm_head, inputs['labels'], chunk_size, num_items_in_batch)
+
+
+def verify_chunked_loss(chunk_size: int = 5, seed: int = 0) -> Dict[str, float]:
+    """
+    Compare the chunked loss and its gradients against the reference loss of a
+    tiny randomly initialised GPT-OSS model
+    """
+    from transformers import GptOssConfig, GptOssForCausalLM
+
+    torch.manual_seed(seed)
+    config = GptOssConfig(
+        vocab_size=97,
+        hidden_size=32,
+        intermediate_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=8,
+        num_local_experts=4,
+        num_experts_per_tok=2,
+        layer_types=['sliding_attention', 'full_attention'],
+        sliding_window=4,
+        pad_token_id=0,
+        eos_token_id=1,
+    )
+    config._attn_implementation = 'eager'
+    model = GptOssForCausalLM(config).float()
+
+    input_ids = torch.randint(2, config.vocab_size, (2, 13))
+    labels = input_ids.clone()
+    labels[:, :4] = IGNORE_INDEX
+    labels[1, 9:] = IGNORE_INDEX
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 11:] = 0
+
+    model.zero_grad()
+    reference = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels).loss
+    reference.backward()
+    reference_grad = model.lm_head.weight.grad.clone()
+
+    model.zero_grad()
+    chunked = compute_chunked_causal_lm_loss(
+        model, {'input_ids': input_ids, 'attention_mask': attention_mask, 'labels': labels}, chunk_size
+    )
+    chunked.backward()
+    chunked_grad = model.lm_head.weight.grad.clone()
+
+    return {
+        'reference_loss': reference.item(),
+        'chunked_loss': chunked.item(),
+        'loss_abs_diff': abs(reference.item() - chunked.item()),
+        'grad_max_abs_diff': (reference_grad - chunked_grad).abs().max().item(),
+    }
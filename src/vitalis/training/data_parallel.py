@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+CPU Data-Parallel LoRA Training
+Runs N gloo ranks on one machine that share the frozen base weights through a memory-mapped
+file, so adding ranks adds throughput without adding copies of the base model
+"""
+
+import os
+import json
+import socket
+import hashlib
+import logging
+import time
+import torch
+import torch.multiprocessing as mp
+from pathlib import Path
+from typing import Dict, Optional
+from transformers import AutoConfig, AutoModelForCausalLM
+
+# Environment variable the launcher uses to hand the shared weight file to each rank
+SHARED_BASE_ENV = "VITALIS_SHARED_BASE"
+
+
+def shared_base_path(model_path: str, cache_dir: str, dtype: torch.dtype = torch.bfloat16) -> Path:
+    """Shared weight file for a checkpoint and dtype; the key changes when the checkpoint does"""
+    model_dir = Path(model_path).resolve()
+    stamps = [str(model_dir), str(dtype)]
+    for name in ('config.json', 'model.safetensors.index.json'):
+        path = model_dir / name
+        if path.exists():
+            stamps.append(f"{name}:{path.stat().st_size}:{path.stat().st_mtime_ns}")
+    key = hashlib.sha1('|'.join(stamps).encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"base-{key}.pt"
+
+
+def export_shared_base(model, path: Path) -> Path:
+    """
+    Write every parameter and buffer of a loaded model to one torch.save file
+
+    Non-persistent buffers (rotary frequencies) are included so a model built on the
+    meta device can be completed from the file alone
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tensors = {name: tensor.detach().cpu() for name, tensor in model.named_parameters()}
+    tensors.update({name: tensor.cpu() for name, tensor in model.named_buffers()})
+    tmp_path = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+    torch.save(tensors, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def prepare_shared_base(model_path: str, cache_dir: str, dtype: torch.dtype = torch.bfloat16) -> Path:
+    """Load the base model once and export it for the ranks, unless the file already exists"""
+    path = shared_base_path(model_path, cache_dir, dtype)
+    if path.exists():
+        logging.info(f"Reusing shared base weights {path}")
+        return path
+
+    logging.info(f"Exporting base weights to {path} for memory-mapped sharing...")
+    start_time = time.time()
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path,
+        local_files_only=True,
+        trust_remote_code=True,
+        device_map="cpu",
+        torch_dtype=dtype,
+        low_cpu_mem_usage=True
+    )
+    model = model.to(dtype=dtype)
+    export_shared_base(model, path)
+    del model
+    logging.info(f"COMPLETED Shared base weights written in {time.time() - start_time:.1f}s "
+                 f"({path.stat().st_size / 1024**3:.1f} GB)")
+    return path
+
+
+def _assign(model, name: str, tensor: torch.Tensor):
+    module_name, _, leaf = name.rpartition('.')
+    module = model.get_submodule(module_name) if module_name else model
+    if leaf in module._parameters:
+        module._parameters[leaf] = torch.nn.Parameter(tensor, requires_grad=False)
+    else:
+        module._buffers[leaf] = tensor
+
+
+def load_shared_base(model_path: str, path: Path, dtype: torch.dtype = torch.bfloat16):
+    """
+    Base model whose tensors are views of the memory-mapped shared file
+
+    The model is built on the meta device and every tensor is assigned from
+    torch.load(mmap=True), so pages come from the page cache that all ranks share.
+    Frozen weights are never written, so no rank gets a private copy
+    """
+    config = AutoConfig.from_pretrained(model_path, local_files_only=True, trust_remote_code=True)
+    if hasattr(config, 'quantization_config'):
+        # The shared file holds dequantized weights
+        del config.quantization_config
+    with torch.device('meta'):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+
+    tensors = torch.load(path, mmap=True, weights_only=True, map_location='cpu')
+    for name, tensor in tensors.items():
+        _assign(model, name, tensor)
+
+    missing = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if missing:
+        raise ValueError(f"Shared base file {path} is missing {len(missing)} tensors, e.g. {missing[:3]}")
+    model.eval()
+    return model
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _run_rank(local_rank: int, world_size: int, config_path: str, shared_path: str, threads: int, port: int):
+    os.environ.update({
+        'RANK': str(local_rank),
+        'LOCAL_RANK': str(local_rank),
+        'WORLD_SIZE': str(world_size),
+        'MASTER_ADDR': '127.0.0.1',
+        'MASTER_PORT': str(port),
+        SHARED_BASE_ENV: shared_path,
+    })
+    torch.set_num_threads(threads)
+
+    from vitalis.training.lora_emergency_trainer import LoRAEmergencyTrainer
+
+    trainer = LoRAEmergencyTrainer(config_path)
+    if not trainer.run_complete_pipeline():
+        raise SystemExit(1)
+
+
+def launch_data_parallel(config_path: str, num_processes: int, threads_per_rank: Optional[int] = None,
+                         port: Optional[int] = None) -> Dict:
+    """
+    Train LoRAEmergencyTrainer on num_processes gloo ranks on this machine
+
+    The base model is exported once to <output_dir>/shared_base and every rank maps it.
+    Each rank trains on its shard of every batch order and DDP all-reduces only the
+    LoRA gradients (the only parameters that require grad)
+    """
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    if config.get('packed_experts', False):
+        # The shared file holds dense weights; ranks cannot map packed MXFP4 experts from it
+        raise ValueError("packed_experts is not supported with data-parallel training; "
+                         "disable it or train on a single process")
+
+    cache_dir = config.get('shared_base_dir', str(Path(config['output_dir']) / 'shared_base'))
+    shared_path = prepare_shared_base(config['model_path'], cache_dir)
+
+    threads = threads_per_rank or max(1, (os.cpu_count() or 1) // num_processes)
+    port = port or _free_port()
+    logging.info(f"LAUNCH Starting {num_processes} gloo ranks, {threads} threads each, base weights {shared_path}")
+
+    start_time = time.time()
+    mp.start_processes(
+        _run_rank,
+        args=(num_processes, config_path, str(shared_path), threads, port),
+        nprocs=num_processes,
+        join=True,
+        start_method='spawn'
+    )
+    return {
+        'num_processes': num_processes,
+        'threads_per_rank': threads,
+        'shared_base_path': str(shared_path),
+        'seconds': time.time() - start_time,
+    }
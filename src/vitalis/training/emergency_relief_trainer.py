@@ -11,145 +11,31 @@ import logging
 import time
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM, 
     TrainingArguments, 
-    Trainer,
-    DataCollatorForLanguageModeling,
     get_linear_schedule_with_warmup
 )
-from transformers.trainer_callback import TrainerCallback
 import numpy as np
 from typing import Dict, List, Optional, Any
 import warnings
 from pathlib import Path
-import psutil
-import gc
 
-warnings.filterwarnings("ignore")
-
-class EmergencyReliefDataset(Dataset):
-    """
-    Custom dataset for emergency relief training data
-    Handles conversation format and proper tokenization
-    """
-    
-    def __init__(self, data_path: str, tokenizer, max_length: int = 1024):
-        self.tokenizer = tokenizer
-        self.max_length = max_length
-        
-        # Load training data
-        with open(data_path, 'r') as f:
-            raw_data = json.load(f)
-        
-        self.examples = raw_data.get('training_data', [])
-        
-        # System prompt for emergency relief context
-        self.system_prompt = (
-            "You are an expert emergency relief coordinator. Provide detailed, "
-            "actionable guidance for disaster response, resource coordination, "
-            "and emergency management. Always prioritize safety and follow "
-            "established protocols."
-        )
-        
-        # Preprocess all examples
-        self.processed_examples = self._preprocess_examples()
-        
-        logging.info(f"Loaded {len(self.processed_examples)} training examples")
-    
-    def _preprocess_examples(self) -> List[Dict]:
-        """Preprocess examples into chat format"""
-        processed = []
-        
-        for example in self.examples:
-            # Create conversation format
-            conversation = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": example.get('instruction', '')},
-                {"role": "assistant", "content": example.get('response', '')}
-            ]
-            
-            # Apply chat template
-            try:
-                formatted_text = self.tokenizer.apply_chat_template(
-                    conversation,
-                    tokenize=False,
-                    add_generation_prompt=False
-                )
-                processed.append({
-                    'text': formatted_text,
-                    'metadata': example.get('metadata', {})
-                })
-            except Exception as e:
-                logging.warning(f"Failed to process example: {e}")
-                continue
-        
-        return processed
-    
-    def __len__(self):
-        return len(self.processed_examples)
-    
-    def __getitem__(self, idx):
-        example = self.processed_examples[idx]
-        
-        # Tokenize
-        encoding = self.tokenizer(
-            example['text'],
-            truncation=True,
-            max_length=self.max_length,
-            padding='max_length',
-            return_tensors='pt'
-        )
-        
-        return {
-            'input_ids': encoding['input_ids'].flatten(),
-            'attention_mask': encoding['attention_mask'].flatten(),
-            'labels': encoding['input_ids'].flatten().clone()
-        }
+from vitalis.data.pipeline import build_datasets, build_batching
+from vitalis.data.batching import subset_lengths
+from vitalis.utils.memory_planner import (
+    MemoryPlanner, GB, available_memory_bytes, dtype_name, format_plan, select_strategy, workload_from_config
+)
+from vitalis.training.vitalis_trainer import VitalisTrainer
+from vitalis.training.async_checkpoint import AsyncCheckpointWriter
+from vitalis.training.checkpoint_policy import apply_checkpoint_policy
+from vitalis.training.telemetry import telemetry_from_config
+from vitalis.training.lean_optimizers import build_optimizer, OptimizerReportCallback
+from vitalis.training.zero_sharding import ZERO_SHARDING_ENV, ShardedTrainer, init_process_group, load_sharded_model
+from vitalis.training.batch_autotune import autotune_from_config
 
-class MemoryMonitorCallback(TrainerCallback):
-    """
-    Callback to monitor memory usage during training
-    Critical for M4 MacBook Pro memory management
-    """
-    
-    def __init__(self, log_interval: int = 1):
-        self.log_interval = log_interval
-        self.step_count = 0
-    
-    def on_step_begin(self, args, state, control, **kwargs):
-        """Log before each step starts"""
-        print(f"PROCESSING Starting step {state.global_step + 1}/21...")
-    
-    def on_step_end(self, args, state, control, **kwargs):
-        self.step_count += 1
-        
-        if self.step_count % self.log_interval == 0:
-            # Get memory usage
-            memory_info = psutil.virtual_memory()
-            memory_percent = memory_info.percent
-            memory_used_gb = memory_info.used / (1024**3)
-            memory_total_gb = memory_info.total / (1024**3)
-            
-            # Get MPS memory if available
-            mps_memory = "N/A"
-            if torch.backends.mps.is_available():
-                try:
-                    mps_memory = f"{torch.mps.current_allocated_memory() / (1024**3):.2f}GB"
-                except:
-                    pass
-            
-            print(f"METRICS Step {state.global_step}: Memory {memory_used_gb:.2f}/{memory_total_gb:.2f}GB ({memory_percent:.1f}%), MPS: {mps_memory}")
-            logging.info(f"Step {state.global_step}: Memory {memory_used_gb:.2f}/{memory_total_gb:.2f}GB ({memory_percent:.1f}%), MPS: {mps_memory}")
-            
-            # Force garbage collection if memory usage is high
-            if memory_percent > 80:
-                logging.warning("High memory usage detected, forcing garbage collection")
-                gc.collect()
-                if torch.backends.mps.is_available():
-                    torch.mps.empty_cache()
+warnings.filterwarnings("ignore")
 
 class EmergencyReliefTrainer:
     """
@@ -159,6 +45,13 @@ class EmergencyReliefTrainer:
     
     def __init__(self, config_path: str):
         self.config = self._load_config(config_path)
+        
+        # ZeRO-3 sharding over gloo ranks (launch_sharded_training or torchrun)
+        self.zero_sharding = self.config.get('zero_sharding', False) or os.environ.get(ZERO_SHARDING_ENV) == '1'
+        self.world_size = int(os.environ.get('WORLD_SIZE', 1))
+        self.rank = int(os.environ.get('RANK', 0))
+        self.sharded = None
+        
         self.setup_logging()
         
         # Initialize components
@@ -166,6 +59,7 @@ class EmergencyReliefTrainer:
         self.model = None
         self.dataset = None
         self.trainer = None
+        self.telemetry = None
         
         logging.info("Emergency Relief Trainer initialized")
         logging.info(f"Configuration: {json.dumps(self.config, indent=2)}")
@@ -180,7 +74,8 @@ class EmergencyReliefTrainer:
         log_dir = Path(self.config['output_dir']) / 'logs'
         log_dir.mkdir(parents=True, exist_ok=True)
         
-        log_file = log_dir / f"training_{int(time.time())}.log"
+        rank_suffix = f"_rank{self.rank}" if self.world_size > 1 else ""
+        log_file = log_dir / f"training_{int(time.time())}{rank_suffix}.log"
         
         logging.basicConfig(
             level=logging.INFO,
@@ -216,6 +111,9 @@ class EmergencyReliefTrainer:
         """Load model with multiple fallback strategies"""
         logging.info("Loading GPT-OSS 20B model...")
         
+        if self.zero_sharding:
+            return self._load_sharded_model()
+        
         # Try different loading strategies
         strategies = [
             {
@@ -238,6 +136,9 @@ class EmergencyReliefTrainer:
             }
         ]
         
+        # Pick the strategy from config.json and the safetensors index before loading anything
+        strategies = self._plan_strategies(strategies)
+        
         for strategy in strategies:
             try:
                 logging.info(f"Trying: {strategy['name']}")
@@ -246,7 +147,7 @@ class EmergencyReliefTrainer:
                     self.config['model_path'],
                     local_files_only=True,
                     trust_remote_code=True,
-                    **{k: v for k, v in strategy.items() if k != 'name'}
+                    **{k: v for k, v in strategy.items() if k not in ('name', 'plan')}
                 )
                 
                 # Ensure consistent dtypes across all model components
@@ -260,9 +161,9 @@ class EmergencyReliefTrainer:
                 param_dtypes = {str(param.dtype) for param in self.model.parameters()}
                 logging.info(f"Model parameter dtypes after conversion: {param_dtypes}")
                 
-                # Enable gradient checkpointing for memory efficiency
+                # Gradient checkpointing on the layers selected by config['gradient_checkpointing']
                 if hasattr(self.model, 'gradient_checkpointing_enable'):
-                    self.model.gradient_checkpointing_enable()
+                    apply_checkpoint_policy(self.model, self.config.get('gradient_checkpointing', True))
                 
                 logging.info(f"COMPLETED Model loaded successfully with {strategy['name']}")
                 logging.info(f"Model device: {next(self.model.parameters()).device}")
@@ -277,27 +178,63 @@ class EmergencyReliefTrainer:
         logging.error("FAILED All model loading strategies failed")
         return False
     
+    def _load_sharded_model(self) -> bool:
+        """Build the model on the meta device and keep only this rank's parameter shards"""
+        try:
+            self.rank, self.world_size = init_process_group()
+            self.model, self.sharded = load_sharded_model(self.config['model_path'], self.rank, self.world_size)
+            if hasattr(self.model, 'gradient_checkpointing_enable'):
+                apply_checkpoint_policy(self.model, self.config.get('gradient_checkpointing', True))
+            return True
+        except Exception as e:
+            logging.error(f"FAILED Sharded model loading failed: {e}")
+            return False
+    
+    def _plan_strategies(self, strategies: List[Dict]) -> List[Dict]:
+        """
+        Keep only the first strategy the memory planner predicts will fit
+        Returns no strategies when none fits, and all of them if the planner cannot run
+        """
+        if not self.config.get('memory_plan', True):
+            return strategies
+        
+        try:
+            planner = MemoryPlanner(self.config['model_path'])
+            workload = workload_from_config(self.config, 'full')
+            budget = int(self.config['memory_budget_gb'] * GB) if 'memory_budget_gb' in self.config \
+                else available_memory_bytes()
+            chosen = select_strategy(planner, strategies, workload, budget)
+        except Exception as e:
+            logging.warning(f"WARNING Memory planner unavailable, trying all strategies: {e}")
+            return strategies
+        
+        if chosen is None:
+            smallest = min(
+                (planner.plan(dtype=dtype_name(s['torch_dtype']), **workload) for s in strategies),
+                key=lambda plan: plan['peak_bytes']
+            )
+            logging.error(f"FAILED No load strategy fits in {budget / GB:.1f} GB; smallest plan:")
+            for line in format_plan(smallest):
+                logging.error(line)
+            return []
+        
+        for line in format_plan(chosen['plan']):
+            logging.info(line)
+        return [chosen]
+    
     def prepare_dataset(self) -> bool:
-        """Prepare training dataset"""
+        """Prepare training and validation datasets"""
         try:
             logging.info("Preparing training dataset...")
             
-            self.dataset = EmergencyReliefDataset(
-                data_path=self.config['data_path'],
-                tokenizer=self.tokenizer,
-                max_length=self.config['max_length']
+            self.dataset, self.train_dataset, self.val_dataset = build_datasets(
+                self.config, self.tokenizer, self.config['max_length']
             )
             
-            # Split into train/validation
-            dataset_size = len(self.dataset)
-            train_size = int(0.9 * dataset_size)
-            val_size = dataset_size - train_size
-            
-            self.train_dataset, self.val_dataset = torch.utils.data.random_split(
-                self.dataset, [train_size, val_size]
+            logging.info(
+                f"COMPLETED Dataset prepared: {len(self.train_dataset)} train, "
+                f"{len(self.val_dataset)} validation"
             )
-            
-            logging.info(f"COMPLETED Dataset prepared: {train_size} train, {val_size} validation examples")
             return True
             
         except Exception as e:
@@ -309,6 +246,13 @@ class EmergencyReliefTrainer:
         try:
             logging.info("Setting up trainer...")
             
+            if self.sharded is not None:
+                return self._setup_sharded_trainer()
+            
+            # Measured micro-batch / accumulation split for the effective batch; saved with the model
+            if self.config.get('autotune_batch_size', False):
+                self._autotune_batch_size()
+            
             # Training arguments optimized for M4 MacBook Pro
             training_args = TrainingArguments(
                 output_dir=self.config['output_dir'],
@@ -336,21 +280,39 @@ class EmergencyReliefTrainer:
                 ddp_find_unused_parameters=False,
             )
             
-            # Data collator
-            data_collator = DataCollatorForLanguageModeling(
-                tokenizer=self.tokenizer,
-                mlm=False,
-                pad_to_multiple_of=8
-            )
+            # Data collator and batch sampler for the configured batching mode
+            data_collator, train_batch_sampler = self._build_batching(training_args)
+            
+            # Full-model checkpoints are written in the background so save_steps does not stall training
+            checkpoint_writer = None
+            if self.config.get('async_checkpointing', True):
+                checkpoint_writer = AsyncCheckpointWriter(
+                    self.config['output_dir'],
+                    save_total_limit=training_args.save_total_limit,
+                    max_shard_size=int(self.config.get('checkpoint_shard_size_gb', 5) * GB)
+                )
+            
+            # Step throughput, time split and memory, sampled every telemetry_sample_every steps
+            self.telemetry = telemetry_from_config(self.config)
+            
+            # config['optimizer'] selects AdamW (Trainer default), adafactor, adamw_8bit or adamw_offload
+            optimizer = build_optimizer(self.model, self.config, training_args.learning_rate, training_args.weight_decay)
+            callbacks = [self.telemetry] if self.telemetry else []
+            callbacks.append(OptimizerReportCallback(self.config.get('optimizer', 'adamw')))
             
             # Create trainer
-            self.trainer = Trainer(
+            self.trainer = VitalisTrainer(
                 model=self.model,
                 args=training_args,
                 train_dataset=self.train_dataset,
                 eval_dataset=self.val_dataset,
                 data_collator=data_collator,
-                callbacks=[MemoryMonitorCallback(log_interval=1)]
+                train_batch_sampler=train_batch_sampler,
+                loss_mode=self.config.get('loss_mode', 'standard'),
+                loss_chunk_size=self.config.get('loss_chunk_size', 256),
+                checkpoint_writer=checkpoint_writer,
+                optimizers=(optimizer, None),
+                callbacks=callbacks
             )
             
             logging.info("COMPLETED Trainer setup complete")
@@ -360,6 +322,45 @@ class EmergencyReliefTrainer:
             logging.error(f"FAILED Failed to setup trainer: {e}")
             return False
     
+    def _autotune_batch_size(self):
+        """Replace batch_size and gradient_accumulation_steps by the fastest split of their product that fits"""
+        if self.world_size > 1:
+            # Each rank would probe on its own and could pick a different split
+            logging.info("IDEA Batch autotuning skipped for multi-rank training")
+            return
+        try:
+            lengths = subset_lengths(self.train_dataset)
+        except Exception:
+            # Streamed datasets have no lengths up front; probe at max_length only
+            lengths = None
+        effective_batch = self.config['batch_size'] * self.config['gradient_accumulation_steps']
+        result = autotune_from_config(self.model, self.config, 'full', effective_batch, self.config['max_length'], lengths)
+        self.config['batch_size'] = result['micro_batch_size']
+        self.config['gradient_accumulation_steps'] = result['gradient_accumulation_steps']
+        self.config['batch_autotune'] = result
+    
+    def _setup_sharded_trainer(self) -> bool:
+        """Training loop over this rank's shards; every rank reads its own slice of each epoch"""
+        data_collator, train_batch_sampler = build_batching(
+            self.config, self.tokenizer, self.model, self.train_dataset, self.config['max_length'],
+            self.config['batch_size'], self.config.get('seed', 42)
+        )
+        if train_batch_sampler is not None:
+            logging.info("IDEA Sharded training batches through a distributed sampler, not the length-grouped one")
+        if self.config.get('loss_mode', 'standard') == 'chunked':
+            logging.warning("WARNING Chunked loss bypasses the lm_head hooks sharding relies on; using the standard loss")
+        
+        self.trainer = ShardedTrainer(self.sharded, self.config, self.train_dataset, self.val_dataset, data_collator)
+        logging.info(f"COMPLETED Sharded trainer setup complete (rank {self.rank}/{self.world_size})")
+        return True
+    
+    def _build_batching(self, training_args: TrainingArguments):
+        """Collator and train batch sampler for config['batching_mode']"""
+        return build_batching(
+            self.config, self.tokenizer, self.model, self.train_dataset, self.config['max_length'],
+            training_args.per_device_train_batch_size, training_args.seed
+        )
+    
     def train(self) -> bool:
         """Execute the training process"""
         try:
@@ -392,6 +393,8 @@ class EmergencyReliefTrainer:
             output_path.mkdir(parents=True, exist_ok=True)
             
             self.trainer.save_model(str(output_path))
+            if self.rank != 0:
+                return
             self.tokenizer.save_pretrained(str(output_path))
             
             # Save training config
@@ -408,6 +411,11 @@ class EmergencyReliefTrainer:
         try:
             logging.info("Validating trained model...")
             
+            if self.sharded is not None:
+                # Sampled generations differ per rank, and every forward is a collective
+                logging.info("IDEA Skipping generation checks in sharded mode; validate the saved model instead")
+                return True
+            
             test_prompts = [
                 "How do you coordinate evacuation during a wildfire?",
                 "What are the essential supplies for emergency shelter setup?",
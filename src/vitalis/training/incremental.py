@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Incremental Adapter Training
+Diffs the training data against the content-hash manifest saved with the previous adapter,
+so a refresh trains on the new examples plus a replay sample of old ones, starting from the
+previous adapter weights and optimizer moments
+"""
+
+import json
+import random
+import logging
+import time
+import torch
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from transformers.trainer_callback import TrainerCallback
+
+# Saved next to the adapter: content hashes of the examples trained and validated on so far
+MANIFEST_FILE = "trained_examples.json"
+# Optimizer state_dict of the adapter's last step, so a refresh continues its moments
+OPTIMIZER_FILE = "optimizer.pt"
+
+
+def load_trained_examples(adapter_dir: Path) -> Optional[Dict]:
+    path = Path(adapter_dir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_trained_examples(adapter_dir: Path, train_hashes: Sequence[str], val_hashes: Sequence[str],
+                           previous: Optional[Dict], run: Dict) -> Path:
+    """
+    Manifest of everything the adapter has seen: the previous manifest's hashes plus this
+    run's, and one history entry per run
+    """
+    previous = previous or {'train': [], 'validation': [], 'runs': []}
+    train = sorted(set(previous['train']) | set(train_hashes))
+    validation = sorted((set(previous['validation']) | set(val_hashes)) - set(train))
+    manifest = {
+        'train': train,
+        'validation': validation,
+        'runs': previous['runs'] + [{'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), **run}],
+    }
+    path = Path(adapter_dir) / MANIFEST_FILE
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+
+def incremental_split(hashes: Sequence[str], train_indices: Sequence[int], val_indices: Sequence[int],
+                      manifest: Dict, replay_ratio: float, seed: int = 42) -> Tuple[List[int], List[int], Dict]:
+    """
+    Dataset rows to train and validate on in an incremental run
+
+    Examples the manifest lists keep their side (old training examples are replay
+    candidates, old validation examples stay in validation); new examples keep the side of
+    the current split. Training gets every new training example plus
+    round(replay_ratio * new) old ones sampled with seed
+    """
+    trained, validated = set(manifest['train']), set(manifest['validation'])
+    current_train = set(train_indices)
+    new_train, old_train, validation = [], [], []
+    for index in list(train_indices) + list(val_indices):
+        content = hashes[index]
+        if content in trained:
+            old_train.append(index)
+        elif content in validated:
+            validation.append(index)
+        elif index in current_train:
+            new_train.append(index)
+        else:
+            validation.append(index)
+
+    replay_count = min(len(old_train), round(replay_ratio * len(new_train)))
+    replay = sorted(random.Random(seed).sample(old_train, replay_count))
+    counts = {'new_examples': len(new_train), 'replay_examples': len(replay), 'previous_examples': len(old_train),
+              'validation_examples': len(validation)}
+    return sorted(new_train + replay), sorted(validation), counts
+
+
+class OptimizerStateLoader(TrainerCallback):
+    """
+    Loads the previous adapter's optimizer moments into the freshly created optimizer
+
+    on_train_begin runs after the Trainer has built its optimizer and scheduler; only the
+    per-parameter state is taken over, while learning rate and the other group settings
+    stay those of the current run
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.loaded = False
+
+    def on_train_begin(self, args, state, control, optimizer=None, **kwargs):
+        if optimizer is None or not self.path.exists():
+            return
+        saved = torch.load(self.path, map_location='cpu', weights_only=False)
+        settings = [{k: v for k, v in group.items() if k != 'params'} for group in optimizer.param_groups]
+        try:
+            optimizer.load_state_dict(saved)
+        except ValueError as e:
+            logging.warning(f"WARNING Previous optimizer state does not match the adapter's parameters, starting fresh: {e}")
+            return
+        for group, setting in zip(optimizer.param_groups, settings):
+            group.update(setting)
+        self.loaded = True
+        logging.info(f"COMPLETED Optimizer moments restored from {self.path}")
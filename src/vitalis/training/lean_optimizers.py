@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Memory-Lean Optimizers
+Alternatives to AdamW's two full-precision moments per parameter for full fine-tuning:
+Adafactor's factored second moment, AdamW with 8-bit (float8) block-scaled state in plain
+PyTorch, and AdamW with its moments in memory-mapped files streamed one tensor at a time
+"""
+
+import gc
+import os
+import math
+import time
+import shutil
+import logging
+import numpy as np
+import torch
+from pathlib import Path
+from typing import Dict, List, Optional
+from transformers.trainer_callback import TrainerCallback
+
+# config['optimizer'] values; 'adamw' is the Trainer's default AdamW
+OPTIMIZERS = ('adamw', 'adafactor', 'adamw_8bit', 'adamw_offload')
+
+FP8_DTYPE = torch.float8_e4m3fn
+FP8_MAX = 448.0
+
+
+def no_weight_decay(name: str, param) -> bool:
+    """Biases, norm weights and other 1-D parameters are not decayed"""
+    return name.endswith('bias') or 'norm' in name or param.dim() < 2
+
+
+def decay_parameter_groups(model, weight_decay: float) -> List[Dict]:
+    """Trainable parameters split into decayed weights and undecayed biases / norm weights"""
+    decay, no_decay = [], []
+    for name, param in model.named_parameters():
+        if not param.requires_grad:
+            continue
+        (no_decay if no_weight_decay(name, param) else decay).append(param)
+    return [
+        {'params': decay, 'weight_decay': weight_decay},
+        {'params': no_decay, 'weight_decay': 0.0},
+    ]
+
+
+def _quantize_blocks(values: torch.Tensor, block_size: int):
+    """float32 values (a multiple of block_size long) -> float8 codes and one float32 scale per block"""
+    blocks = values.view(-1, block_size)
+    scales = blocks.abs().amax(dim=1).clamp(min=1e-30) / FP8_MAX
+    return (blocks / scales[:, None]).to(FP8_DTYPE).view(-1), scales
+
+
+def _dequantize_blocks(codes: torch.Tensor, scales: torch.Tensor, block_size: int) -> torch.Tensor:
+    return (codes.view(-1, block_size).float() * scales[:, None]).view(-1)
+
+
+class AdamW8bit(torch.optim.Optimizer):
+    """
+    AdamW whose moments are stored in 8 bits
+
+    Both moments are kept as float8 (e4m3) codes with one float32 scale per block of
+    block_size values; the second moment is stored as its square root, which halves the
+    exponent range the codes must cover. Updates run in float32 over chunks of chunk_size
+    values, so the float32 working set stays bounded for the largest expert tensors.
+    State lives on the CPU (MPS has no float8) and costs about 2 bytes per parameter
+    instead of 8
+    """
+
+    def __init__(self, params, lr: float = 1e-3, betas=(0.9, 0.999), eps: float = 1e-8,
+                 weight_decay: float = 0.01, block_size: int = 256, chunk_size: int = 1 << 24):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super().__init__(params, defaults)
+        self.block_size = block_size
+        self.chunk_size = max(block_size, chunk_size // block_size * block_size)
+        self.last_step_seconds = 0.0
+
+    def _init_state(self, param: torch.Tensor) -> Dict:
+        padded = math.ceil(param.numel() / self.block_size) * self.block_size
+        num_blocks = padded // self.block_size
+        return {
+            'step': 0,
+            'exp_avg': torch.zeros(padded, dtype=FP8_DTYPE),
+            'exp_avg_scale': torch.zeros(num_blocks, dtype=torch.float32),
+            'exp_avg_sq_sqrt': torch.zeros(padded, dtype=FP8_DTYPE),
+            'exp_avg_sq_sqrt_scale': torch.zeros(num_blocks, dtype=torch.float32),
+        }
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        start_time = time.perf_counter()
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            lr, eps, weight_decay = group['lr'], group['eps'], group['weight_decay']
+            for param in group['params']:
+                if param.grad is None:
+                    continue
+                state = self.state[param]
+                if not state:
+                    state.update(self._init_state(param))
+                state['step'] += 1
+                bias_correction1 = 1 - beta1 ** state['step']
+                bias_correction2 = 1 - beta2 ** state['step']
+
+                flat_param = param.view(-1)
+                flat_grad = param.grad.view(-1)
+                numel = flat_param.numel()
+                for start in range(0, numel, self.chunk_size):
+                    end = min(start + self.chunk_size, numel)
+                    first_block = start // self.block_size
+                    last_block = math.ceil(end / self.block_size)
+                    span = slice(first_block * self.block_size, last_block * self.block_size)
+                    blocks = slice(first_block, last_block)
+
+                    grad = torch.zeros(span.stop - span.start, dtype=torch.float32)
+                    grad[:end - start] = flat_grad[start:end].cpu()
+                    exp_avg = _dequantize_blocks(state['exp_avg'][span], state['exp_avg_scale'][blocks], self.block_size)
+                    exp_avg_sq = _dequantize_blocks(
+                        state['exp_avg_sq_sqrt'][span], state['exp_avg_sq_sqrt_scale'][blocks], self.block_size
+                    ).square_()
+
+                    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                    denom = (exp_avg_sq / bias_correction2).sqrt_().add_(eps)
+                    update = (exp_avg / bias_correction1).div_(denom)[:end - start]
+
+                    chunk = flat_param[start:end]
+                    if weight_decay:
+                        chunk.mul_(1 - lr * weight_decay)
+                    chunk.add_(update.to(device=chunk.device, dtype=chunk.dtype), alpha=-lr)
+
+                    state['exp_avg'][span], state['exp_avg_scale'][blocks] = _quantize_blocks(exp_avg, self.block_size)
+                    state['exp_avg_sq_sqrt'][span], state['exp_avg_sq_sqrt_scale'][blocks] = \
+                        _quantize_blocks(exp_avg_sq.sqrt_(), self.block_size)
+
+        self.last_step_seconds = time.perf_counter() - start_time
+        return loss
+
+
+class OffloadedAdamW(torch.optim.Optimizer):
+    """
+    AdamW whose float32 moments live in memory-mapped files under offload_dir
+
+    Parameters are updated in model order, one tensor and chunk_size values at a time, and
+    each tensor's file is flushed after its update, so the resident cost of the state is
+    one chunk plus whatever clean pages the OS keeps cached. A new optimizer starts from
+    zeroed files. state_dict carries the step counts and copies the moments into a
+    snapshot directory named after the step, which load_state_dict copies back, so a
+    checkpoint resumes from its own moments; the newest max_snapshots are kept
+    """
+
+    def __init__(self, params, offload_dir: str, lr: float = 1e-3, betas=(0.9, 0.999), eps: float = 1e-8,
+                 weight_decay: float = 0.01, chunk_size: int = 1 << 24, max_snapshots: int = 3):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super().__init__(params, defaults)
+        self.offload_dir = Path(offload_dir)
+        self.offload_dir.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.max_snapshots = max_snapshots
+        self.last_step_seconds = 0.0
+        self._moments: Dict[int, np.memmap] = {}
+        self._restored = False
+        self._index = {id(p): i for i, p in enumerate(p for group in self.param_groups for p in group['params'])}
+
+    def _moment_path(self, index: int) -> Path:
+        return self.offload_dir / f"moments_{index:05d}.bin"
+
+    def _moment_file(self, param: torch.Tensor) -> np.memmap:
+        index = self._index[id(param)]
+        if index not in self._moments:
+            path = self._moment_path(index)
+            shape = (2, param.numel())
+            expected = 2 * param.numel() * 4
+            # Files left by an earlier run are only reused when a state_dict restored them
+            restored = self._restored and path.exists() and path.stat().st_size == expected
+            self._moments[index] = np.memmap(path, dtype=np.float32, mode='r+' if restored else 'w+', shape=shape)
+        return self._moments[index]
+
+    def state_dict(self):
+        state = super().state_dict()
+        step = max((param_state['step'] for param_state in self.state.values()), default=0)
+        snapshot = self.offload_dir / f"snapshot-{step}"
+        tmp_snapshot = self.offload_dir / f".snapshot-{step}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_snapshot, ignore_errors=True)
+        tmp_snapshot.mkdir()
+        for index, moments in self._moments.items():
+            moments.flush()
+            shutil.copyfile(self._moment_path(index), tmp_snapshot / self._moment_path(index).name)
+        shutil.rmtree(snapshot, ignore_errors=True)
+        os.replace(tmp_snapshot, snapshot)
+
+        snapshots = sorted(self.offload_dir.glob('snapshot-*'), key=lambda path: int(path.name.split('-')[1]))
+        for old in snapshots[:-self.max_snapshots]:
+            shutil.rmtree(old, ignore_errors=True)
+        state['offload_snapshot'] = str(snapshot)
+        return state
+
+    def load_state_dict(self, state_dict):
+        state_dict = dict(state_dict)
+        snapshot = state_dict.pop('offload_snapshot', None)
+        if snapshot is None or not Path(snapshot).is_dir():
+            raise FileNotFoundError(f"Offloaded moments snapshot {snapshot} not found; cannot resume adamw_offload state")
+        super().load_state_dict(state_dict)
+
+        for moments in self._moments.values():
+            moments.flush()
+        self._moments = {}
+        for path in self.offload_dir.glob('moments_*.bin'):
+            path.unlink()
+        for path in Path(snapshot).glob('moments_*.bin'):
+            shutil.copyfile(path, self.offload_dir / path.name)
+        self._restored = True
+
+    def offloaded_bytes(self) -> int:
+        return sum(moments.nbytes for moments in self._moments.values())
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        start_time = time.perf_counter()
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            lr, eps, weight_decay = group['lr'], group['eps'], group['weight_decay']
+            for param in group['params']:
+                if param.grad is None:
+                    continue
+                state = self.state[param]
+                if not state:
+                    state['step'] = 0
+                state['step'] += 1
+                bias_correction1 = 1 - beta1 ** state['step']
+                bias_correction2 = 1 - beta2 ** state['step']
+
+                moments = self._moment_file(param)
+                flat_param = param.view(-1)
+                flat_grad = param.grad.view(-1)
+                for start in range(0, flat_param.numel(), self.chunk_size):
+                    end = min(start + self.chunk_size, flat_param.numel())
+                    exp_avg = torch.from_numpy(moments[0, start:end])
+                    exp_avg_sq = torch.from_numpy(moments[1, start:end])
+                    grad = flat_grad[start:end].to(device='cpu', dtype=torch.float32)
+
+                    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                    update = (exp_avg / bias_correction1).div_((exp_avg_sq / bias_correction2).sqrt_().add_(eps))
+
+                    chunk = flat_param[start:end]
+                    if weight_decay:
+                        chunk.mul_(1 - lr * weight_decay)
+                    chunk.add_(update.to(device=chunk.device, dtype=chunk.dtype), alpha=-lr)
+                moments.flush()
+
+        self.last_step_seconds = time.perf_counter() - start_time
+        return loss
+
+
+def optimizer_state_bytes(optimizer) -> Dict[str, int]:
+    """Resident bytes of every tensor in the optimizer state, plus bytes offloaded to files"""
+    # The Trainer hands callbacks accelerate's AcceleratedOptimizer, which hides the state of the one it wraps
+    optimizer = getattr(optimizer, 'optimizer', optimizer)
+    resident = sum(
+        value.numel() * value.element_size()
+        for state in optimizer.state.values() for value in state.values() if torch.is_tensor(value)
+    )
+    offloaded = optimizer.offloaded_bytes() if hasattr(optimizer, 'offloaded_bytes') else 0
+    return {'resident': resident, 'offloaded': offloaded}
+
+
+def build_optimizer(model, config: Dict, learning_rate: float, weight_decay: float,
+                    param_groups: Optional[List[Dict]] = None):
+    """
+    Optimizer for config['optimizer'], or None for 'adamw' (the Trainer builds its default)
+
+    'adafactor' is transformers' Adafactor with the external learning-rate schedule and no
+    first moment; 'adamw_8bit' and 'adamw_offload' are the classes above. param_groups
+    replaces the model's decay groups (sharded training optimizes flat shards)
+    """
+    name = config.get('optimizer', 'adamw')
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer '{name}', expected one of {OPTIMIZERS}")
+    if name == 'adamw':
+        return None
+
+    groups = param_groups or decay_parameter_groups(model, weight_decay)
+    if name == 'adafactor':
+        from transformers.optimization import Adafactor
+
+        return Adafactor(groups, lr=learning_rate, scale_parameter=False, relative_step=False,
+                         warmup_init=False, beta1=None)
+    if name == 'adamw_8bit':
+        return AdamW8bit(groups, lr=learning_rate, block_size=config.get('optimizer_block_size', 256))
+    return OffloadedAdamW(
+        groups, lr=learning_rate,
+        offload_dir=config.get('optimizer_offload_dir', str(Path(config['output_dir']) / 'optimizer_offload'))
+    )
+
+
+class OptimizerReportCallback(TrainerCallback):
+    """
+    Measures optimizer.step time and the optimizer state footprint
+
+    Adds optimizer_step_s (mean since the last log), optimizer_state_gb and
+    optimizer_offloaded_gb to the Trainer logs and prints a summary when training ends
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._start = 0.0
+        self._seconds = []
+        self.total_seconds = 0.0
+        self.steps = 0
+        self.footprint = {'resident': 0, 'offloaded': 0}
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._start = time.perf_counter()
+
+    def on_optimizer_step(self, args, state, control, optimizer=None, **kwargs):
+        seconds = time.perf_counter() - self._start
+        self._seconds.append(seconds)
+        self.total_seconds += seconds
+        self.steps += 1
+        if self.steps == 1 and optimizer is not None:
+            # State is allocated lazily on the first step and keeps its size afterwards
+            self.footprint = optimizer_state_bytes(optimizer)
+            logging.info(f"METRICS {self.name} state: {self.footprint['resident'] / 1024**3:.2f} GB resident, "
+                         f"{self.footprint['offloaded'] / 1024**3:.2f} GB offloaded")
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs is None or not self._seconds:
+            return
+        logs['optimizer_step_s'] = round(sum(self._seconds) / len(self._seconds), 4)
+        logs['optimizer_state_gb'] = round(self.footprint['resident'] / 1024**3, 3)
+        logs['optimizer_offloaded_gb'] = round(self.footprint['offloaded'] / 1024**3, 3)
+        self._seconds = []
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.steps:
+            print(f"METRICS Optimizer {self.name}: {self.total_seconds / self.steps:.2f}s per step, "
+                  f"state {self.footprint['resident'] / 1024**3:.2f} GB resident + "
+                  f"{self.footprint['offloaded'] / 1024**3:.2f} GB offloaded")
+
+
+def measure_optimizers(model, names: List[str], config: Dict, batch_size: int, seq_len: int,
+                       steps: int = 3, learning_rate: float = 1e-5) -> List[Dict]:
+    """
+    Optimizer step time and state footprint for each optimizer on random token batches
+
+    The same model is trained by each optimizer in turn; weights drift, which does not
+    matter for timing and memory
+    """
+    device = next(model.parameters()).device
+    vocab_size = model.config.vocab_size
+    model.train()
+
+    results = []
+    for name in names:
+        optimizer = build_optimizer(model, {**config, 'optimizer': name}, learning_rate, 0.01)
+        if optimizer is None:
+            optimizer = torch.optim.AdamW(decay_parameter_groups(model, 0.01), lr=learning_rate)
+        step_times = []
+        for _ in range(steps + 1):
+            input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+            model(input_ids=input_ids, labels=input_ids, use_cache=False).loss.backward()
+            start_time = time.perf_counter()
+            optimizer.step()
+            step_times.append(time.perf_counter() - start_time)
+            optimizer.zero_grad(set_to_none=True)
+
+        footprint = optimizer_state_bytes(optimizer)
+        step_times = sorted(step_times[1:])
+        results.append({
+            'optimizer': name,
+            'step_seconds': step_times[len(step_times) // 2],
+            'state_bytes': footprint['resident'],
+            'offloaded_bytes': footprint['offloaded'],
+            'state_bytes_per_parameter': footprint['resident'] / sum(p.numel() for p in model.parameters() if p.requires_grad),
+        })
+        logging.info(f"METRICS {name}: {results[-1]['step_seconds']:.2f}s/step, "
+                     f"state {footprint['resident'] / 1024**3:.2f} GB (+{footprint['offloaded'] / 1024**3:.2f} GB offloaded)")
+        del optimizer
+        gc.collect()
+    return results
@@ -13,85 +13,42 @@ import torch
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM, 
-    TrainingArguments, 
-    Trainer,
-    DataCollatorForLanguageModeling
+    TrainingArguments
 )
 from peft import LoraConfig, get_peft_model, TaskType, PeftModel
-from torch.utils.data import Dataset
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Optional
 import warnings
 from pathlib import Path
 import psutil
 import gc
 
-warnings.filterwarnings("ignore")
+from vitalis.data.pipeline import build_datasets, build_batching, resolve_backend, training_data_path
+from vitalis.data.batching import GroupedBatchSampler, subset_lengths
+from vitalis.data.dedup import example_category
+from vitalis.data.packing import PackedDataset
+from vitalis.data.streaming import iter_training_examples
+from vitalis.utils.memory_planner import MemoryPlanner, GB, available_memory_bytes, format_plan, workload_from_config
+from vitalis.training.vitalis_trainer import VitalisTrainer
+from vitalis.training.adapter_checkpoint import AdapterCheckpointCallback
+from vitalis.training.async_checkpoint import AsyncCheckpointWriter, latest_checkpoint
+from vitalis.training.checkpoint_policy import apply_checkpoint_policy, describe_checkpoint_modes
+from vitalis.training.data_parallel import SHARED_BASE_ENV, load_shared_base
+from vitalis.training.mxfp4_experts import load_packed_mxfp4_model
+from vitalis.training.telemetry import telemetry_from_config
+from vitalis.training.batch_autotune import autotune_from_config
+from vitalis.training.incremental import (
+    OPTIMIZER_FILE, OptimizerStateLoader, incremental_split, load_trained_examples, write_trained_examples
+)
+from vitalis.training.category_adapters import (
+    AdapterRoutingCollator, AdapterTaggedDataset, MultiAdapterTrainer, adapter_assignments,
+    attach_category_adapters, resolve_adapter_groups, write_manifest
+)
+from vitalis.training.prefix_cache import (
+    PrefixCachedDataset, PrefixEmbedsCollator, decoder_layer_range, load_or_build_prefix_cache
+)
 
-class EmergencyReliefDataset(Dataset):
-    """Lightweight dataset for LoRA training"""
-    
-    def __init__(self, data_path: str, tokenizer, max_length: int = 512):
-        self.tokenizer = tokenizer
-        self.max_length = max_length
-        
-        with open(data_path, 'r') as f:
-            raw_data = json.load(f)
-        
-        self.examples = raw_data.get('training_data', [])
-        
-        self.system_prompt = (
-            "You are an expert emergency relief coordinator. Provide detailed, "
-            "actionable guidance for disaster response, resource coordination, "
-            "and emergency management. Always prioritize safety and follow "
-            "established protocols."
-        )
-        
-        self.processed_examples = self._preprocess_examples()
-        logging.info(f"Loaded {len(self.processed_examples)} training examples for LoRA")
-    
-    def _preprocess_examples(self) -> List[Dict]:
-        processed = []
-        
-        for example in self.examples:
-            conversation = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": example.get('instruction', '')},
-                {"role": "assistant", "content": example.get('response', '')}
-            ]
-            
-            try:
-                formatted_text = self.tokenizer.apply_chat_template(
-                    conversation,
-                    tokenize=False,
-                    add_generation_prompt=False
-                )
-                processed.append({'text': formatted_text})
-            except Exception as e:
-                logging.warning(f"Failed to process example: {e}")
-                continue
-        
-        return processed
-    
-    def __len__(self):
-        return len(self.processed_examples)
-    
-    def __getitem__(self, idx):
-        example = self.processed_examples[idx]
-        
-        encoding = self.tokenizer(
-            example['text'],
-            truncation=True,
-            max_length=self.max_length,
-            padding='max_length',
-            return_tensors='pt'
-        )
-        
-        return {
-            'input_ids': encoding['input_ids'].flatten(),
-            'attention_mask': encoding['attention_mask'].flatten(),
-            'labels': encoding['input_ids'].flatten().clone()
-        }
+warnings.filterwarnings("ignore")
 
 class LoRAEmergencyTrainer:
     """
@@ -100,6 +57,10 @@ class LoRAEmergencyTrainer:
     
     def __init__(self, config_path: str):
         self.config = self._load_config(config_path)
+        # Set by launch_data_parallel for each gloo rank
+        self.world_size = int(os.environ.get('WORLD_SIZE', 1))
+        self.rank = int(os.environ.get('RANK', 0))
+        self.shared_base_path = os.environ.get(SHARED_BASE_ENV)
         self.setup_logging()
         
         self.tokenizer = None
@@ -107,6 +68,16 @@ class LoRAEmergencyTrainer:
         self.peft_model = None
         self.dataset = None
         self.trainer = None
+        self.telemetry = None
+        self.checkpoint_callback = None
+        self.prefix_cache = None
+        self.adapter_groups = None
+        self.adapter_assignments = None
+        self.previous_adapter = None
+        self.previous_manifest = None
+        self.incremental_counts = None
+        self.up_to_date = False  # Incremental run with no new examples: nothing to train
+        self.max_length = self.config.get('lora_max_length', 512)  # Reduced for memory efficiency
         
         logging.info("LoRA Emergency Relief Trainer initialized")
     
@@ -118,7 +89,8 @@ class LoRAEmergencyTrainer:
         log_dir = Path(self.config['output_dir']) / 'logs'
         log_dir.mkdir(parents=True, exist_ok=True)
         
-        log_file = log_dir / f"lora_training_{int(time.time())}.log"
+        rank_suffix = f"_rank{self.rank}" if self.world_size > 1 else ""
+        log_file = log_dir / f"lora_training_{int(time.time())}{rank_suffix}.log"
         
         logging.basicConfig(
             level=logging.INFO,
@@ -144,9 +116,32 @@ class LoRAEmergencyTrainer:
             
             logging.info("COMPLETED Tokenizer loaded")
             
+            if self.shared_base_path:
+                if self.config.get('packed_experts', False):
+                    print("FAILED packed_experts is not supported with data-parallel training")
+                    logging.error("FAILED Shared base weights are dense; disable packed_experts or train on one process")
+                    return False
+                # Data-parallel rank: map the base weights the launcher exported (planned by the launcher)
+                logging.info(f"Mapping shared base weights from {self.shared_base_path}...")
+                self.model = load_shared_base(self.config['model_path'], Path(self.shared_base_path))
+                print(f"COMPLETED Rank {self.rank}/{self.world_size}: base weights memory-mapped")
+                return True
+            
+            # Predict peak memory from config.json and the safetensors index before loading
+            if not self._check_memory_plan():
+                return False
+            
             logging.info("Loading base model for LoRA...")
             print("Loading model (this may take a few minutes)...")
             
+            if self.config.get('packed_experts', False):
+                # Experts stay MXFP4 and are dequantized per forward; LoRA only touches attention
+                print("PROCESSING Loading with MXFP4 experts kept packed...")
+                self.model = load_packed_mxfp4_model(self.config['model_path'])
+                logging.info("COMPLETED Base model loaded with packed experts")
+                print("COMPLETED Base model loaded successfully")
+                return True
+            
             # Try MPS first, fallback to CPU
             try:
                 if torch.backends.mps.is_available():
@@ -193,30 +188,78 @@ class LoRAEmergencyTrainer:
             print(f"FAILED Failed to load model: {e}")
             return False
     
+    def _check_memory_plan(self) -> bool:
+        """False when the planner predicts the LoRA run cannot fit in memory"""
+        if not self.config.get('memory_plan', True):
+            return True
+        
+        try:
+            planner = MemoryPlanner(self.config['model_path'])
+            plan = planner.plan(
+                dtype='mxfp4' if self.config.get('packed_experts', False) else 'bfloat16',
+                **workload_from_config(self.config, 'lora', batch_size=self.config.get('lora_batch_size', 1),
+                                       seq_len=self.max_length)
+            )
+            budget = int(self.config['memory_budget_gb'] * GB) if 'memory_budget_gb' in self.config \
+                else available_memory_bytes()
+        except Exception as e:
+            logging.warning(f"WARNING Memory planner unavailable: {e}")
+            return True
+        
+        for line in format_plan(plan):
+            logging.info(line)
+        if plan['peak_bytes'] > budget:
+            print(f"FAILED Predicted peak {plan['peak_bytes'] / GB:.1f} GB exceeds {budget / GB:.1f} GB available")
+            logging.error("FAILED LoRA run does not fit in memory; see the plan above")
+            return False
+        
+        print(f"COMPLETED Memory plan: {plan['peak_bytes'] / GB:.1f} GB predicted of {budget / GB:.1f} GB available")
+        return True
+    
     def setup_lora(self) -> bool:
         """Set up LoRA configuration"""
         try:
             logging.info("Setting up LoRA configuration...")
             print("CONFIG Setting up LoRA for parameter-efficient training...")
             
+            # Optionally confine the adapters to the upper layers (lora_first_layer onwards)
+            layer_kwargs = {}
+            first_layer = self.config.get('lora_first_layer', 0)
+            if first_layer:
+                layer_kwargs['layers_to_transform'] = list(range(first_layer, self.model.config.num_hidden_layers))
+                print(f"CONFIG LoRA on layers {first_layer}-{self.model.config.num_hidden_layers - 1}")
+            
             # LoRA configuration optimized for emergency relief training
             lora_config = LoraConfig(
                 task_type=TaskType.CAUSAL_LM,
                 inference_mode=False,
-                r=8,  # Reduced rank for lower memory usage
-                lora_alpha=16,  # Reduced scaling parameter
-                lora_dropout=0.1,  # Dropout for regularization
-                target_modules=["q_proj", "v_proj"],  # Fewer target modules for memory efficiency
-                bias="none"
+                r=self.config.get('lora_r', 8),  # Reduced rank for lower memory usage
+                lora_alpha=self.config.get('lora_alpha', 16),  # Reduced scaling parameter
+                lora_dropout=self.config.get('lora_dropout', 0.1),  # Dropout for regularization
+                target_modules=self.config.get('lora_target_modules', ["q_proj", "v_proj"]),  # Fewer target modules for memory efficiency
+                bias="none",
+                **layer_kwargs
             )
             
-            # Enable gradient checkpointing before applying LoRA
+            # Enable gradient checkpointing before applying LoRA, on the layers the config selects
             if hasattr(self.model, 'gradient_checkpointing_enable'):
-                self.model.gradient_checkpointing_enable()
-                print("COMPLETED Gradient checkpointing enabled for memory efficiency")
-            
-            # Apply LoRA to the model
-            self.peft_model = get_peft_model(self.model, lora_config)
+                modes = apply_checkpoint_policy(self.model, self.config.get('gradient_checkpointing', True))
+                print(f"COMPLETED Gradient checkpointing: {describe_checkpoint_modes(modes)}")
+            
+            # Apply LoRA to the model: one adapter, one per category group, or the previous adapter to continue
+            self.previous_adapter = self._incremental_adapter()
+            if self.config.get('category_adapters'):
+                self.adapter_groups = self._category_adapter_groups()
+                self.peft_model = attach_category_adapters(self.model, lora_config, list(self.adapter_groups))
+                print(f"CONFIG {len(self.adapter_groups)} category adapters: {', '.join(self.adapter_groups)}")
+            elif self.previous_adapter is not None:
+                # The saved adapter's own LoRA configuration applies
+                self.previous_manifest = load_trained_examples(self.previous_adapter)
+                self.peft_model = PeftModel.from_pretrained(self.model, str(self.previous_adapter), is_trainable=True)
+                print(f"CONFIG Continuing adapter {self.previous_adapter} "
+                      f"({len(self.previous_manifest['train'])} examples trained so far)")
+            else:
+                self.peft_model = get_peft_model(self.model, lora_config)
             
             # Print trainable parameters
             trainable_params = self.peft_model.print_trainable_parameters()
@@ -230,27 +273,49 @@ class LoRAEmergencyTrainer:
             print(f"FAILED LoRA setup failed: {e}")
             return False
     
+    def teardown_lora(self):
+        """Remove the adapter from the base model and free the trainer, so another adapter can be attached"""
+        if self.trainer is not None and self.trainer.checkpoint_writer is not None:
+            self.trainer.checkpoint_writer.close()
+        if self.peft_model is not None:
+            self.model = self.peft_model.unload()
+        self.trainer = None
+        self.peft_model = None
+        self.checkpoint_callback = None
+        self.telemetry = None
+        self.adapter_groups = None
+        self.adapter_assignments = None
+        self.previous_adapter = None
+        self.previous_manifest = None
+        self.incremental_counts = None
+        self.up_to_date = False
+        gc.collect()
+        if torch.backends.mps.is_available():
+            torch.mps.empty_cache()
+    
     def prepare_dataset(self) -> bool:
         """Prepare training dataset"""
         try:
             logging.info("Preparing training dataset...")
             print("LIBRARY Preparing emergency relief training data...")
             
-            self.dataset = EmergencyReliefDataset(
-                data_path=self.config['data_path'],
-                tokenizer=self.tokenizer,
-                max_length=512  # Reduced for memory efficiency
+            self.dataset, self.train_dataset, self.val_dataset = build_datasets(
+                self.config, self.tokenizer, self.max_length
             )
             
-            # Split dataset
-            dataset_size = len(self.dataset)
-            train_size = int(0.9 * dataset_size)
-            val_size = dataset_size - train_size
+            # Incremental runs train on examples the previous adapter has not seen, plus a replay sample
+            if self.previous_manifest is not None:
+                self._select_incremental_examples()
+                if self.up_to_date:
+                    return True
             
-            self.train_dataset, self.val_dataset = torch.utils.data.random_split(
-                self.dataset, [train_size, val_size]
-            )
+            if self._use_prefix_cache():
+                self._attach_prefix_cache()
+            
+            if self.adapter_groups:
+                self._route_category_adapters()
             
+            train_size, val_size = len(self.train_dataset), len(self.val_dataset)
             logging.info(f"COMPLETED Dataset prepared: {train_size} train, {val_size} validation")
             print(f"COMPLETED Dataset ready: {train_size} training, {val_size} validation examples")
             
@@ -267,23 +332,28 @@ class LoRAEmergencyTrainer:
             logging.info("Setting up LoRA trainer...")
             print("SETTINGS Setting up memory-efficient trainer...")
             
+            # Measured micro-batch / accumulation split for the effective batch; saved with the adapter
+            if self.config.get('autotune_batch_size', False):
+                self._autotune_batch_size()
+            
             # Training arguments optimized for LoRA and memory efficiency
             training_args = TrainingArguments(
                 output_dir=self.config['output_dir'],
                 overwrite_output_dir=True,
                 num_train_epochs=3,
-                per_device_train_batch_size=1,
+                max_steps=self.config.get('lora_max_steps', -1),  # Caps short runs such as sweep trials
+                per_device_train_batch_size=self.config.get('lora_batch_size', 1),
                 per_device_eval_batch_size=1,
-                gradient_accumulation_steps=8,  # Larger accumulation for LoRA
-                learning_rate=1e-4,  # Higher learning rate for LoRA
+                gradient_accumulation_steps=self.config.get('lora_gradient_accumulation_steps', 8),  # Larger accumulation for LoRA
+                learning_rate=self.config.get('lora_learning_rate', 1e-4),  # Higher learning rate for LoRA
                 weight_decay=0.01,
                 warmup_steps=20,
                 logging_steps=1,
-                save_steps=10,
                 eval_steps=10,
-                save_total_limit=2,
                 eval_strategy="steps",
-                load_best_model_at_end=True,
+                # Checkpoints and best-model restore are handled by AdapterCheckpointCallback
+                save_strategy="no",
+                load_best_model_at_end=False,
                 metric_for_best_model="eval_loss",
                 greater_is_better=False,
                 fp16=False,
@@ -293,22 +363,44 @@ class LoRAEmergencyTrainer:
                 report_to=None,
                 ddp_find_unused_parameters=False,
                 dataloader_num_workers=0,  # Reduce memory usage
+                ddp_backend="gloo" if self.world_size > 1 else None,  # CPU data-parallel ranks
             )
             
-            # Data collator
-            data_collator = DataCollatorForLanguageModeling(
-                tokenizer=self.tokenizer,
-                mlm=False,
-                pad_to_multiple_of=8
+            # Data collator and batch sampler for the configured batching mode
+            data_collator, train_batch_sampler = self._build_batching(training_args)
+            
+            # Adapter-only checkpoints, written in the background: no base weights are written or reloaded
+            checkpoint_writer = AsyncCheckpointWriter(self.config['output_dir'], save_total_limit=2)
+            self.checkpoint_callback = AdapterCheckpointCallback(
+                output_dir=self.config['output_dir'],
+                save_steps=10,
+                save_total_limit=2,
+                metric_for_best_model=training_args.metric_for_best_model,
+                greater_is_better=training_args.greater_is_better,
+                writer=checkpoint_writer,
+                adapter_names=list(self.adapter_groups) if self.adapter_groups else None,
+                keep_best_optimizer=not self.adapter_groups
             )
             
-            # Create trainer
-            self.trainer = Trainer(
+            # Step throughput, time split and memory; each data-parallel rank writes its own file
+            self.telemetry = telemetry_from_config(self.config, rank=self.rank)
+            
+            # Create trainer; with category adapters each batch activates its adapter
+            trainer_class, adapter_kwargs = VitalisTrainer, {}
+            if self.adapter_groups:
+                trainer_class, adapter_kwargs = MultiAdapterTrainer, {'adapter_names': list(self.adapter_groups)}
+            self.trainer = trainer_class(
                 model=self.peft_model,
                 args=training_args,
                 train_dataset=self.train_dataset,
                 eval_dataset=self.val_dataset,
-                data_collator=data_collator
+                data_collator=data_collator,
+                train_batch_sampler=train_batch_sampler,
+                callbacks=[self.checkpoint_callback] + ([self.telemetry] if self.telemetry else []),
+                checkpoint_writer=checkpoint_writer,
+                loss_mode=self.config.get('loss_mode', 'standard'),
+                loss_chunk_size=self.config.get('loss_chunk_size', 256),
+                **adapter_kwargs
             )
             
             logging.info("COMPLETED LoRA trainer setup complete")
@@ -320,6 +412,173 @@ class LoRAEmergencyTrainer:
             print(f"FAILED Trainer setup failed: {e}")
             return False
     
+    def _autotune_batch_size(self):
+        """Set lora_batch_size and lora_gradient_accumulation_steps to the fastest split of their product that fits"""
+        if self.world_size > 1 or self.prefix_cache is not None:
+            # Ranks must agree on the split, and cached prefixes replace the token inputs the probes use
+            logging.info("IDEA Batch autotuning skipped for data-parallel ranks and prefix-cached training")
+            return
+        try:
+            lengths = subset_lengths(self.train_dataset)
+        except Exception:
+            # Streamed datasets have no lengths up front; probe at max_length only
+            lengths = None
+        effective_batch = self.config.get('lora_batch_size', 1) * self.config.get('lora_gradient_accumulation_steps', 8)
+        result = autotune_from_config(self.peft_model, self.config, 'lora', effective_batch, self.max_length, lengths)
+        self.config['lora_batch_size'] = result['micro_batch_size']
+        self.config['lora_gradient_accumulation_steps'] = result['gradient_accumulation_steps']
+        self.config['batch_autotune'] = result
+        print(f"SETTINGS Autotuned batch: {result['micro_batch_size']} x {result['gradient_accumulation_steps']} accumulation steps")
+    
+    def _build_batching(self, training_args: TrainingArguments):
+        """Collator and train batch sampler for config['batching_mode']"""
+        data_collator, train_batch_sampler = build_batching(
+            self.config, self.tokenizer, self.model, self.train_dataset, self.max_length,
+            training_args.per_device_train_batch_size, training_args.seed
+        )
+        if self.prefix_cache is not None:
+            data_collator = PrefixEmbedsCollator(data_collator, padding_side=self.tokenizer.padding_side)
+        if self.adapter_groups:
+            # Batches never mix adapters; bucketed mode still groups lengths within each adapter
+            data_collator = AdapterRoutingCollator(data_collator, list(self.adapter_groups))
+            bucketed = self.config.get('batching_mode', 'bucketed') == 'bucketed'
+            train_batch_sampler = GroupedBatchSampler(
+                [self.adapter_assignments[i] for i in self.train_dataset.indices],
+                training_args.per_device_train_batch_size,
+                lengths=subset_lengths(self.train_dataset) if bucketed else None,
+                seed=training_args.seed
+            )
+        return data_collator, train_batch_sampler
+    
+    def _incremental_adapter(self) -> Optional[Path]:
+        """Previous adapter to continue when config['incremental'] is set, None for a run from scratch"""
+        if not self.config.get('incremental', False):
+            return None
+        if self.config.get('category_adapters'):
+            raise ValueError("incremental training continues a single adapter; category_adapters is not supported")
+        
+        adapter_dir = Path(self.config.get('incremental_from', Path(self.config['output_dir']) / 'emergency_relief_lora'))
+        if not (adapter_dir / 'adapter_config.json').exists() or load_trained_examples(adapter_dir) is None:
+            print(f"WARNING No previous adapter with a trained-examples manifest in {adapter_dir}; training from scratch")
+            return None
+        return adapter_dir
+    
+    def _select_incremental_examples(self):
+        """
+        Restrict training to new examples plus incremental_replay_ratio old ones per new
+        example; sets up_to_date when there are no new examples
+        """
+        if self.dataset is None:
+            raise ValueError("incremental training needs content hashes; the streaming backend is not supported")
+        
+        packed = self.config.get('batching_mode', 'bucketed') == 'packed'
+        train_indices, val_indices, self.incremental_counts = incremental_split(
+            self.dataset.content_hashes,
+            _split_indices(self.train_dataset),
+            _split_indices(self.val_dataset),
+            self.previous_manifest,
+            replay_ratio=self.config.get('incremental_replay_ratio', 0.5),
+            seed=self.config.get('split_seed', 42)
+        )
+        counts = self.incremental_counts
+        print(f"METRICS Incremental: {counts['new_examples']} new, {counts['replay_examples']} replayed of "
+              f"{counts['previous_examples']} previous, {counts['validation_examples']} validation examples")
+        if not counts['new_examples']:
+            print("COMPLETED No new examples since the previous adapter; nothing to train")
+            self.up_to_date = True
+            return
+        
+        self.train_dataset = torch.utils.data.Subset(self.dataset, train_indices)
+        self.val_dataset = torch.utils.data.Subset(self.dataset, val_indices)
+        if packed:
+            self.train_dataset = PackedDataset(self.train_dataset, self.max_length)
+            self.val_dataset = PackedDataset(self.val_dataset, self.max_length)
+    
+    def _category_adapter_groups(self) -> Dict[str, List[str]]:
+        """Adapter name -> categories for config['category_adapters'], from the categories in the data"""
+        if self.world_size > 1:
+            raise ValueError("category_adapters is not supported with data-parallel ranks")
+        if resolve_backend(self.config) == 'streaming' or self.config.get('batching_mode', 'bucketed') == 'packed':
+            raise ValueError("category_adapters needs per-example batches; streaming and packed batching are not supported")
+        
+        categories = [
+            example_category(example)
+            for example in iter_training_examples(training_data_path(self.config, self.tokenizer))
+        ]
+        return resolve_adapter_groups(self.config['category_adapters'], categories)
+    
+    def _route_category_adapters(self):
+        """Tag every example with its adapter and drop examples whose category has none"""
+        base = self.train_dataset.dataset
+        self.adapter_assignments = adapter_assignments(base.categories, self.adapter_groups)
+        tagged = AdapterTaggedDataset(base, self.adapter_assignments)
+        self.train_dataset = torch.utils.data.Subset(
+            tagged, [i for i in self.train_dataset.indices if self.adapter_assignments[i] >= 0]
+        )
+        self.val_dataset = torch.utils.data.Subset(
+            tagged, [i for i in self.val_dataset.indices if self.adapter_assignments[i] >= 0]
+        )
+        
+        for name, counts in self._adapter_example_counts().items():
+            print(f"METRICS Adapter {name}: {counts['train_examples']} train, {counts['val_examples']} validation examples")
+        skipped = self.adapter_assignments.count(-1)
+        if skipped:
+            print(f"WARNING {skipped} examples belong to no category adapter and are not trained on")
+    
+    def _adapter_example_counts(self) -> Dict[str, Dict[str, int]]:
+        counts = {}
+        for index, name in enumerate(self.adapter_groups):
+            counts[name] = {
+                'train_examples': sum(1 for i in self.train_dataset.indices if self.adapter_assignments[i] == index),
+                'val_examples': sum(1 for i in self.val_dataset.indices if self.adapter_assignments[i] == index),
+            }
+        return counts
+    
+    def evaluate_category_adapters(self) -> Dict[str, Dict[str, float]]:
+        """Eval loss of every adapter on its own categories' validation examples"""
+        metrics = {}
+        for index, name in enumerate(self.adapter_groups):
+            indices = [i for i in self.val_dataset.indices if self.adapter_assignments[i] == index]
+            if not indices:
+                continue
+            result = self.trainer.evaluate(
+                eval_dataset=torch.utils.data.Subset(self.val_dataset.dataset, indices),
+                metric_key_prefix=f"eval_{name}"
+            )
+            metrics[name] = {'eval_loss': result.get(f"eval_{name}_loss")}
+            print(f"METRICS Adapter {name}: eval loss {metrics[name]['eval_loss']:.4f}")
+        return metrics
+    
+    def _use_prefix_cache(self) -> bool:
+        """prefix_activation_cache needs frozen lower layers and random access to unpacked examples"""
+        if not self.config.get('prefix_activation_cache', False):
+            return False
+        if not self.config.get('lora_first_layer', 0):
+            print("WARNING prefix_activation_cache needs lora_first_layer > 0; running the full model")
+            return False
+        if self.dataset is None or self.config.get('batching_mode', 'bucketed') == 'packed':
+            print("WARNING prefix_activation_cache does not support streaming or packed batches; running the full model")
+            return False
+        return True
+    
+    def _attach_prefix_cache(self):
+        """Compute the frozen layers once per example and train on their cached output"""
+        num_prefix_layers = self.config['lora_first_layer']
+        cache_dir = self.config.get('prefix_cache_dir', str(Path(self.config['output_dir']) / 'prefix_cache'))
+        print(f"PROCESSING Caching activations of the {num_prefix_layers} frozen layers...")
+        
+        self.prefix_cache = load_or_build_prefix_cache(
+            self.peft_model, self.dataset, num_prefix_layers, cache_dir,
+            dtype=next(self.model.parameters()).dtype
+        )
+        cached = PrefixCachedDataset(self.dataset, self.prefix_cache, padding_side=self.tokenizer.padding_side)
+        self.train_dataset = torch.utils.data.Subset(cached, self.train_dataset.indices)
+        self.val_dataset = torch.utils.data.Subset(cached, self.val_dataset.indices)
+        
+        meta = self.prefix_cache.meta
+        print(f"COMPLETED Prefix cache ready: {meta['num_tokens']} tokens, "
+              f"{meta['num_tokens'] * meta['hidden_size'] * self.prefix_cache.dtype.itemsize / 1024**3:.1f} GB memory-mapped")
+    
     def train(self) -> bool:
         """Execute LoRA training"""
         try:
@@ -330,15 +589,30 @@ class LoRAEmergencyTrainer:
             # Force garbage collection before training
             gc.collect()
             
-            # Start training
-            train_result = self.trainer.train()
+            # Resume an interrupted run from its latest adapter checkpoint
+            resume_from = self._resume_checkpoint()
+            if resume_from:
+                print(f"PROCESSING Resuming from {resume_from} (adapter, optimizer, scheduler and RNG state)")
+                self.checkpoint_callback.restore_best(resume_from)
+            
+            # An incremental run continues the previous adapter's optimizer moments
+            if self.previous_adapter is not None and not resume_from:
+                self.trainer.add_callback(OptimizerStateLoader(self.previous_adapter / OPTIMIZER_FILE))
+            
+            # Start training; with a prefix cache only the trainable suffix layers run
+            if self.prefix_cache is not None:
+                with decoder_layer_range(self.peft_model, self.prefix_cache.meta['num_prefix_layers']):
+                    train_result = self.trainer.train(resume_from_checkpoint=resume_from)
+            else:
+                train_result = self.trainer.train(resume_from_checkpoint=resume_from)
             
             logging.info("COMPLETED LoRA training completed!")
             print("COMPLETED Emergency relief training completed successfully!")
             logging.info(f"Final train loss: {train_result.training_loss:.4f}")
             
-            # Save the LoRA adapter
-            self.save_lora_model()
+            # Save the LoRA adapter (once, from rank 0, when data-parallel)
+            if self.trainer.is_world_process_zero():
+                self.save_lora_model()
             
             return True
             
@@ -347,18 +621,47 @@ class LoRAEmergencyTrainer:
             print(f"FAILED Training failed: {e}")
             return False
     
+    def _resume_checkpoint(self) -> Optional[str]:
+        """Checkpoint to resume from: config['resume_from_checkpoint'] is a path, or true for the latest"""
+        resume = self.config.get('resume_from_checkpoint', False)
+        if not resume:
+            return None
+        if self.adapter_groups:
+            print("WARNING Resuming is not supported with category_adapters, starting a new run")
+            return None
+        if isinstance(resume, str):
+            return resume
+        checkpoint = latest_checkpoint(self.config['output_dir'])
+        if checkpoint is None:
+            print("WARNING No checkpoint found to resume from, starting a new run")
+        return checkpoint
+    
     def save_lora_model(self):
         """Save the LoRA adapter"""
         try:
             logging.info("Saving LoRA adapter...")
             print("SAVE Saving emergency relief LoRA model...")
             
-            output_path = Path(self.config['output_dir']) / 'emergency_relief_lora'
+            # Category adapters go to category_adapters/<adapter>/, described by adapters.json
+            adapter_dir = 'category_adapters' if self.adapter_groups else 'emergency_relief_lora'
+            output_path = Path(self.config['output_dir']) / adapter_dir
             output_path.mkdir(parents=True, exist_ok=True)
             
             # Save LoRA adapter
             self.peft_model.save_pretrained(str(output_path))
             self.tokenizer.save_pretrained(str(output_path))
+            if self.adapter_groups:
+                write_manifest(output_path, self.adapter_groups, self._adapter_example_counts(),
+                               self.evaluate_category_adapters())
+            else:
+                # Optimizer moments of the saved adapter and the content hashes trained on, for the next incremental run
+                optimizer_state = self._saved_adapter_optimizer_state()
+                if optimizer_state is not None:
+                    torch.save(optimizer_state, output_path / OPTIMIZER_FILE)
+                else:
+                    (output_path / OPTIMIZER_FILE).unlink(missing_ok=True)
+                    print("WARNING Optimizer state of the best adapter is unavailable; the next incremental run starts fresh moments")
+                self._write_trained_examples(output_path)
             
             # Save config
             with open(output_path / 'training_config.json', 'w') as f:
@@ -371,8 +674,29 @@ class LoRAEmergencyTrainer:
             logging.error(f"FAILED Failed to save model: {e}")
             print(f"FAILED Failed to save model: {e}")
     
+    def _saved_adapter_optimizer_state(self) -> Optional[Dict]:
+        """Optimizer state of the step whose adapter is saved: the best one when it was restored"""
+        callback = self.checkpoint_callback
+        if callback is None or callback.best_state is None:
+            # No evaluation picked a best adapter; the model holds the last step's
+            return self.trainer.optimizer.state_dict()
+        return callback.best_optimizer_state
+    
+    def _write_trained_examples(self, output_path: Path):
+        if self.dataset is None:
+            # Streamed examples are not hashed
+            return
+        hashes = self.dataset.content_hashes
+        train_hashes = [hashes[i] for i in _split_indices(self.train_dataset)]
+        val_hashes = [hashes[i] for i in _split_indices(self.val_dataset)]
+        run = {'mode': 'incremental' if self.previous_manifest else 'full',
+               **(self.incremental_counts or {'new_examples': len(train_hashes), 'validation_examples': len(val_hashes)})}
+        write_trained_examples(output_path, train_hashes, val_hashes, self.previous_manifest, run)
+    
     def test_model(self) -> bool:
         """Test the trained model"""
+        if self.rank != 0:
+            return True
         try:
             logging.info("Testing trained LoRA model...")
             print("TEST Testing emergency relief AI...")
@@ -453,6 +777,11 @@ class LoRAEmergencyTrainer:
                 logging.error(f"FAILED {step_name} failed after {duration:.2f}s")
                 print(f"FAILED {step_name} failed")
                 return False
+            
+            if self.up_to_date:
+                print("\nSUCCESS Adapter already trained on every example; no training run needed")
+                logging.info("SUCCESS Incremental run found no new examples")
+                return True
         
         print("\nSUCCESS EMERGENCY RELIEF AI TRAINING COMPLETED!")
         print("=" * 60)
@@ -460,6 +789,10 @@ class LoRAEmergencyTrainer:
         
         return True
 
+def _split_indices(dataset) -> List[int]:
+    """Dataset rows of a train/validation Subset, also when it is packed"""
+    return list(getattr(dataset, 'source_dataset', dataset).indices)
+
 def main():
     """Main entry point"""
     config_path = "./config/emergency_relief_training_config.json"
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+LoRA Hyperparameter Sweep
+Loads the tokenizer and base model once, then trains and evaluates a fresh adapter per
+configuration and ranks the trials by eval loss, throughput and peak memory
+"""
+
+import re
+import json
+import time
+import logging
+import itertools
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from vitalis.training.lora_emergency_trainer import LoRAEmergencyTrainer
+from vitalis.training.checkpoint_policy import PeakMemorySampler
+from vitalis.utils.memory_planner import GB
+
+# Trial keys that change the data, its tokenization, labels, split or the cached prefix activations
+DATASET_KEYS = (
+    'data_path', 'lora_max_length', 'lora_first_layer', 'prefix_activation_cache', 'batching_mode', 'supervise',
+    'data_backend', 'streaming', 'shuffle_buffer', 'deduplicate', 'dedup_threshold', 'dedup_num_perm',
+    'dedup_num_bands', 'dedup_dir', 'split_seed', 'token_cache_dir', 'category_adapters', 'incremental',
+    'incremental_from', 'incremental_replay_ratio'
+)
+
+# Trainer attributes prepare_dataset sets (and teardown_lora clears), restored with reused datasets
+DATASET_STATE = ('dataset', 'train_dataset', 'val_dataset', 'prefix_cache', 'adapter_assignments', 'incremental_counts')
+
+
+def expand_sweep(spec: Dict) -> List[Dict]:
+    """
+    Trials from a sweep spec: explicit "trials" (each a dict of config overrides, optionally
+    with a "name") followed by the cartesian product of "grid" ({key: [values]}).
+    "base" overrides apply to every trial
+    """
+    base = spec.get('base', {})
+    trials = [{**base, **trial} for trial in spec.get('trials', [])]
+    grid = spec.get('grid', {})
+    if grid:
+        keys = list(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            trials.append({**base, **dict(zip(keys, values))})
+    if not trials:
+        raise ValueError("Sweep spec has no 'trials' or 'grid' entries")
+
+    for index, trial in enumerate(trials):
+        if 'name' not in trial:
+            label = ','.join(f"{key}={value}" for key, value in trial.items() if key not in base)
+            trial['name'] = f"trial_{index:02d}" + (f"_{label}" if label else "")
+        trial['name'] = re.sub(r'[^A-Za-z0-9_.=,-]+', '-', trial['name'])
+    return trials
+
+
+def _dataset_key(config: Dict):
+    return tuple(json.dumps(config.get(key), sort_keys=True) for key in DATASET_KEYS)
+
+
+def run_trial(trainer: LoRAEmergencyTrainer, base_config: Dict, trial: Dict, sweep_dir: Path,
+              datasets: Dict) -> Dict:
+    """Attach, train, evaluate and detach one adapter on the already loaded base model"""
+    overrides = {key: value for key, value in trial.items() if key != 'name'}
+    output_dir = sweep_dir / trial['name']
+    trainer.config = {
+        **base_config,
+        **overrides,
+        'output_dir': str(output_dir),
+        'telemetry': True,
+        'telemetry_dir': str(output_dir / 'telemetry'),
+        'resume_from_checkpoint': False,
+    }
+    trainer.max_length = trainer.config.get('lora_max_length', 512)
+    result = {'name': trial['name'], 'overrides': overrides, 'status': 'failed'}
+
+    if not trainer._check_memory_plan():
+        result['status'] = 'skipped'
+        return result
+
+    start_time = time.time()
+    try:
+        with PeakMemorySampler() as sampler:
+            if not trainer.setup_lora():
+                return result
+
+            # Datasets depend only on tokenization settings; reuse them across trials
+            key = _dataset_key(trainer.config)
+            if key in datasets:
+                for name, value in datasets[key].items():
+                    setattr(trainer, name, value)
+            else:
+                trainer.prefix_cache = None
+                if not trainer.prepare_dataset():
+                    return result
+                if trainer.up_to_date:
+                    result['status'] = 'skipped'
+                    return result
+                datasets[key] = {name: getattr(trainer, name) for name in DATASET_STATE}
+
+            if not (trainer.setup_trainer() and trainer.train()):
+                return result
+            metrics = trainer.trainer.evaluate()
+            telemetry = trainer.telemetry.summary()
+    finally:
+        trainer.teardown_lora()
+
+    result.update({
+        'status': 'completed',
+        'eval_loss': metrics.get('eval_loss'),
+        'tokens_per_second': telemetry['tokens_per_second'],
+        'samples_per_second': telemetry['samples_per_second'],
+        # Above the memory in use before the trial (base model, cached datasets); the process peak as well
+        'peak_memory_gb': sampler.peak_delta / GB,
+        'peak_process_memory_gb': sampler.peak / GB,
+        'minutes': (time.time() - start_time) / 60,
+        'adapter_path': str(output_dir / 'emergency_relief_lora'),
+    })
+    return result
+
+
+def run_lora_sweep(config_path: str, spec: Dict, sweep_dir: Optional[str] = None) -> List[Dict]:
+    """
+    Run every trial of the sweep spec against one loaded base model
+
+    Each trial writes its adapter, checkpoints and telemetry under <sweep_dir>/<name>.
+    Returns the leaderboard: completed trials by ascending eval loss, then skipped
+    and failed ones
+    """
+    trainer = LoRAEmergencyTrainer(config_path)
+    base_config = dict(trainer.config)
+    sweep_dir = Path(sweep_dir or Path(base_config['output_dir']) / 'sweep')
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    trials = expand_sweep(spec)
+
+    if not trainer.load_model_and_tokenizer():
+        raise RuntimeError("Base model could not be loaded")
+
+    datasets = {}
+    results = []
+    for index, trial in enumerate(trials, 1):
+        print(f"\nLAUNCH Trial {index}/{len(trials)}: {trial['name']}")
+        try:
+            result = run_trial(trainer, base_config, trial, sweep_dir, datasets)
+        except Exception as e:
+            logging.error(f"FAILED Trial {trial['name']} failed: {e}")
+            overrides = {key: value for key, value in trial.items() if key != 'name'}
+            result = {'name': trial['name'], 'overrides': overrides, 'status': 'failed', 'error': str(e)}
+        results.append(result)
+        print(f"COMPLETED Trial {trial['name']}: {result['status']}")
+
+        # Keep the leaderboard current so an interrupted sweep still reports finished trials
+        leaderboard = rank_trials(results)
+        with open(sweep_dir / 'leaderboard.json', 'w') as f:
+            json.dump(leaderboard, f, indent=2)
+
+    return rank_trials(results)
+
+
+def rank_trials(results: List[Dict]) -> List[Dict]:
+    """Completed trials by ascending eval loss first, then skipped and failed trials"""
+    completed = sorted((r for r in results if r['status'] == 'completed'),
+                       key=lambda r: float('inf') if r['eval_loss'] is None else r['eval_loss'])
+    return completed + [r for r in results if r['status'] != 'completed']
+
+
+def format_leaderboard(leaderboard: List[Dict]) -> List[str]:
+    """Printable leaderboard lines"""
+    lines = [f"{'#':>3} {'trial':<40} {'eval loss':>10} {'tokens/s':>9} {'peak +GB':>8} {'min':>6}"]
+    for place, result in enumerate(leaderboard, 1):
+        if result['status'] != 'completed':
+            lines.append(f"{place:>3} {result['name']:<40} {result['status']:>10}")
+            continue
+        eval_loss = f"{result['eval_loss']:.4f}" if result['eval_loss'] is not None else "n/a"
+        lines.append(f"{place:>3} {result['name']:<40} {eval_loss:>10} {result['tokens_per_second']:>9.0f} "
+                     f"{result['peak_memory_gb']:>8.2f} {result['minutes']:>6.1f}")
+    return lines
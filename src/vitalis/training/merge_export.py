@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Merged Model Export
+Folds a trained LoRA adapter into the base weights and writes a standalone sharded
+safetensors model (experts MXFP4-packed as in the base checkpoint), then checks that the
+exported model reproduces the logits of base model plus adapter
+"""
+
+import os
+import copy
+import json
+import shutil
+import logging
+import time
+import torch
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from vitalis.data.dataset import SYSTEM_PROMPT
+from vitalis.training.async_checkpoint import save_sharded_safetensors
+from vitalis.training.mxfp4_experts import load_packed_mxfp4_model, pack_expert_state
+
+# Base model files copied next to the merged weights
+COPIED_FILES = ('config.json', 'generation_config.json', 'chat_template.jinja', 'tokenizer.json',
+                'tokenizer_config.json', 'special_tokens_map.json')
+
+VERIFY_PROMPTS = [
+    "How do you coordinate evacuation during a wildfire?",
+    "What are essential supplies for emergency shelter setup?",
+    "Outline triage priorities after a building collapse.",
+]
+
+
+def is_mxfp4_checkpoint(model_path: str) -> bool:
+    with open(Path(model_path) / 'config.json', 'r') as f:
+        quantization = json.load(f).get('quantization_config') or {}
+    return quantization.get('quant_method') == 'mxfp4'
+
+
+def load_base_model(model_path: str):
+    """Base model with MXFP4 experts kept packed when the checkpoint has them, else bfloat16"""
+    if is_mxfp4_checkpoint(model_path):
+        return load_packed_mxfp4_model(model_path)
+
+    from transformers import AutoModelForCausalLM
+
+    return AutoModelForCausalLM.from_pretrained(
+        model_path, local_files_only=True, trust_remote_code=True,
+        device_map="cpu", torch_dtype=torch.bfloat16, low_cpu_mem_usage=True
+    )
+
+
+def verification_inputs(tokenizer, prompts: List[str] = VERIFY_PROMPTS) -> Dict[str, torch.Tensor]:
+    """Chat-formatted prompts, left-padded into one batch"""
+    texts = [
+        tokenizer.apply_chat_template(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            tokenize=False, add_generation_prompt=True
+        )
+        for prompt in prompts
+    ]
+    # Pad a copy so the tokenizer exported with the model keeps its own settings
+    tokenizer = copy.deepcopy(tokenizer)
+    tokenizer.padding_side = 'left'
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer(texts, return_tensors='pt', padding=True)
+
+
+@torch.no_grad()
+def compute_logits(model, inputs: Dict[str, torch.Tensor]) -> torch.Tensor:
+    model.eval()
+    logits = model(**inputs, use_cache=False).logits.float()
+    # Padding positions carry no prediction
+    return logits[inputs['attention_mask'].bool()]
+
+
+def compare_logits(reference: torch.Tensor, exported: torch.Tensor, atol: float, rtol: float) -> Dict:
+    """allclose-style comparison plus how often the top-1 token agrees"""
+    diff = (reference - exported).abs()
+    allowed = atol + rtol * reference.abs()
+    return {
+        'max_abs_diff': diff.max().item(),
+        'mean_abs_diff': diff.mean().item(),
+        'violation_fraction': (diff > allowed).float().mean().item(),
+        'top1_agreement': (reference.argmax(-1) == exported.argmax(-1)).float().mean().item(),
+        'atol': atol,
+        'rtol': rtol,
+        'within_tolerance': bool((diff <= allowed).all()),
+    }
+
+
+def export_state_dict(model, requantize_experts: bool) -> Dict[str, torch.Tensor]:
+    """Merged model tensors under the base checkpoint's names"""
+    state = {name: tensor.detach().contiguous() for name, tensor in model.state_dict().items()}
+    if requantize_experts:
+        # Experts were loaded dense (dequantized); store them packed like the base checkpoint
+        state = pack_expert_state(state)
+    return state
+
+
+def export_merged_model(adapter_path: str, output_dir: str, base_model_path: Optional[str] = None,
+                        max_shard_size: int = 5 * 1024**3, verify: bool = True,
+                        atol: float = 0.1, rtol: float = 0.02) -> Dict:
+    """
+    Merge adapter_path into its base model and write <output_dir> as a standalone model
+
+    The base model path defaults to model_path in the adapter's training_config.json.
+    When verify is set, reference logits of base + adapter are taken before merging and
+    compared with the logits of the exported model loaded back from disk
+    """
+    from peft import PeftModel
+    from transformers import AutoTokenizer
+
+    adapter_path = Path(adapter_path)
+    if base_model_path is None:
+        with open(adapter_path / 'training_config.json', 'r') as f:
+            base_model_path = json.load(f)['model_path']
+    mxfp4 = is_mxfp4_checkpoint(base_model_path)
+    tokenizer_path = adapter_path if (adapter_path / 'tokenizer_config.json').exists() else Path(base_model_path)
+    tokenizer = AutoTokenizer.from_pretrained(str(tokenizer_path), local_files_only=True, trust_remote_code=True)
+
+    start_time = time.time()
+    logging.info(f"Loading base model {base_model_path} and adapter {adapter_path}...")
+    model = PeftModel.from_pretrained(load_base_model(base_model_path), str(adapter_path))
+
+    inputs = verification_inputs(tokenizer) if verify else None
+    reference = compute_logits(model, inputs) if verify else None
+
+    model = model.merge_and_unload(safe_merge=True)
+    dense_experts = mxfp4 and not any(name.endswith('_blocks') for name, _ in model.named_buffers())
+    state = export_state_dict(model, requantize_experts=dense_experts)
+    del model
+
+    output_dir = Path(output_dir)
+    tmp_dir = output_dir.with_name(f".{output_dir.name}.tmp-{os.getpid()}")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    filenames = save_sharded_safetensors(tmp_dir, 'model', state, max_shard_size)
+    total_bytes = sum(tensor.numel() * tensor.element_size() for tensor in state.values())
+    del state
+
+    for name in COPIED_FILES:
+        source = Path(base_model_path) / name
+        if source.exists():
+            shutil.copy2(source, tmp_dir / name)
+    tokenizer.save_pretrained(str(tmp_dir))
+    with open(tmp_dir / 'merge_info.json', 'w') as f:
+        json.dump({'base_model': str(base_model_path), 'adapter': str(adapter_path),
+                   'experts': 'mxfp4' if mxfp4 else 'dense'}, f, indent=2)
+
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    os.replace(tmp_dir, output_dir)
+    logging.info(f"COMPLETED Merged model written to {output_dir} ({total_bytes / 1024**3:.1f} GB, "
+                 f"{len(filenames)} files) in {time.time() - start_time:.0f}s")
+
+    result = {'output_dir': str(output_dir), 'files': filenames, 'total_bytes': total_bytes, 'experts': 'mxfp4' if mxfp4 else 'dense'}
+    if verify:
+        exported = compute_logits(load_base_model(str(output_dir)), inputs)
+        result['verification'] = compare_logits(reference, exported, atol, rtol)
+        with open(output_dir / 'merge_info.json', 'r') as f:
+            info = json.load(f)
+        info['verification'] = result['verification']
+        with open(output_dir / 'merge_info.json', 'w') as f:
+            json.dump(info, f, indent=2)
+    return result
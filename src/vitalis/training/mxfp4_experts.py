@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Packed MXFP4 Experts
+Keeps GPT-OSS expert weights in their checkpoint format (4-bit blocks plus UE8 scales) and
+dequantizes one expert at a time inside forward and backward, so LoRA training on the
+attention projections needs the packed 13.7 GB model instead of a bfloat16 copy
+"""
+
+import json
+import logging
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from pathlib import Path
+from typing import Dict, Tuple
+
+# E2M1 code points; bit 3 is the sign
+FP4_VALUES = [
+    +0.0, +0.5, +1.0, +1.5, +2.0, +3.0, +4.0, +6.0,
+    -0.0, -0.5, -1.0, -1.5, -2.0, -3.0, -4.0, -6.0,
+]
+MXFP4_BLOCK_SIZE = 32
+EXPERT_PROJECTIONS = ('gate_up_proj', 'down_proj')
+
+
+def dequantize_mxfp4(blocks: torch.Tensor, scales: torch.Tensor, dtype: torch.dtype = torch.bfloat16) -> torch.Tensor:
+    """
+    Unpack (..., G, 16) uint8 blocks and (..., G) UE8 scales into (..., G * 32) values
+
+    Each byte holds two E2M1 values (low nibble first); every 32 values share the
+    power-of-two scale 2 ** (scale - 127)
+    """
+    lut = torch.tensor(FP4_VALUES, dtype=dtype, device=blocks.device)
+    *prefix, groups, block_bytes = blocks.shape
+    out = torch.empty(*prefix, groups, block_bytes * 2, dtype=dtype, device=blocks.device)
+    out[..., 0::2] = lut[(blocks & 0x0F).long()]
+    out[..., 1::2] = lut[(blocks >> 4).long()]
+    exponents = scales.to(torch.int32).unsqueeze(-1) - 127
+    torch.ldexp(out, exponents, out=out)
+    return out.reshape(*prefix, groups * block_bytes * 2)
+
+
+def quantize_mxfp4(weight: torch.Tensor, rows_per_chunk: int = 4096) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Round (..., K) values to MXFP4, K a multiple of 32; the inverse of dequantize_mxfp4
+
+    Each group's scale is the smallest power of two that brings its largest magnitude
+    within the E2M1 range (6.0); values are rounded to the nearest code point
+    """
+    *prefix, cols = weight.shape
+    if cols % MXFP4_BLOCK_SIZE:
+        raise ValueError(f"Last dimension {cols} is not a multiple of {MXFP4_BLOCK_SIZE}")
+    groups = cols // MXFP4_BLOCK_SIZE
+    flat = weight.reshape(-1, groups, MXFP4_BLOCK_SIZE)
+    magnitudes = torch.tensor(FP4_VALUES[:8], dtype=torch.float32, device=weight.device)
+
+    blocks = torch.empty(flat.shape[0], groups, MXFP4_BLOCK_SIZE // 2, dtype=torch.uint8, device=weight.device)
+    scales = torch.empty(flat.shape[0], groups, dtype=torch.uint8, device=weight.device)
+    for start in range(0, flat.shape[0], rows_per_chunk):
+        chunk = flat[start:start + rows_per_chunk].float()
+        amax = chunk.abs().amax(dim=-1, keepdim=True).clamp(min=2.0 ** -126)
+        exponent = torch.ceil(torch.log2(amax / 6.0)).clamp(-127, 127)
+        scaled = chunk / torch.exp2(exponent)
+
+        index = (scaled.abs().unsqueeze(-1) - magnitudes).abs().argmin(dim=-1)
+        index = index + 8 * ((scaled < 0) & (index > 0)).long()
+        blocks[start:start + rows_per_chunk] = (index[..., 0::2] | (index[..., 1::2] << 4)).to(torch.uint8)
+        scales[start:start + rows_per_chunk] = (exponent.squeeze(-1) + 127).to(torch.uint8)
+
+    return blocks.reshape(*prefix, groups, MXFP4_BLOCK_SIZE // 2), scales.reshape(*prefix, groups)
+
+
+def pack_expert_state(state: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    """
+    State dict with dense GptOssExperts weights, (experts, in, out), replaced by the MXFP4
+    <projection>_blocks / _scales tensors of the checkpoint layout; other tensors pass through
+    """
+    packed = {}
+    for name, tensor in state.items():
+        prefix, _, leaf = name.rpartition('.')
+        if prefix.endswith('mlp.experts') and leaf in EXPERT_PROJECTIONS:
+            packed[f"{prefix}.{leaf}_blocks"], packed[f"{prefix}.{leaf}_scales"] = quantize_mxfp4(tensor.transpose(1, 2))
+        else:
+            packed[name] = tensor
+    return packed
+
+
+class _PackedLinear(torch.autograd.Function):
+    """
+    x @ W.T for a frozen MXFP4 weight W (out, in)
+
+    Only the packed tensors are saved for backward; W is dequantized again there,
+    so no dequantized weight outlives the call
+    """
+
+    @staticmethod
+    def forward(ctx, x, blocks, scales):
+        ctx.save_for_backward(blocks, scales)
+        return F.linear(x, dequantize_mxfp4(blocks, scales, x.dtype))
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        blocks, scales = ctx.saved_tensors
+        return grad_output @ dequantize_mxfp4(blocks, scales, grad_output.dtype), None, None
+
+
+class PackedMXFP4Experts(nn.Module):
+    """
+    Drop-in replacement for GptOssExperts that holds the packed checkpoint tensors
+
+    Weights are buffers, never trained; gradients flow to the expert inputs only.
+    Only experts that received tokens are dequantized, one at a time
+    """
+
+    def __init__(self, num_experts: int, hidden_size: int, expert_dim: int,
+                 alpha: float = 1.702, limit: float = 7.0, dtype: torch.dtype = torch.bfloat16, device=None):
+        super().__init__()
+        self.num_experts = num_experts
+        self.hidden_size = hidden_size
+        self.expert_dim = expert_dim
+        self.alpha = alpha
+        self.limit = limit
+        groups_in = hidden_size // MXFP4_BLOCK_SIZE
+        groups_mid = expert_dim // MXFP4_BLOCK_SIZE
+        u8 = dict(dtype=torch.uint8, device=device)
+        self.register_buffer('gate_up_proj_blocks', torch.zeros(num_experts, 2 * expert_dim, groups_in, 16, **u8))
+        self.register_buffer('gate_up_proj_scales', torch.zeros(num_experts, 2 * expert_dim, groups_in, **u8))
+        self.register_buffer('gate_up_proj_bias', torch.zeros(num_experts, 2 * expert_dim, dtype=dtype, device=device))
+        self.register_buffer('down_proj_blocks', torch.zeros(num_experts, hidden_size, groups_mid, 16, **u8))
+        self.register_buffer('down_proj_scales', torch.zeros(num_experts, hidden_size, groups_mid, **u8))
+        self.register_buffer('down_proj_bias', torch.zeros(num_experts, hidden_size, dtype=dtype, device=device))
+
+    def forward(self, hidden_states: torch.Tensor, router_indices=None, routing_weights=None) -> torch.Tensor:
+        batch_size = hidden_states.shape[0]
+        hidden_states = hidden_states.reshape(-1, self.hidden_size)
+        next_states = torch.zeros_like(hidden_states)
+
+        with torch.no_grad():
+            expert_mask = F.one_hot(router_indices, num_classes=self.num_experts).permute(2, 1, 0)
+            expert_hit = torch.greater(expert_mask.sum(dim=(-1, -2)), 0).nonzero()
+
+        for expert_idx in expert_hit[:, 0].tolist():
+            with torch.no_grad():
+                _, token_idx = torch.where(expert_mask[expert_idx])
+            current_state = hidden_states[token_idx]
+
+            gate_up = _PackedLinear.apply(
+                current_state, self.gate_up_proj_blocks[expert_idx], self.gate_up_proj_scales[expert_idx]
+            ) + self.gate_up_proj_bias[expert_idx]
+            gate, up = gate_up[..., ::2], gate_up[..., 1::2]
+            gate = gate.clamp(min=None, max=self.limit)
+            up = up.clamp(min=-self.limit, max=self.limit)
+            glu = gate * torch.sigmoid(gate * self.alpha)
+            gated_output = (up + 1) * glu
+
+            out = _PackedLinear.apply(
+                gated_output, self.down_proj_blocks[expert_idx], self.down_proj_scales[expert_idx]
+            ) + self.down_proj_bias[expert_idx]
+            weighted_output = out * routing_weights[token_idx, expert_idx, None]
+            next_states.index_add_(0, token_idx, weighted_output.to(hidden_states.dtype))
+
+        return next_states.view(batch_size, -1, self.hidden_size)
+
+    def dequantized(self, projection: str, dtype: torch.dtype = torch.bfloat16) -> torch.Tensor:
+        """
+        All experts of gate_up_proj or down_proj in GptOssExperts parameter layout
+        (experts, in_features, out_features)
+        """
+        blocks = getattr(self, f"{projection}_blocks")
+        scales = getattr(self, f"{projection}_scales")
+        return dequantize_mxfp4(blocks, scales, dtype).transpose(1, 2).contiguous()
+
+
+def _checkpoint_tensors(model_path: Path):
+    """Yield (name, tensor) for every tensor in the safetensors checkpoint"""
+    from safetensors import safe_open
+
+    index_path = model_path / 'model.safetensors.index.json'
+    if index_path.exists():
+        with open(index_path, 'r') as f:
+            files = sorted(set(json.load(f)['weight_map'].values()))
+    else:
+        files = ['model.safetensors']
+    for filename in files:
+        with safe_open(str(model_path / filename), framework='pt', device='cpu') as f:
+            for name in f.keys():
+                yield name, f.get_tensor(name)
+
+
+def load_packed_mxfp4_model(model_path: str, dtype: torch.dtype = torch.bfloat16):
+    """
+    GPT-OSS causal LM whose experts stay MXFP4-packed
+
+    Non-expert weights are loaded in dtype; expert blocks, scales and biases are
+    placed in PackedMXFP4Experts modules exactly as stored in the checkpoint
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    model_path = Path(model_path)
+    config = AutoConfig.from_pretrained(str(model_path), local_files_only=True, trust_remote_code=True)
+    quantization = getattr(config, 'quantization_config', None) or {}
+    if quantization.get('quant_method') != 'mxfp4':
+        raise ValueError(f"{model_path} is not an MXFP4 checkpoint (quant_method {quantization.get('quant_method')})")
+    del config.quantization_config
+
+    with torch.device('meta'):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+
+    for layer in model.model.layers:
+        layer.mlp.experts = PackedMXFP4Experts(
+            config.num_local_experts, config.hidden_size, config.intermediate_size,
+            alpha=getattr(layer.mlp.experts, 'alpha', 1.702), limit=getattr(layer.mlp.experts, 'limit', 7.0),
+            dtype=dtype, device='meta'
+        )
+
+    loaded = set()
+    for name, tensor in _checkpoint_tensors(model_path):
+        module_name, _, leaf = name.rpartition('.')
+        module = model.get_submodule(module_name)
+        if not tensor.dtype == torch.uint8:
+            tensor = tensor.to(dtype)
+        if leaf in module._parameters:
+            module._parameters[leaf] = nn.Parameter(tensor, requires_grad=False)
+        elif leaf in module._buffers:
+            module._buffers[leaf] = tensor
+        else:
+            raise ValueError(f"Checkpoint tensor {name} has no place in the model")
+        loaded.add(name)
+
+    # Non-persistent buffers (rotary frequencies) are not in the checkpoint; rebuild them on the CPU
+    rotary = model.model.rotary_emb
+    model.model.rotary_emb = type(rotary)(config=config)
+    if model.lm_head.weight.is_meta and getattr(config, 'tie_word_embeddings', False):
+        model.lm_head.weight = model.model.embed_tokens.weight
+
+    missing = [n for n, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise ValueError(f"Checkpoint is missing {len(missing)} tensors, e.g. {missing[:3]}")
+
+    packed_bytes = sum(t.numel() * t.element_size() for n, t in model.named_buffers() if '.experts.' in n)
+    logging.info(f"COMPLETED Loaded {len(loaded)} tensors; experts kept packed ({packed_bytes / 1024**3:.1f} GB)")
+    return model
+
+
+def verify_packed_experts(seed: int = 0) -> Dict[str, float]:
+    """
+    Compare PackedMXFP4Experts against GptOssExperts holding the same dequantized weights,
+    for outputs and input gradients, on a tiny random configuration
+    """
+    from transformers import GptOssConfig
+    from transformers.models.gpt_oss.modeling_gpt_oss import GptOssExperts
+
+    torch.manual_seed(seed)
+    config = GptOssConfig(hidden_size=64, intermediate_size=64, num_local_experts=4, num_experts_per_tok=2)
+    packed = PackedMXFP4Experts(4, 64, 64, dtype=torch.float32)
+    packed.gate_up_proj_blocks, packed.gate_up_proj_scales = quantize_mxfp4(torch.randn(4, 128, 64) * 0.1)
+    packed.down_proj_blocks, packed.down_proj_scales = quantize_mxfp4(torch.randn(4, 64, 64) * 0.1)
+    packed.gate_up_proj_bias = torch.randn(4, 128) * 0.01
+    packed.down_proj_bias = torch.randn(4, 64) * 0.01
+
+    reference = GptOssExperts(config).float()
+    with torch.no_grad():
+        reference.gate_up_proj.copy_(packed.dequantized('gate_up_proj', torch.float32))
+        reference.down_proj.copy_(packed.dequantized('down_proj', torch.float32))
+        reference.gate_up_proj_bias.copy_(packed.gate_up_proj_bias)
+        reference.down_proj_bias.copy_(packed.down_proj_bias)
+    reference.train()
+
+    tokens = 10
+    router_indices = torch.stack([torch.randperm(4)[:2] for _ in range(tokens)])
+    routing_weights = torch.zeros(tokens, 4).scatter_(1, router_indices, torch.rand(tokens, 2))
+    hidden = torch.randn(1, tokens, 64)
+
+    results = []
+    for experts in (reference, packed):
+        x = hidden.clone().requires_grad_(True)
+        out = experts(x, router_indices=router_indices, routing_weights=routing_weights)
+        out.pow(2).sum().backward()
+        results.append((out.detach(), x.grad))
+
+    # Dequantized MXFP4 values are representable, so a round trip must reproduce them
+    weights = dequantize_mxfp4(packed.down_proj_blocks, packed.down_proj_scales, torch.float32)
+    roundtrip = dequantize_mxfp4(*quantize_mxfp4(weights), torch.float32)
+    return {
+        'output_max_abs_diff': (results[0][0] - results[1][0]).abs().max().item(),
+        'grad_max_abs_diff': (results[0][1] - results[1][1]).abs().max().item(),
+        'roundtrip_max_abs_diff': (weights - roundtrip).abs().max().item(),
+    }
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Frozen-Prefix Activation Cache
+When LoRA only adapts the upper layers, the lower layers are a fixed function of the input.
+Their output hidden states are computed once per example, stored in a memory-mapped file,
+and training runs only the trainable suffix of the decoder on top of them
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import contextlib
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from pathlib import Path
+from torch.utils.data import Dataset
+from typing import Dict, List, Optional
+
+from vitalis.training.chunked_loss import lm_head_bypass
+
+# Bump whenever the on-disk layout changes so stale caches are rebuilt
+PREFIX_CACHE_FORMAT_VERSION = 1
+
+HIDDEN_FILE = "hidden.bin"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+# numpy has no bfloat16; bfloat16 activations are stored as their raw 16-bit patterns
+_STORAGE_DTYPES = {
+    torch.bfloat16: (np.int16, torch.int16),
+    torch.float16: (np.float16, None),
+    torch.float32: (np.float32, None),
+}
+
+
+class _LayerRange(nn.ModuleList):
+    """
+    Decoder layer list that only iterates layers[start:stop]
+
+    Layers stay registered under their original indices, so parameter names, state
+    dicts and adapter checkpoints are unchanged while the range is active
+    """
+
+    def __init__(self, layers, start: int, stop: int):
+        super().__init__(layers)
+        self.start, self.stop = start, stop
+
+    def __iter__(self):
+        return iter(list(self._modules.values())[self.start:self.stop])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            # Models that iterate self.layers[:num_hidden_layers] keep the same range
+            return _LayerRange(list(self._modules.values())[idx], self.start, self.stop)
+        return super().__getitem__(idx)
+
+
+def _unwrap_causal_lm(model: nn.Module) -> nn.Module:
+    while hasattr(model, 'module'):
+        model = model.module
+    if hasattr(model, 'get_base_model'):
+        model = model.get_base_model()
+    return model
+
+
+def _decoder(model: nn.Module) -> nn.Module:
+    """The decoder (GptOssModel) underneath PEFT/DDP wrappers"""
+    return _unwrap_causal_lm(model).model
+
+
+@contextlib.contextmanager
+def decoder_layer_range(model: nn.Module, start: int, stop: Optional[int] = None):
+    """Temporarily run only decoder layers [start, stop) in the model's own forward"""
+    decoder = _decoder(model)
+    layers = decoder.layers
+    decoder.layers = _LayerRange(list(layers), start, len(layers) if stop is None else stop)
+    try:
+        yield
+    finally:
+        decoder.layers = layers
+
+
+@contextlib.contextmanager
+def prefix_output(model: nn.Module, num_prefix_layers: int):
+    """
+    Make the model's forward return the hidden states after the first num_prefix_layers
+    layers as its logits (no final norm, no lm_head)
+    """
+    decoder = _decoder(model)
+    norm = decoder.norm
+    decoder.norm = nn.Identity()
+    try:
+        with decoder_layer_range(model, 0, num_prefix_layers), lm_head_bypass(model):
+            yield
+    finally:
+        decoder.norm = norm
+
+
+@torch.no_grad()
+def run_prefix(model: nn.Module, input_ids: torch.Tensor, num_prefix_layers: int,
+               attention_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """Hidden states entering layer num_prefix_layers, shape (batch, seq, hidden)"""
+    with prefix_output(model, num_prefix_layers):
+        return model(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).logits
+
+
+def _weights_fingerprint(model_path: str) -> str:
+    """Name, size and mtime of every weight file (and index) under model_path, so replaced weights miss the cache"""
+    path = Path(model_path)
+    if not path.is_dir():
+        return ''
+    files = sorted(list(path.glob('*.safetensors')) + list(path.glob('*.safetensors.index.json')) + list(path.glob('*.bin')))
+    return ';'.join(f"{f.name}:{f.stat().st_size}:{f.stat().st_mtime_ns}" for f in files)
+
+
+def _model_fingerprint(model: nn.Module) -> str:
+    config = _unwrap_causal_lm(model).config
+    model_path = str(getattr(config, '_name_or_path', ''))
+    return model_path + '|' + config.to_json_string(use_diff=False) + '|' + _weights_fingerprint(model_path)
+
+
+def dataset_fingerprint(dataset) -> str:
+    """Hash of every example's real token ids, in order"""
+    digest = hashlib.sha256()
+    for idx in range(len(dataset)):
+        item = dataset[idx]
+        length = int(item['attention_mask'].sum()) if 'attention_mask' in item else len(item['input_ids'])
+        digest.update(np.asarray(item['input_ids'][:length], dtype=np.int64).tobytes())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def compute_prefix_cache_key(model: nn.Module, dataset, num_prefix_layers: int, dtype: torch.dtype) -> str:
+    parts = {
+        'format_version': PREFIX_CACHE_FORMAT_VERSION,
+        'model': hashlib.sha256(_model_fingerprint(model).encode('utf-8')).hexdigest(),
+        'num_prefix_layers': num_prefix_layers,
+        'dtype': str(dtype),
+        'data': dataset_fingerprint(dataset),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def build_prefix_cache(model: nn.Module, dataset, num_prefix_layers: int, cache_path: Path,
+                       dtype: torch.dtype = torch.bfloat16) -> int:
+    """
+    Run the frozen prefix over every example once and write the hidden states to cache_path
+    Only real (unpadded) positions are stored; returns the number of cached tokens
+    """
+    start_time = time.time()
+    cache_path = Path(cache_path)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp-{os.getpid()}")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    device = next(model.parameters()).device
+    hidden_size = _unwrap_causal_lm(model).config.hidden_size
+    _, view_dtype = _STORAGE_DTYPES[dtype]
+    offsets = [0]
+    was_training = model.training
+    model.eval()
+    try:
+        with open(tmp_path / HIDDEN_FILE, 'wb') as f:
+            for idx in range(len(dataset)):
+                item = dataset[idx]
+                length = int(item['attention_mask'].sum()) if 'attention_mask' in item else len(item['input_ids'])
+                input_ids = torch.as_tensor(item['input_ids'][:length], dtype=torch.long, device=device).unsqueeze(0)
+                hidden = run_prefix(model, input_ids, num_prefix_layers)[0].to('cpu', dtype)
+                if view_dtype is not None:
+                    hidden = hidden.view(view_dtype)
+                f.write(hidden.contiguous().numpy().tobytes())
+                offsets.append(offsets[-1] + length)
+                if (idx + 1) % 100 == 0:
+                    logging.info(f"PROCESSING Prefix activations: {idx + 1}/{len(dataset)} examples")
+    finally:
+        model.train(was_training)
+
+    np.save(tmp_path / OFFSETS_FILE, np.asarray(offsets, dtype=np.int64))
+    with open(tmp_path / META_FILE, 'w') as f:
+        json.dump({
+            'format_version': PREFIX_CACHE_FORMAT_VERSION,
+            'num_examples': len(dataset),
+            'num_tokens': offsets[-1],
+            'hidden_size': hidden_size,
+            'num_prefix_layers': num_prefix_layers,
+            'dtype': str(dtype).replace('torch.', ''),
+            'created_at': int(time.time()),
+        }, f, indent=2)
+
+    # Publish atomically; a concurrent builder that finished first wins
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not (cache_path / META_FILE).exists():
+            raise
+
+    logging.info(
+        f"COMPLETED Prefix activation cache built: {len(dataset)} examples, {offsets[-1]} tokens "
+        f"through {num_prefix_layers} layers in {time.time() - start_time:.1f}s -> {cache_path}"
+    )
+    return offsets[-1]
+
+
+class PrefixActivationCache:
+    """
+    Read-only view of a built prefix activation cache
+    The hidden-state file is memory-mapped lazily so DataLoader workers map it themselves
+    """
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = Path(cache_path)
+        with open(self.cache_path / META_FILE, 'r') as f:
+            self.meta = json.load(f)
+        self.dtype = getattr(torch, self.meta['dtype'])
+        self._hidden = None
+        self._offsets = None
+
+    def _ensure_open(self):
+        if self._hidden is None:
+            np_dtype, _ = _STORAGE_DTYPES[self.dtype]
+            self._hidden = np.memmap(self.cache_path / HIDDEN_FILE, dtype=np_dtype, mode='r').reshape(
+                -1, self.meta['hidden_size']
+            )
+            self._offsets = np.load(self.cache_path / OFFSETS_FILE, mmap_mode='r')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_hidden'] = None
+        state['_offsets'] = None
+        return state
+
+    def __len__(self):
+        return self.meta['num_examples']
+
+    def hidden_states(self, idx: int) -> torch.Tensor:
+        """(tokens, hidden) activations entering the first trainable layer for example idx"""
+        self._ensure_open()
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        hidden = torch.from_numpy(np.array(self._hidden[start:end]))
+        _, view_dtype = _STORAGE_DTYPES[self.dtype]
+        return hidden.view(self.dtype) if view_dtype is not None else hidden
+
+
+def load_or_build_prefix_cache(model: nn.Module, dataset, num_prefix_layers: int, cache_dir: str,
+                               dtype: torch.dtype = torch.bfloat16) -> PrefixActivationCache:
+    """Open the cache matching this model, dataset and prefix depth, building it if missing"""
+    key = compute_prefix_cache_key(model, dataset, num_prefix_layers, dtype)
+    cache_path = Path(cache_dir) / key[:16]
+
+    if (cache_path / META_FILE).exists():
+        logging.info(f"Using prefix activation cache: {cache_path}")
+    else:
+        logging.info(f"Building prefix activation cache ({num_prefix_layers} frozen layers) at {cache_path}...")
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        build_prefix_cache(model, dataset, num_prefix_layers, cache_path, dtype)
+
+    cache = PrefixActivationCache(cache_path)
+    if len(cache) != len(dataset):
+        raise ValueError(f"Prefix cache {cache_path} has {len(cache)} examples, dataset has {len(dataset)}")
+    return cache
+
+
+class PrefixCachedDataset(Dataset):
+    """
+    Dataset items extended with the cached prefix activations as inputs_embeds
+
+    Items keep input_ids and labels; inputs_embeds has one row per input_ids position,
+    zero on padding
+    """
+
+    def __init__(self, dataset, cache: PrefixActivationCache, padding_side: str = 'right'):
+        self.dataset = dataset
+        self.cache = cache
+        self.padding_side = padding_side
+
+    def __len__(self):
+        return len(self.dataset)
+
+    @property
+    def lengths(self):
+        return self.dataset.lengths
+
+    @property
+    def categories(self):
+        return self.dataset.categories
+
+    def __getitem__(self, idx):
+        item = dict(self.dataset[idx])
+        hidden = self.cache.hidden_states(idx)
+        length = len(item['input_ids'])
+        embeds = hidden.new_zeros((length, hidden.shape[-1]))
+        real = min(hidden.shape[0], length)
+        if self.padding_side == 'left':
+            embeds[length - real:] = hidden[:real]
+        else:
+            embeds[:real] = hidden[:real]
+        item['inputs_embeds'] = embeds
+        return item
+
+
+class PrefixEmbedsCollator:
+    """
+    Wraps a collator: pads the cached activations to the batch length and passes them
+    as inputs_embeds instead of input_ids (labels are still built from input_ids)
+    """
+
+    def __init__(self, collator, padding_side: str = 'right'):
+        self.collator = collator
+        self.padding_side = padding_side
+
+    def __call__(self, features: List[Dict]) -> Dict[str, torch.Tensor]:
+        features = [dict(feature) for feature in features]
+        embeds = [feature.pop('inputs_embeds') for feature in features]
+        batch = self.collator(features)
+
+        seq_len = batch['input_ids'].shape[1]
+        inputs_embeds = embeds[0].new_zeros((len(embeds), seq_len, embeds[0].shape[-1]))
+        for row, rows in enumerate(embeds):
+            real = min(rows.shape[0], seq_len)
+            if self.padding_side == 'left':
+                inputs_embeds[row, seq_len - real:] = rows[rows.shape[0] - real:]
+            else:
+                inputs_embeds[row, :real] = rows[:real]
+
+        batch.pop('input_ids')
+        batch['inputs_embeds'] = inputs_embeds
+        return batch
+
+
+def verify_prefix_cache(num_prefix_layers: int = 2, seed: int = 0) -> Dict[str, float]:
+    """
+    Compare the loss and suffix gradients of a full forward pass against the suffix
+    run on prefix activations, on a tiny randomly initialised GPT-OSS model
+    """
+    from transformers import GptOssConfig, GptOssForCausalLM
+
+    torch.manual_seed(seed)
+    config = GptOssConfig(
+        vocab_size=97,
+        hidden_size=32,
+        intermediate_size=32,
+        num_hidden_layers=4,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=8,
+        num_local_experts=4,
+        num_experts_per_tok=2,
+        layer_types=['sliding_attention', 'full_attention'] * 2,
+        sliding_window=4,
+        pad_token_id=0,
+        eos_token_id=1,
+    )
+    config._attn_implementation = 'eager'
+    model = GptOssForCausalLM(config).float()
+    model.eval()
+
+    input_ids = torch.randint(2, config.vocab_size, (2, 13))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 10:] = 0
+    labels = input_ids.masked_fill(attention_mask == 0, -100)
+    suffix_weight = model.model.layers[-1].self_attn.q_proj.weight
+
+    model.zero_grad()
+    reference = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels).loss
+    reference.backward()
+    reference_grad = suffix_weight.grad.clone()
+
+    hidden = run_prefix(model, input_ids, num_prefix_layers, attention_mask=attention_mask)
+    model.zero_grad()
+    with decoder_layer_range(model, num_prefix_layers):
+        cached = model(inputs_embeds=hidden, attention_mask=attention_mask, labels=labels).loss
+    cached.backward()
+    cached_grad = suffix_weight.grad.clone()
+
+    return {
+        'reference_loss': reference.item(),
+        'cached_loss': cached.item(),
+        'loss_abs_diff': abs(reference.item() - cached.item()),
+        'grad_max_abs_diff': (reference_grad - cached_grad).abs().max().item(),
+    }
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Training Telemetry
+Per-step throughput and time split (data wait, forward, backward, optimizer), resident
+memory and forced garbage collections, recorded every N steps as JSONL with an optional
+Chrome trace (chrome://tracing or ui.perfetto.dev)
+"""
+
+import gc
+import sys
+import json
+import time
+import logging
+import psutil
+import torch
+from pathlib import Path
+from typing import Dict, List, Optional
+from transformers.trainer_callback import TrainerCallback
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PHASES = ('data_wait', 'forward', 'backward', 'optimizer')
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    elif torch.backends.mps.is_available():
+        torch.mps.synchronize()
+
+
+def _batch_shape(args, kwargs):
+    """(samples, tokens) of a forward call from input_ids, inputs_embeds or attention_mask"""
+    tensor = kwargs.get('input_ids')
+    if tensor is None:
+        tensor = kwargs.get('inputs_embeds')
+    if tensor is None and args:
+        tensor = args[0]
+    if not isinstance(tensor, torch.Tensor) or tensor.dim() < 2:
+        return 0, 0
+    mask = kwargs.get('attention_mask')
+    if isinstance(mask, torch.Tensor) and mask.dim() == 2:
+        return tensor.shape[0], int(mask.sum().item())
+    return tensor.shape[0], tensor.shape[0] * tensor.shape[1]
+
+
+class TelemetryCallback(TrainerCallback):
+    """
+    Records where each sampled training step spends its time
+
+    Phase boundaries come from model forward hooks and the Trainer's step events:
+    data wait runs from the previous step's end (after logging, evaluation and saving)
+    to on_step_begin, forward is the model call, backward runs to the next substep or
+    to on_pre_optimizer_step, and optimizer runs from there to on_step_end. Unsampled
+    steps only take a timestamp per event; token counting, device synchronization,
+    memory queries and writes happen on sampled steps only. Like the callback it
+    replaces, it forces a garbage collection when system memory passes gc_threshold_percent
+    """
+
+    def __init__(self, output_dir: str, sample_every: int = 10, chrome_trace: bool = False,
+                 gc_threshold_percent: float = 80.0, rank: int = 0):
+        self.output_dir = Path(output_dir)
+        self.sample_every = max(1, sample_every)
+        self.chrome_trace = chrome_trace
+        self.gc_threshold_percent = gc_threshold_percent
+        self.rank = rank
+        suffix = f"_rank{rank}" if rank else ""
+        self.jsonl_path = self.output_dir / f"telemetry{suffix}.jsonl"
+        self.trace_path = self.output_dir / f"telemetry_trace{suffix}.json"
+
+        self.process = psutil.Process()
+        self.hooks = []
+        self.records: List[Dict] = []
+        self.trace_events: List[Dict] = []
+        self.forced_gc = 0
+        self._file = None
+        self._origin = 0.0
+        self._last_mark = 0.0
+        self._in_step = False
+        self._sampled = False
+        self._reset_step()
+
+    def _reset_step(self):
+        self._step_start = 0.0
+        self._phase_start = 0.0
+        self._phase = None
+        self._totals = dict.fromkeys(PHASES, 0.0)
+        self._spans = []
+        self._samples = 0
+        self._tokens = 0
+
+    def _close_phase(self, now: float):
+        if self._phase is not None:
+            self._totals[self._phase] += now - self._phase_start
+            if self._sampled and self.chrome_trace:
+                self._spans.append((self._phase, self._phase_start, now))
+        self._phase = None
+
+    def _open_phase(self, phase: str, now: float):
+        self._close_phase(now)
+        self._phase = phase
+        self._phase_start = now
+
+    def _sync_now(self) -> float:
+        if self._sampled:
+            _synchronize()
+        return time.perf_counter()
+
+    # Model hooks
+    def _forward_pre_hook(self, module, args, kwargs):
+        if not self._in_step:
+            return
+        now = self._sync_now()
+        self._open_phase('forward', now)
+        if self._sampled:
+            samples, tokens = _batch_shape(args, kwargs)
+            self._samples += samples
+            self._tokens += tokens
+
+    def _forward_hook(self, module, args, kwargs, output):
+        if not self._in_step:
+            return
+        self._open_phase('backward', self._sync_now())
+
+    # Trainer events
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.jsonl_path, 'a')
+        if model is not None:
+            self.hooks = [
+                model.register_forward_pre_hook(self._forward_pre_hook, with_kwargs=True),
+                model.register_forward_hook(self._forward_hook, with_kwargs=True),
+            ]
+        self._origin = self._last_mark = time.perf_counter()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self._file is None:
+            return
+        self._reset_step()
+        self._sampled = (state.global_step + 1) % self.sample_every == 0
+        now = self._sync_now()
+        self._step_start = self._last_mark
+        self._totals['data_wait'] = now - self._last_mark
+        if self._sampled and self.chrome_trace:
+            self._spans.append(('data_wait', self._last_mark, now))
+        self._in_step = True
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        if self._in_step:
+            self._close_phase(self._sync_now())
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        if self._in_step:
+            self._open_phase('optimizer', self._sync_now())
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if not self._in_step:
+            return
+        now = self._sync_now()
+        self._close_phase(now)
+        self._in_step = False
+        self._last_mark = now
+        if self._sampled:
+            self._record(state.global_step, now)
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        self._last_mark = time.perf_counter()
+        if self._file is not None and self.records:
+            self._file.flush()
+            summary = self.summary()
+            logging.info(
+                f"METRICS Step {state.global_step}: {summary['tokens_per_second']:.0f} tokens/s, "
+                f"{summary['samples_per_second']:.2f} samples/s, "
+                + ", ".join(f"{phase} {summary['time_split'][phase]:.0%}" for phase in PHASES)
+                + f", peak RSS {summary['peak_rss_gb']:.2f} GB, forced GC {self.forced_gc}"
+            )
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self._last_mark = time.perf_counter()
+
+    def on_save(self, args, state, control, **kwargs):
+        self._last_mark = time.perf_counter()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self.chrome_trace:
+            with open(self.trace_path, 'w') as f:
+                json.dump({'traceEvents': self.trace_events, 'displayTimeUnit': 'ms'}, f)
+        if self.records:
+            summary = self.summary()
+            print(f"METRICS Throughput: {summary['tokens_per_second']:.0f} tokens/s, "
+                  f"{summary['samples_per_second']:.2f} samples/s over {summary['sampled_steps']} sampled steps")
+            print("METRICS Step time split: "
+                  + ", ".join(f"{phase} {summary['time_split'][phase]:.0%}" for phase in PHASES))
+            print(f"METRICS Peak RSS {summary['peak_rss_gb']:.2f} GB, {self.forced_gc} forced garbage collections")
+        print(f"FOLDER Telemetry saved to: {self.jsonl_path}")
+
+    def _record(self, step: int, now: float):
+        step_seconds = now - self._step_start
+        memory = psutil.virtual_memory()
+        if memory.percent > self.gc_threshold_percent:
+            logging.warning(f"WARNING Memory at {memory.percent:.0f}%, forcing garbage collection")
+            gc.collect()
+            if torch.backends.mps.is_available():
+                torch.mps.empty_cache()
+            self.forced_gc += 1
+
+        peak = peak_rss_bytes()
+        record = {
+            'step': step,
+            'time': round(now - self._origin, 4),
+            'step_s': round(step_seconds, 5),
+            **{f"{phase}_s": round(self._totals[phase], 5) for phase in PHASES},
+            'samples': self._samples,
+            'tokens': self._tokens,
+            'tokens_per_s': round(self._tokens / step_seconds, 2) if step_seconds > 0 else 0.0,
+            'samples_per_s': round(self._samples / step_seconds, 3) if step_seconds > 0 else 0.0,
+            'rss_gb': round(self.process.memory_info().rss / 1024**3, 3),
+            'peak_rss_gb': round(peak / 1024**3, 3) if peak is not None else None,
+            'system_memory_percent': memory.percent,
+            'forced_gc': self.forced_gc,
+        }
+        self.records.append(record)
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+        if self.chrome_trace:
+            to_us = lambda t: round((t - self._origin) * 1e6, 1)
+            self.trace_events.append({'name': f"step {step}", 'ph': 'X', 'pid': self.rank, 'tid': 0,
+                                      'ts': to_us(self._step_start), 'dur': round(step_seconds * 1e6, 1),
+                                      'args': {'tokens': self._tokens, 'samples': self._samples}})
+            for phase, start, end in self._spans:
+                self.trace_events.append({'name': phase, 'ph': 'X', 'pid': self.rank, 'tid': 1,
+                                          'ts': to_us(start), 'dur': round((end - start) * 1e6, 1)})
+            self.trace_events.append({'name': 'rss_gb', 'ph': 'C', 'pid': self.rank, 'ts': to_us(now),
+                                      'args': {'rss': record['rss_gb']}})
+
+    def summary(self) -> Dict:
+        """Throughput and time split aggregated over the sampled steps so far"""
+        seconds = sum(r['step_s'] for r in self.records) or float('inf')
+        peaks = [r['peak_rss_gb'] if r['peak_rss_gb'] is not None else r['rss_gb'] for r in self.records]
+        return {
+            'sampled_steps': len(self.records),
+            'tokens_per_second': sum(r['tokens'] for r in self.records) / seconds,
+            'samples_per_second': sum(r['samples'] for r in self.records) / seconds,
+            'time_split': {phase: sum(r[f"{phase}_s"] for r in self.records) / seconds for phase in PHASES},
+            'peak_rss_gb': max(peaks, default=0.0),
+            'forced_gc': self.forced_gc,
+        }
+
+
+def telemetry_from_config(config: Dict, rank: int = 0) -> Optional[TelemetryCallback]:
+    """TelemetryCallback configured by the telemetry_* keys, or None when telemetry is off"""
+    if not config.get('telemetry', True):
+        return None
+    return TelemetryCallback(
+        config.get('telemetry_dir', str(Path(config['output_dir']) / 'telemetry')),
+        sample_every=config.get('telemetry_sample_every', 10),
+        chrome_trace=config.get('telemetry_chrome_trace', False),
+        gc_threshold_percent=config.get('gc_threshold_percent', 80.0),
+        rank=rank
+    )
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Training Throughput Estimator
+Times a few forward/backward and optimizer steps of the training configuration on this
+machine, on the real model or on proxies built from its first layers at two depths, and
+extrapolates over the dataset's token-length distribution to an ETA, tokens/sec and peak
+memory with bootstrap confidence bounds
+"""
+
+import math
+import time
+import random
+import logging
+import statistics
+import numpy as np
+import torch
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from vitalis.data.batching import LengthGroupedBatchSampler
+from vitalis.data.packing import pack_sequences
+from vitalis.training.batch_autotune import release_device_memory, synchronize_device
+from vitalis.training.checkpoint_policy import PeakMemorySampler, apply_checkpoint_policy
+from vitalis.training.chunked_loss import compute_chunked_causal_lm_loss
+from vitalis.training.lean_optimizers import build_optimizer, decay_parameter_groups
+from vitalis.training.mxfp4_experts import PackedMXFP4Experts, load_packed_mxfp4_model
+from vitalis.utils.memory_planner import GB, MemoryPlanner, workload_from_config
+
+# The collators pad every batch to a multiple of this
+PAD_MULTIPLE = 8
+
+
+def training_schedule(config: Dict, mode: str) -> Dict:
+    """Sequence length, batch shape and run length the full or LoRA trainer uses for a config"""
+    if mode == 'lora':
+        return {
+            'max_length': config.get('lora_max_length', 512),
+            'batch_size': config.get('lora_batch_size', 1),
+            'gradient_accumulation_steps': config.get('lora_gradient_accumulation_steps', 8),
+            'epochs': 3,
+            'max_steps': config.get('lora_max_steps', -1),
+        }
+    return {
+        'max_length': config['max_length'],
+        'batch_size': config['batch_size'],
+        'gradient_accumulation_steps': config['gradient_accumulation_steps'],
+        'epochs': config['num_epochs'],
+        'max_steps': -1,
+    }
+
+
+def train_split_lengths(lengths: Sequence[int], seed: int = 42) -> List[int]:
+    """Lengths of the examples in the training side of the pipeline's seeded 90/10 random_split"""
+    train_size = int(0.9 * len(lengths))
+    order = torch.randperm(len(lengths), generator=torch.Generator().manual_seed(seed)).tolist()
+    return [lengths[i] for i in order[:train_size]]
+
+
+def plan_micro_batches(lengths: Sequence[int], max_length: int, batch_size: int,
+                       batching_mode: str = 'bucketed', seed: int = 42) -> List[Tuple[int, int]]:
+    """
+    (rows, padded sequence length) of every micro-batch in one epoch, formed the way the
+    training samplers and collators form them for batching_mode
+    """
+    truncated = [min(int(length), max_length) for length in lengths]
+    if batching_mode == 'packed':
+        rows = len(pack_sequences(truncated, max_length))
+        return [(min(batch_size, rows - start), max_length) for start in range(0, rows, batch_size)]
+    if batching_mode == 'fixed':
+        return [(min(batch_size, len(truncated) - start), max_length) for start in range(0, len(truncated), batch_size)]
+
+    batches = LengthGroupedBatchSampler(truncated, batch_size, seed=seed)._plan_batches(0)
+    return [
+        (len(batch), min(-(-max(truncated[i] for i in batch) // PAD_MULTIPLE) * PAD_MULTIPLE, max_length))
+        for batch in batches if batch
+    ]
+
+
+def probe_lengths(micro_batches: Sequence[Tuple[int, int]], count: int = 4) -> List[int]:
+    """Distinct padded lengths at evenly spaced quantiles of the planned micro-batches, longest included"""
+    seq_lens = sorted(seq_len for _, seq_len in micro_batches)
+    count = max(count, 2)
+    return sorted({seq_lens[min(len(seq_lens) - 1, int(q / (count - 1) * len(seq_lens)))] for q in range(count)})
+
+
+def time_steps(model, batch_size: int, seq_len: int, steps: int = 5, loss_mode: str = 'standard',
+               loss_chunk_size: int = 256) -> Dict:
+    """Wall time and peak memory of each of steps forward/backward passes, after one warmup step"""
+    device = next(model.parameters()).device
+    vocab_size = model.config.vocab_size
+    step_times, peaks = [], []
+    for step in range(steps + 1):
+        input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+        inputs = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids), 'labels': input_ids}
+        with PeakMemorySampler() as sampler:
+            start_time = time.time()
+            if loss_mode == 'chunked':
+                loss = compute_chunked_causal_lm_loss(model, inputs, loss_chunk_size)
+            else:
+                loss = model(**inputs, use_cache=False).loss
+            loss.backward()
+            synchronize_device(device)
+            elapsed = time.time() - start_time
+        model.zero_grad(set_to_none=True)
+        del loss
+        if step:
+            step_times.append(elapsed)
+            peaks.append(sampler.peak)
+    return {'seq_len': seq_len, 'step_times': step_times, 'peak_memory_bytes': peaks}
+
+
+def time_optimizer_steps(model, optimizer, steps: int = 3) -> List[float]:
+    """
+    Wall time of optimizer steps on small random gradients, after one warmup step that
+    allocates the optimizer state; the weights change, so only use this on probe models
+    """
+    device = next(model.parameters()).device
+    params = [p for p in model.parameters() if p.requires_grad]
+    step_times = []
+    for step in range(steps + 1):
+        for param in params:
+            param.grad = torch.randn_like(param) * 1e-3
+        start_time = time.time()
+        optimizer.step()
+        synchronize_device(device)
+        if step:
+            step_times.append(time.time() - start_time)
+        optimizer.zero_grad(set_to_none=True)
+    return step_times
+
+
+def measure_throughput(model, seq_lens: Sequence[int], batch_size: int, steps: int = 5, optimizer=None,
+                       loss_mode: str = 'standard', loss_chunk_size: int = 256) -> Dict:
+    """Timed forward/backward steps at every probe length, then timed optimizer steps"""
+    was_training = model.training
+    model.train()
+    probes = []
+    for seq_len in sorted(seq_lens):
+        probes.append(time_steps(model, batch_size, seq_len, steps, loss_mode, loss_chunk_size))
+        logging.info(f"METRICS Probe {batch_size} x {seq_len}: {statistics.median(probes[-1]['step_times']):.2f} s/step, "
+                     f"peak {max(probes[-1]['peak_memory_bytes']) / GB:.2f} GB")
+    optimizer_times = time_optimizer_steps(model, optimizer) if optimizer is not None else []
+    model.train(was_training)
+    return {'probes': probes, 'optimizer_step_times': optimizer_times}
+
+
+def extrapolate_depth(measurements: Dict[int, Dict], num_layers: int) -> Dict:
+    """
+    Full-depth measurement from proxy measurements at two depths
+
+    Step time and peak memory are taken as linear in depth (embeddings, head and loss are
+    the intercept, each decoder layer adds the slope), applied sample by sample; a noisy
+    negative slope never extrapolates below the deeper proxy
+    """
+    (shallow, low), (deep, high) = sorted(measurements.items())
+    scale = (num_layers - shallow) / (deep - shallow)
+
+    def extend(low_values, high_values):
+        return [max(a + (b - a) * scale, b) for a, b in zip(low_values, high_values)]
+
+    probes = [
+        {
+            'seq_len': low_probe['seq_len'],
+            'step_times': extend(low_probe['step_times'], high_probe['step_times']),
+            'peak_memory_bytes': extend(low_probe['peak_memory_bytes'], high_probe['peak_memory_bytes']),
+        }
+        for low_probe, high_probe in zip(low['probes'], high['probes'])
+    ]
+    return {'probes': probes, 'optimizer_step_times': extend(low['optimizer_step_times'], high['optimizer_step_times'])}
+
+
+def _epoch_seconds(probes: List[Dict], shape_counts: Counter, batch_size: int) -> float:
+    """Forward/backward seconds for one epoch of micro-batches, from a polynomial fit of step time over length"""
+    seq_lens = [probe['seq_len'] for probe in probes]
+    means = [statistics.fmean(probe['step_times']) for probe in probes]
+    # Quadratic with enough lengths (attention), else linear or constant
+    fit = np.poly1d(np.polyfit(seq_lens, means, min(len(seq_lens) - 1, 2)))
+    floor = min(means)
+    return sum(count * rows / batch_size * max(float(fit(seq_len)), floor)
+               for (rows, seq_len), count in shape_counts.items())
+
+
+def estimate_training_time(measurement: Dict, micro_batches: Sequence[Tuple[int, int]], real_tokens: int,
+                           batch_size: int, gradient_accumulation_steps: int, epochs: int, max_steps: int = -1,
+                           reserve_bytes: int = 0, confidence: float = 0.9, resamples: int = 1000,
+                           seed: int = 42) -> Dict:
+    """
+    ETA, real tokens/sec and peak memory of a run, with confidence bounds
+
+    Time bounds resample the timed steps (bootstrap) and refit; peak memory bounds are the
+    range over the timed steps at the longest length, plus reserve_bytes (optimizer state,
+    which no forward/backward probe holds)
+    """
+    steps_per_epoch = math.ceil(len(micro_batches) / gradient_accumulation_steps)
+    optimizer_steps = steps_per_epoch * epochs
+    if max_steps > 0:
+        optimizer_steps = min(optimizer_steps, max_steps)
+    # Share of the planned epochs a max_steps cap lets run
+    fraction = optimizer_steps / (steps_per_epoch * epochs) if steps_per_epoch else 0.0
+    shape_counts = Counter(micro_batches)
+
+    def total_seconds(probes: List[Dict], optimizer_times: List[float]) -> float:
+        optimizer_seconds = statistics.fmean(optimizer_times) if optimizer_times else 0.0
+        return _epoch_seconds(probes, shape_counts, batch_size) * epochs * fraction + optimizer_steps * optimizer_seconds
+
+    probes, optimizer_times = measurement['probes'], measurement['optimizer_step_times']
+    seconds = total_seconds(probes, optimizer_times)
+
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(resamples):
+        resampled = [
+            {'seq_len': probe['seq_len'], 'step_times': [rng.choice(probe['step_times']) for _ in probe['step_times']]}
+            for probe in probes
+        ]
+        samples.append(total_seconds(resampled, [rng.choice(optimizer_times) for _ in optimizer_times]))
+    samples.sort()
+    tail = (1 - confidence) / 2
+    lower = samples[int(tail * (len(samples) - 1))]
+    upper = samples[int(math.ceil((1 - tail) * (len(samples) - 1)))]
+
+    trained_tokens = real_tokens * epochs * fraction
+    longest = max(probes, key=lambda probe: probe['seq_len'])['peak_memory_bytes']
+    return {
+        'eta_seconds': seconds,
+        'eta_bounds_seconds': [lower, upper],
+        'eta_hours': seconds / 3600,
+        'eta_bounds_hours': [lower / 3600, upper / 3600],
+        'tokens_per_second': trained_tokens / seconds,
+        'tokens_per_second_bounds': [trained_tokens / upper, trained_tokens / lower],
+        'peak_memory_gb': (statistics.median(longest) + reserve_bytes) / GB,
+        'peak_memory_bounds_gb': [(min(longest) + reserve_bytes) / GB, (max(longest) + reserve_bytes) / GB],
+        'reserve_gb': reserve_bytes / GB,
+        'confidence': confidence,
+        'optimizer_steps': optimizer_steps,
+        'micro_batches': round(len(micro_batches) * epochs * fraction),
+        'trained_tokens': round(trained_tokens),
+        'padded_tokens': round(sum(rows * seq_len for rows, seq_len in micro_batches) * epochs * fraction),
+    }
+
+
+def build_probe_model(config: Dict, mode: str, num_layers: Optional[int] = None):
+    """
+    Model to time with the config's LoRA adapters or full-parameter gradients and its
+    checkpointing policy: the real weights, or with num_layers a randomly initialized model
+    with only the first num_layers layers of the real config (same per-layer shapes). With
+    packed_experts the LoRA model keeps its experts MXFP4-packed, as the LoRA trainer does
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    # The LoRA trainer keeps MXFP4 experts packed on the CPU with packed_experts
+    packed = mode == 'lora' and config.get('packed_experts', False)
+    if num_layers:
+        model_config = AutoConfig.from_pretrained(config['model_path'], local_files_only=True, trust_remote_code=True)
+        model_config.num_hidden_layers = num_layers
+        if getattr(model_config, 'layer_types', None):
+            model_config.layer_types = model_config.layer_types[:num_layers]
+        if hasattr(model_config, 'quantization_config'):
+            del model_config.quantization_config
+        model = AutoModelForCausalLM.from_config(model_config, torch_dtype=torch.bfloat16)
+        if packed:
+            for layer in model.model.layers:
+                layer.mlp.experts = PackedMXFP4Experts(
+                    model_config.num_local_experts, model_config.hidden_size, model_config.intermediate_size,
+                    alpha=getattr(layer.mlp.experts, 'alpha', 1.702), limit=getattr(layer.mlp.experts, 'limit', 7.0),
+                    dtype=torch.bfloat16, device='cpu'
+                )
+    elif packed:
+        model = load_packed_mxfp4_model(config['model_path'])
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            config['model_path'],
+            local_files_only=True,
+            trust_remote_code=True,
+            torch_dtype=torch.bfloat16,
+            low_cpu_mem_usage=True
+        )
+    if torch.backends.mps.is_available() and not packed:
+        model = model.to('mps')
+    apply_checkpoint_policy(model, config.get('gradient_checkpointing', True))
+
+    if mode == 'lora':
+        from peft import LoraConfig, get_peft_model, TaskType
+
+        # lora_first_layer is ignored on proxies, which may not reach that layer
+        first_layer = 0 if num_layers else config.get('lora_first_layer', 0)
+        layer_kwargs = {'layers_to_transform': list(range(first_layer, model.config.num_hidden_layers))} if first_layer else {}
+        model = get_peft_model(model, LoraConfig(
+            task_type=TaskType.CAUSAL_LM,
+            r=config.get('lora_r', 8),
+            lora_alpha=config.get('lora_alpha', 16),
+            lora_dropout=config.get('lora_dropout', 0.1),
+            target_modules=config.get('lora_target_modules', ["q_proj", "v_proj"]),
+            bias="none",
+            **layer_kwargs
+        ))
+    return model
+
+
+def _probe_optimizer(model, config: Dict, mode: str):
+    if mode == 'lora':
+        return torch.optim.AdamW([p for p in model.parameters() if p.requires_grad],
+                                 lr=config.get('lora_learning_rate', 1e-4), weight_decay=0.01)
+    learning_rate = config.get('learning_rate', 1e-5)
+    return build_optimizer(model, config, learning_rate, 0.01) or \
+        torch.optim.AdamW(decay_parameter_groups(model, 0.01), lr=learning_rate)
+
+
+def dataset_token_lengths(config: Dict) -> List[int]:
+    """Untruncated chat-template token length of every training example (deduplicated when configured)"""
+    from transformers import AutoTokenizer
+    from vitalis.data.dataset import SYSTEM_PROMPT
+    from vitalis.data.length_profile import collect_token_lengths
+    from vitalis.data.pipeline import training_data_path
+    from vitalis.data.streaming import iter_training_examples
+
+    tokenizer = AutoTokenizer.from_pretrained(config['model_path'], local_files_only=True, trust_remote_code=True)
+    return collect_token_lengths(
+        iter_training_examples(training_data_path(config, tokenizer)), tokenizer, SYSTEM_PROMPT,
+        num_workers=config.get('preprocessing_workers'),
+        chunk_size=config.get('preprocessing_chunk_size', 256)
+    )['lengths']
+
+
+def estimate_from_config(config: Dict, mode: str, lengths: Sequence[int], proxy_layers: Optional[int] = None,
+                         steps: int = 5, num_lengths: int = 4, confidence: float = 0.9) -> Dict:
+    """
+    Measured estimate for a training config and the untruncated token lengths of its dataset
+
+    With proxy_layers, proxies of proxy_layers and twice as many layers are timed and
+    extrapolated to the real depth; otherwise the real model is loaded and timed
+    """
+    schedule = training_schedule(config, mode)
+    batching_mode = config.get('batching_mode', 'bucketed')
+    train_lengths = train_split_lengths(lengths, config.get('split_seed', 42))
+    micro_batches = plan_micro_batches(train_lengths, schedule['max_length'], schedule['batch_size'], batching_mode)
+    seq_lens = probe_lengths(micro_batches, num_lengths)
+
+    planner = MemoryPlanner(config['model_path'])
+    depths = [proxy_layers, 2 * proxy_layers] if proxy_layers else [None]
+    measurements = {}
+    for depth in depths:
+        logging.info(f"PROCESSING Timing {depth or planner.num_layers} layers at lengths {seq_lens}...")
+        model = build_probe_model(config, mode, depth)
+        optimizer = _probe_optimizer(model, config, mode)
+        measurements[depth] = measure_throughput(
+            model, seq_lens, schedule['batch_size'], steps, optimizer,
+            loss_mode=config.get('loss_mode', 'standard'),
+            loss_chunk_size=config.get('loss_chunk_size', 256)
+        )
+        device = next(model.parameters()).device
+        del model, optimizer
+        release_device_memory(device)
+    measurement = extrapolate_depth(measurements, planner.num_layers) if proxy_layers else measurements[None]
+
+    # Optimizer state is allocated by the first optimizer step, after every probe
+    dtype = 'mxfp4' if mode == 'lora' and config.get('packed_experts', False) else 'bfloat16'
+    plan = planner.plan(dtype=dtype, **workload_from_config(config, mode, batch_size=schedule['batch_size'],
+                                                            seq_len=schedule['max_length']))
+    report = estimate_training_time(
+        measurement, micro_batches,
+        real_tokens=sum(min(length, schedule['max_length']) for length in train_lengths),
+        batch_size=schedule['batch_size'],
+        gradient_accumulation_steps=schedule['gradient_accumulation_steps'],
+        epochs=schedule['epochs'],
+        max_steps=schedule['max_steps'],
+        reserve_bytes=int(plan['components']['optimizer_state']),
+        confidence=confidence
+    )
+    report.update({
+        'mode': mode,
+        'batching_mode': batching_mode,
+        'measured_layers': [depth or planner.num_layers for depth in depths],
+        'num_layers': planner.num_layers,
+        'train_examples': len(train_lengths),
+        **schedule,
+        'measurement': measurement,
+    })
+    return report
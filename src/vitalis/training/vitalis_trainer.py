@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Vitalis Trainer
+Hugging Face Trainer extension shared by the full fine-tuning and LoRA pipelines
+Adds length-bucketed batch sampling, the chunked loss path and background checkpoint
+writing on top of the standard training loop
+"""
+
+import os
+from torch.utils.data import DataLoader
+from transformers import Trainer
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+from vitalis.training.chunked_loss import compute_chunked_causal_lm_loss
+from vitalis.training.async_checkpoint import AsyncCheckpointWriter, rng_state, trainer_state_json
+
+
+class VitalisTrainer(Trainer):
+    """
+    Trainer that accepts a custom batch sampler for the training set
+
+    When train_batch_sampler is provided it replaces the default random sampler,
+    so batches follow the sampler's length grouping. With loss_mode='chunked' the
+    loss is computed by chunked_cross_entropy instead of the model's full-logits loss.
+    With a checkpoint_writer, checkpoints are snapshotted to host memory and written
+    in the background instead of blocking the training loop
+    """
+
+    def __init__(self, *args, train_batch_sampler=None, loss_mode: str = 'standard',
+                 loss_chunk_size: int = 256, checkpoint_writer: AsyncCheckpointWriter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train_batch_sampler = train_batch_sampler
+        self.loss_mode = loss_mode
+        self.loss_chunk_size = loss_chunk_size
+        self.checkpoint_writer = checkpoint_writer
+
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.wait()
+
+    def log(self, logs, *args, **kwargs):
+        if self.checkpoint_writer is not None:
+            logs = {**logs, **self.checkpoint_writer.metrics()}
+        super().log(logs, *args, **kwargs)
+
+    def _save_checkpoint(self, model, trial):
+        if self.checkpoint_writer is None:
+            return super()._save_checkpoint(model, trial)
+
+        checkpoint_folder = f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}"
+        run_dir = self._get_output_dir(trial=trial)
+        if os.path.abspath(run_dir) != os.path.abspath(str(self.checkpoint_writer.output_dir)):
+            # Hyperparameter-search run directories are not managed by the writer
+            return super()._save_checkpoint(model, trial)
+
+        # Trainer._save_checkpoint derives the best checkpoint from best_global_step; it is set
+        # here before the write finishes, so rotation protects it and _load_best_model finds it
+        best_global_step = getattr(self.state, 'best_global_step', None)
+        if self.args.metric_for_best_model is not None and best_global_step:
+            self.state.best_model_checkpoint = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{best_global_step}")
+
+        objects = {}
+        if not self.args.save_only_model:
+            objects['optimizer.pt'] = self.optimizer.state_dict()
+            objects['scheduler.pt'] = self.lr_scheduler.state_dict()
+            objects['rng_state.pth'] = rng_state()
+
+        text_files = {'trainer_state.json': trainer_state_json(self.state)}
+        unwrapped = self.accelerator.unwrap_model(self.model)
+        if hasattr(unwrapped, 'config'):
+            text_files['config.json'] = unwrapped.config.to_json_string()
+
+        if self.args.should_save:
+            self.checkpoint_writer.submit(
+                checkpoint_folder,
+                unwrapped.state_dict(),
+                objects=objects,
+                text_files=text_files,
+                protect=[self.state.best_model_checkpoint]
+            )
+
+    def _load_best_model(self):
+        # The best checkpoint may still be in the writer queue
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+        return super()._load_best_model()
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        if self.loss_mode != 'chunked':
+            return super().compute_loss(
+                model, inputs, return_outputs=return_outputs, num_items_in_batch=num_items_in_batch
+            )
+
+        loss = compute_chunked_causal_lm_loss(model, inputs, self.loss_chunk_size, num_items_in_batch)
+        # Evaluation only needs the loss; there are no logits to return
+        return (loss, {'loss': loss}) if return_outputs else loss
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.train_batch_sampler is None:
+            return super().get_train_dataloader()
+
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=self.train_batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
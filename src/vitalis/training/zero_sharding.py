@@ -0,0 +1,706 @@
+#!/usr/bin/env python3
+"""
+ZeRO-3 Sharded Full Fine-Tuning
+Partitions parameters, gradients and optimizer state of a causal LM across gloo ranks on one
+or more hosts; each layer's weights are all-gathered just before its forward and backward and
+freed right after, so a rank holds 1/N of the model plus the layer it is working on
+"""
+
+import os
+import json
+import math
+import shutil
+import logging
+import tempfile
+import time
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from vitalis.training.lean_optimizers import build_optimizer, no_weight_decay
+from vitalis.training.mxfp4_experts import EXPERT_PROJECTIONS, dequantize_mxfp4
+
+# Set by launch_sharded_training so every rank's EmergencyReliefTrainer runs sharded
+ZERO_SHARDING_ENV = "VITALIS_ZERO_SHARDING"
+
+# Elements per float32 all-reduce when averaging one layer's gradients
+REDUCE_CHUNK = 1 << 24
+
+SHARDED_CHECKPOINT_PREFIX = "sharded-checkpoint"
+
+
+def init_process_group() -> Tuple[int, int]:
+    """gloo process group from RANK / WORLD_SIZE / MASTER_ADDR / MASTER_PORT (torchrun or the launcher)"""
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    rank = int(os.environ.get('RANK', 0))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group(backend='gloo', rank=rank, world_size=world_size)
+    return rank, world_size
+
+
+def default_units(model) -> List[nn.Module]:
+    """Modules gathered as one piece: embeddings, every decoder layer, final norm and lm_head"""
+    return [model.model.embed_tokens, *model.model.layers, model.model.norm, model.lm_head]
+
+
+def _output_tensors(output) -> List[torch.Tensor]:
+    if torch.is_tensor(output):
+        return [output]
+    if isinstance(output, dict):
+        output = list(output.values())
+    if isinstance(output, (list, tuple)):
+        return [t for item in output for t in _output_tensors(item)]
+    return []
+
+
+class FlatShard:
+    """
+    Parameters flattened into one buffer of which this rank owns a 1/world_size slice
+
+    The parameters stay registered on their modules as views into the full buffer; its
+    storage is resized to zero whenever the unit is not in use, and gathered back from
+    every rank's slice when it is
+    """
+
+    def __init__(self, model, names: List[str], load_tensor: Callable[[str], torch.Tensor], rank: int, world_size: int,
+                 decay: bool = True):
+        self.names = names
+        self.decay = decay
+        self.rank = rank
+        self.world_size = world_size
+
+        owners = [model.get_submodule(name.rpartition('.')[0]) for name in names]
+        leaves = [name.rpartition('.')[2] for name in names]
+        originals = [owner._parameters[leaf] for owner, leaf in zip(owners, leaves)]
+        total = sum(param.numel() for param in originals)
+        self.shard_size = math.ceil(total / world_size)
+        self.full = torch.zeros(self.shard_size * world_size, dtype=originals[0].dtype)
+
+        self.params = []
+        offset = 0
+        for name, owner, leaf, original in zip(names, owners, leaves, originals):
+            view = self.full[offset:offset + original.numel()].view(original.shape)
+            view.copy_(load_tensor(name).reshape(original.shape))
+            param = nn.Parameter(view, requires_grad=original.requires_grad)
+            owner._parameters[leaf] = param
+            self.params.append(param)
+            offset += original.numel()
+
+        self.shard = nn.Parameter(self.full[rank * self.shard_size:(rank + 1) * self.shard_size].clone())
+        self.gathered = True
+        self.free()
+
+    def gather(self):
+        if self.gathered:
+            return
+        self.full.untyped_storage().resize_(self.full.numel() * self.full.element_size())
+        # Autograd saved the parameter views during forward; refilling the buffer restores
+        # the same values, so the shared version counter is kept from flagging the backward
+        with torch.no_grad(), torch.autograd._unsafe_preserve_version_counter(self.full):
+            if self.world_size == 1:
+                self.full.copy_(self.shard.detach())
+            else:
+                # Moved as bytes: gloo has no bfloat16 all_gather on every build
+                chunks = list(self.full.view(self.world_size, self.shard_size).view(torch.uint8).unbind(0))
+                dist.all_gather(chunks, self.shard.detach().view(torch.uint8))
+        self.gathered = True
+
+    def free(self):
+        if self.gathered:
+            self.full.untyped_storage().resize_(0)
+            self.gathered = False
+
+    def reduce_gradients(self):
+        """Average the full gradients over ranks and add this rank's slice to shard.grad"""
+        grad = torch.zeros(self.full.numel(), dtype=self.full.dtype)
+        offset = 0
+        for param in self.params:
+            if param.grad is not None:
+                grad[offset:offset + param.numel()].copy_(param.grad.reshape(-1))
+                param.grad = None
+            offset += param.numel()
+
+        if self.world_size > 1:
+            for start in range(0, grad.numel(), REDUCE_CHUNK):
+                part = grad[start:start + REDUCE_CHUNK].float()
+                dist.all_reduce(part)
+                grad[start:start + REDUCE_CHUNK].copy_(part.div_(self.world_size))
+
+        local = grad[self.rank * self.shard_size:(self.rank + 1) * self.shard_size]
+        if self.shard.grad is None:
+            self.shard.grad = local.clone()
+        else:
+            self.shard.grad.add_(local)
+
+
+class ShardedUnit:
+    """
+    Hooks that gather a module's FlatShards before its forward and backward
+
+    The forward post-hook frees the weights and registers a hook on the module's outputs,
+    which fires when their gradient arrives, i.e. right before the module's own backward.
+    Once every trainable parameter has its gradient the shards reduce and free again
+    """
+
+    def __init__(self, owner: 'ShardedModel', module: nn.Module, flats: List[FlatShard]):
+        self.owner = owner
+        self.flats = flats
+        self.trainable = [param for flat in flats for param in flat.params if param.requires_grad]
+        self.in_backward = False
+        self._ready = 0
+        module.register_forward_pre_hook(self._pre_forward)
+        module.register_forward_hook(self._post_forward)
+        for param in self.trainable:
+            param.register_post_accumulate_grad_hook(self._on_grad_ready)
+
+    def gather(self):
+        for flat in self.flats:
+            flat.gather()
+
+    def free(self):
+        for flat in self.flats:
+            flat.free()
+
+    def _pre_forward(self, module, args):
+        self.gather()
+
+    def _post_forward(self, module, args, output):
+        if self.in_backward:
+            # Recomputation of a checkpointed unit inside its backward; keep the weights
+            return
+        if torch.is_grad_enabled() and self.trainable:
+            for tensor in _output_tensors(output):
+                if tensor.requires_grad:
+                    tensor.register_hook(self._pre_backward)
+        self.free()
+
+    def _pre_backward(self, grad):
+        self.owner._queue_finish_backward()
+        self.in_backward = True
+        self.gather()
+
+    def _on_grad_ready(self, param):
+        self._ready += 1
+        if self._ready == len(self.trainable):
+            self.finish_backward()
+
+    def finish_backward(self):
+        for flat in self.flats:
+            flat.reduce_gradients()
+        self.free()
+        self._ready = 0
+        self.in_backward = False
+
+
+class ShardedModel:
+    """
+    A causal LM whose parameters are split into per-unit FlatShards across ranks
+
+    load_tensor(name) supplies each parameter's value (defaults to the model's own, for a
+    model that is already materialized); a meta-device model is completed unit by unit,
+    so no rank ever holds more than one unit's full weights. Decayed and undecayed
+    parameters go to separate shards so the optimizer groups stay as in the Trainer path
+    """
+
+    def __init__(self, model, rank: int = 0, world_size: int = 1,
+                 load_tensor: Optional[Callable[[str], torch.Tensor]] = None,
+                 units: Optional[List[nn.Module]] = None):
+        self.model = model
+        self.rank = rank
+        self.world_size = world_size
+        self._finish_queued = False
+
+        all_names = [name for name, _ in model.named_parameters(remove_duplicate=False)]
+        if len(all_names) != len(set(id(p) for p in model.parameters())):
+            raise ValueError("Tied parameters are not supported in sharded training")
+        if load_tensor is None:
+            params = dict(model.named_parameters())
+            load_tensor = lambda name: params[name].detach()
+
+        module_names = {module: name for name, module in model.named_modules()}
+        self.units, claimed = [], set()
+        for module in units or default_units(model):
+            prefix = module_names[module]
+            named = [(f"{prefix}.{name}" if prefix else name, param) for name, param in module.named_parameters()]
+            flats = []
+            for decay in (True, False):
+                names = [name for name, param in named if no_weight_decay(name, param) != decay]
+                if names:
+                    flats.append(FlatShard(model, names, load_tensor, rank, world_size, decay=decay))
+            claimed.update(name for name, _ in named)
+            self.units.append(ShardedUnit(self, module, flats))
+
+        unclaimed = sorted(set(all_names) - claimed)
+        if unclaimed:
+            raise ValueError(f"Parameters outside every shard unit: {unclaimed[:5]}")
+
+    @property
+    def flats(self) -> List[FlatShard]:
+        return [flat for unit in self.units for flat in unit.flats]
+
+    def parameter_groups(self, weight_decay: float) -> List[Dict]:
+        """This rank's shards as optimizer groups: decayed weights and undecayed biases / norms"""
+        return [
+            {'params': [flat.shard for flat in self.flats if flat.decay], 'weight_decay': weight_decay},
+            {'params': [flat.shard for flat in self.flats if not flat.decay], 'weight_decay': 0.0},
+        ]
+
+    def shard_bytes(self) -> int:
+        return sum(flat.shard.numel() * flat.shard.element_size() for flat in self.flats)
+
+    def largest_unit_bytes(self) -> int:
+        return max(sum(flat.full.numel() * flat.full.element_size() for flat in unit.flats) for unit in self.units)
+
+    def _queue_finish_backward(self):
+        if not self._finish_queued:
+            self._finish_queued = True
+            torch.autograd.Variable._execution_engine.queue_callback(self._finish_backward)
+
+    def _finish_backward(self):
+        # Units whose parameters did not all receive a gradient still have to reduce and free
+        for unit in self.units:
+            if unit.in_backward or unit._ready:
+                unit.finish_backward()
+        self._finish_queued = False
+
+    def zero_grad(self):
+        for flat in self.flats:
+            flat.shard.grad = None
+
+    def clip_grad_norm_(self, max_norm: float) -> float:
+        """Clip by the global gradient norm over all ranks' shards; returns the norm before clipping"""
+        squared = torch.zeros(1, dtype=torch.float32)
+        for flat in self.flats:
+            if flat.shard.grad is not None:
+                squared += flat.shard.grad.float().pow(2).sum()
+        if self.world_size > 1:
+            dist.all_reduce(squared)
+        norm = squared.sqrt().item()
+        if max_norm and norm > max_norm:
+            for flat in self.flats:
+                if flat.shard.grad is not None:
+                    flat.shard.grad.mul_(max_norm / (norm + 1e-6))
+        return norm
+
+    def shard_state(self) -> List[torch.Tensor]:
+        return [flat.shard.detach() for flat in self.flats]
+
+    def load_shard_state(self, tensors: List[torch.Tensor]):
+        for flat, tensor in zip(self.flats, tensors):
+            flat.shard.data.copy_(tensor)
+
+    def save_pretrained(self, output_dir: str):
+        """
+        Gather one unit at a time and write it as its own safetensors file from rank 0,
+        with an index and the model config, in the layout from_pretrained loads
+        """
+        from safetensors.torch import save_file
+
+        output_dir = Path(output_dir)
+        tmp_dir = output_dir.with_name(f".{output_dir.name}.tmp-{os.getpid()}")
+        if self.rank == 0:
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir)
+            tmp_dir.mkdir(parents=True)
+
+        weight_map, total_size = {}, 0
+        for index, unit in enumerate(self.units, 1):
+            unit.gather()
+            if self.rank == 0:
+                tensors = {name: param.detach().clone() for flat in unit.flats for name, param in zip(flat.names, flat.params)}
+                filename = f"model-{index:05d}-of-{len(self.units):05d}.safetensors"
+                save_file(tensors, str(tmp_dir / filename), metadata={'format': 'pt'})
+                for name, tensor in tensors.items():
+                    weight_map[name] = filename
+                    total_size += tensor.numel() * tensor.element_size()
+                del tensors
+            unit.free()
+
+        if self.rank == 0:
+            with open(tmp_dir / 'model.safetensors.index.json', 'w') as f:
+                json.dump({'metadata': {'total_size': total_size}, 'weight_map': weight_map}, f, indent=2)
+            self.model.config.save_pretrained(str(tmp_dir))
+            if getattr(self.model, 'generation_config', None) is not None:
+                self.model.generation_config.save_pretrained(str(tmp_dir))
+            if output_dir.exists():
+                shutil.rmtree(output_dir)
+            os.replace(tmp_dir, output_dir)
+        if self.world_size > 1:
+            dist.barrier()
+
+
+class CheckpointReader:
+    """
+    Parameter values from a safetensors checkpoint, with MXFP4 expert blocks dequantized
+    to the dense (experts, in, out) layout of GptOssExperts
+    """
+
+    def __init__(self, model_path: str, dtype: torch.dtype = torch.bfloat16):
+        self.model_path = Path(model_path)
+        self.dtype = dtype
+        index_path = self.model_path / 'model.safetensors.index.json'
+        if index_path.exists():
+            with open(index_path, 'r') as f:
+                self.weight_map = json.load(f)['weight_map']
+        else:
+            from safetensors import safe_open
+
+            with safe_open(str(self.model_path / 'model.safetensors'), framework='pt', device='cpu') as f:
+                self.weight_map = {name: 'model.safetensors' for name in f.keys()}
+        self._files = {}
+
+    def _tensor(self, name: str) -> torch.Tensor:
+        from safetensors import safe_open
+
+        filename = self.weight_map[name]
+        if filename not in self._files:
+            self._files[filename] = safe_open(str(self.model_path / filename), framework='pt', device='cpu')
+        return self._files[filename].get_tensor(name)
+
+    def __call__(self, name: str) -> torch.Tensor:
+        if name in self.weight_map:
+            return self._tensor(name).to(self.dtype)
+        prefix, _, leaf = name.rpartition('.')
+        if leaf in EXPERT_PROJECTIONS and f"{name}_blocks" in self.weight_map:
+            weight = dequantize_mxfp4(self._tensor(f"{name}_blocks"), self._tensor(f"{name}_scales"), self.dtype)
+            return weight.transpose(1, 2)
+        raise KeyError(f"Checkpoint {self.model_path} has no tensor for {name}")
+
+
+def load_sharded_model(model_path: str, rank: int, world_size: int, dtype: torch.dtype = torch.bfloat16):
+    """
+    Causal LM built on the meta device and completed unit by unit from the checkpoint,
+    keeping only this rank's shards; returns (model, ShardedModel)
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    config = AutoConfig.from_pretrained(model_path, local_files_only=True, trust_remote_code=True)
+    if hasattr(config, 'quantization_config'):
+        # Experts are trained dequantized
+        del config.quantization_config
+    with torch.device('meta'):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+
+    # Non-persistent buffers (rotary frequencies) are not in the checkpoint; rebuild them on the CPU
+    rotary = model.model.rotary_emb
+    model.model.rotary_emb = type(rotary)(config=config)
+
+    start_time = time.time()
+    sharded = ShardedModel(model, rank, world_size, load_tensor=CheckpointReader(model_path, dtype))
+    logging.info(f"COMPLETED Rank {rank}/{world_size}: {sharded.shard_bytes() / 1024**3:.2f} GB of shards, "
+                 f"largest gathered unit {sharded.largest_unit_bytes() / 1024**3:.2f} GB "
+                 f"({time.time() - start_time:.0f}s)")
+    return model, sharded
+
+
+def _all_reduce_sum(values: List[float]) -> List[float]:
+    tensor = torch.tensor(values, dtype=torch.float64)
+    if dist.is_initialized():
+        dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+class ShardedTrainer:
+    """
+    Data-parallel training loop over a ShardedModel
+
+    Every rank reads its own slice of each epoch, gradients are averaged into the owning
+    rank's shards during backward and the optimizer steps only the local shards. Uses the
+    training config keys of the Trainer path (batch_size, gradient_accumulation_steps,
+    learning_rate, warmup_steps, num_epochs, logging/eval/save_steps, optimizer)
+    """
+
+    def __init__(self, sharded: ShardedModel, config: Dict, train_dataset, val_dataset, data_collator):
+        from transformers import get_linear_schedule_with_warmup
+
+        self.sharded = sharded
+        self.model = sharded.model
+        self.config = config
+        self.train_dataset = train_dataset
+        self.val_dataset = val_dataset
+        self.data_collator = data_collator
+        self.rank = sharded.rank
+        self.world_size = sharded.world_size
+        self.output_dir = Path(config['output_dir'])
+
+        groups = sharded.parameter_groups(0.01)
+        # Every rank indexes its shards from 0, so offloaded moments need a directory per rank
+        offload_dir = Path(config.get('optimizer_offload_dir', self.output_dir / 'optimizer_offload')) / f"rank{self.rank}"
+        self.optimizer = build_optimizer(
+            self.model, {**config, 'optimizer_offload_dir': str(offload_dir)}, config['learning_rate'], 0.01,
+            param_groups=groups
+        ) or torch.optim.AdamW(groups, lr=config['learning_rate'])
+        self.accumulation = config.get('gradient_accumulation_steps', 1)
+        self.train_loader = self._loader(train_dataset, shuffle=True)
+        steps_per_epoch = len(self.train_loader) // self.accumulation
+        if steps_per_epoch == 0:
+            raise ValueError(f"{len(self.train_loader)} batches per rank are fewer than gradient_accumulation_steps")
+        self.total_steps = config.get('max_steps') or steps_per_epoch * config['num_epochs']
+        self.lr_scheduler = get_linear_schedule_with_warmup(self.optimizer, config.get('warmup_steps', 0), self.total_steps)
+        self.global_step = 0
+
+    def _loader(self, dataset, shuffle: bool):
+        from torch.utils.data import DataLoader
+        from torch.utils.data.distributed import DistributedSampler
+
+        # Padded to the same number of samples on every rank: each forward is a collective
+        sampler = DistributedSampler(dataset, num_replicas=self.world_size, rank=self.rank,
+                                     shuffle=shuffle, seed=self.config.get('seed', 42))
+        return DataLoader(dataset, batch_size=self.config['batch_size'], sampler=sampler,
+                          collate_fn=self.data_collator)
+
+    def train(self):
+        from transformers.trainer_utils import TrainOutput
+
+        start_step = self.load_checkpoint() if self.config.get('resume_from_checkpoint', True) else 0
+        self.model.train()
+        logging_steps = self.config.get('logging_steps', 10)
+        eval_steps = self.config.get('eval_steps')
+        save_steps = self.config.get('save_steps')
+        loss_sum = tokens_seen = 0.0
+        window_loss, window_steps, window_start = 0.0, 0, time.time()
+        micro_step = 0
+
+        epoch = 0
+        while self.global_step < self.total_steps:
+            self.train_loader.sampler.set_epoch(epoch)
+            for batch in self.train_loader:
+                micro_step += 1
+                if micro_step <= start_step * self.accumulation:
+                    # Batches consumed before the resumed checkpoint
+                    continue
+                loss = self.model(**batch, use_cache=False).loss
+                (loss / self.accumulation).backward()
+                window_loss += loss.item() / self.accumulation
+                tokens_seen += batch['input_ids'].numel()
+                if micro_step % self.accumulation:
+                    continue
+
+                grad_norm = self.sharded.clip_grad_norm_(self.config.get('max_grad_norm', 1.0))
+                self.optimizer.step()
+                self.lr_scheduler.step()
+                self.sharded.zero_grad()
+                self.global_step += 1
+                window_steps += 1
+
+                if self.global_step % logging_steps == 0:
+                    total, steps = _all_reduce_sum([window_loss, window_steps])
+                    loss_sum += total / self.world_size
+                    if self.rank == 0:
+                        logging.info(
+                            f"METRICS step {self.global_step}/{self.total_steps}: loss {total / steps:.4f}, "
+                            f"lr {self.lr_scheduler.get_last_lr()[0]:.2e}, grad norm {grad_norm:.3f}, "
+                            f"{(time.time() - window_start) / window_steps:.1f}s/step"
+                        )
+                    window_loss, window_steps, window_start = 0.0, 0, time.time()
+                if eval_steps and self.global_step % eval_steps == 0:
+                    self.evaluate()
+                if save_steps and self.global_step % save_steps == 0:
+                    self.save_checkpoint()
+                if self.global_step >= self.total_steps:
+                    break
+            epoch += 1
+
+        total, _ = _all_reduce_sum([window_loss, 0])
+        loss_sum += total / self.world_size
+        trained_steps = max(1, self.global_step - start_step)
+        return TrainOutput(self.global_step, loss_sum / trained_steps, {'train_tokens_per_rank': tokens_seen})
+
+    @torch.no_grad()
+    def evaluate(self) -> Dict[str, float]:
+        self.model.eval()
+        loss_sum = batches = 0.0
+        for batch in self._loader(self.val_dataset, shuffle=False):
+            loss_sum += self.model(**batch, use_cache=False).loss.item()
+            batches += 1
+        self.model.train()
+        total, count = _all_reduce_sum([loss_sum, batches])
+        metrics = {'eval_loss': total / max(count, 1)}
+        if self.rank == 0:
+            logging.info(f"METRICS step {self.global_step}: eval loss {metrics['eval_loss']:.4f}")
+        return metrics
+
+    def _checkpoint_dirs(self) -> List[Path]:
+        dirs = [d for d in self.output_dir.glob(f"{SHARDED_CHECKPOINT_PREFIX}-*")
+                if len(list(d.glob('rank*.pt'))) == self.world_size]
+        return sorted(dirs, key=lambda d: int(d.name.rsplit('-', 1)[1]))
+
+    def save_checkpoint(self):
+        """Every rank writes its shards and optimizer state; rank 0 keeps the newest three"""
+        checkpoint_dir = self.output_dir / f"{SHARDED_CHECKPOINT_PREFIX}-{self.global_step}"
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        path = checkpoint_dir / f"rank{self.rank}.pt"
+        tmp_path = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+        torch.save({
+            'shards': self.sharded.shard_state(),
+            'optimizer': self.optimizer.state_dict(),
+            'scheduler': self.lr_scheduler.state_dict(),
+            'global_step': self.global_step,
+        }, tmp_path)
+        os.replace(tmp_path, path)
+        if self.world_size > 1:
+            dist.barrier()
+        if self.rank == 0:
+            for old in self._checkpoint_dirs()[:-3]:
+                shutil.rmtree(old, ignore_errors=True)
+            logging.info(f"SAVE Sharded checkpoint {checkpoint_dir}")
+
+    def load_checkpoint(self) -> int:
+        """Restore the newest complete sharded checkpoint; returns its step (0 when there is none)"""
+        dirs = self._checkpoint_dirs()
+        if not dirs:
+            return 0
+        state = torch.load(dirs[-1] / f"rank{self.rank}.pt", map_location='cpu', weights_only=False)
+        self.sharded.load_shard_state(state['shards'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.lr_scheduler.load_state_dict(state['scheduler'])
+        self.global_step = state['global_step']
+        logging.info(f"COMPLETED Resumed sharded training from {dirs[-1]} at step {self.global_step}")
+        return self.global_step
+
+    def save_model(self, output_dir: str):
+        self.sharded.save_pretrained(output_dir)
+
+
+def _run_rank(local_rank: int, world_size: int, config_path: str, threads: int, port: int):
+    os.environ.update({
+        'RANK': str(local_rank),
+        'LOCAL_RANK': str(local_rank),
+        'WORLD_SIZE': str(world_size),
+        'MASTER_ADDR': '127.0.0.1',
+        'MASTER_PORT': str(port),
+        ZERO_SHARDING_ENV: '1',
+    })
+    torch.set_num_threads(threads)
+
+    from vitalis.training.emergency_relief_trainer import EmergencyReliefTrainer
+
+    trainer = EmergencyReliefTrainer(config_path)
+    if not trainer.run_complete_pipeline():
+        raise SystemExit(1)
+
+
+def launch_sharded_training(config_path: str, num_processes: int, threads_per_rank: Optional[int] = None,
+                            port: Optional[int] = None) -> Dict:
+    """
+    Full fine-tuning with EmergencyReliefTrainer on num_processes sharded gloo ranks on this machine
+
+    For several hosts, start scripts/train_emergency_relief_ai.py under torchrun with
+    zero_sharding set in the training config instead
+    """
+    from vitalis.training.data_parallel import _free_port
+
+    threads = threads_per_rank or max(1, (os.cpu_count() or 1) // num_processes)
+    port = port or _free_port()
+    logging.info(f"LAUNCH Starting {num_processes} sharded gloo ranks, {threads} threads each")
+
+    start_time = time.time()
+    mp.start_processes(
+        _run_rank,
+        args=(num_processes, config_path, threads, port),
+        nprocs=num_processes,
+        join=True,
+        start_method='spawn'
+    )
+    return {'num_processes': num_processes, 'threads_per_rank': threads, 'seconds': time.time() - start_time}
+
+
+def _tiny_model(seed: int):
+    from transformers import GptOssConfig, GptOssForCausalLM
+
+    torch.manual_seed(seed)
+    config = GptOssConfig(
+        vocab_size=97,
+        hidden_size=32,
+        intermediate_size=32,
+        num_hidden_layers=4,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=8,
+        num_local_experts=4,
+        num_experts_per_tok=2,
+        layer_types=['sliding_attention', 'full_attention'] * 2,
+        sliding_window=4,
+        pad_token_id=0,
+        eos_token_id=1,
+    )
+    config._attn_implementation = 'eager'
+    return GptOssForCausalLM(config).float()
+
+
+def _verify_batches(seed: int, steps: int, global_batch: int, vocab_size: int) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed + 1)
+    return torch.randint(2, vocab_size, (steps, global_batch, 12), generator=generator)
+
+
+def _verify_rank(rank: int, world_size: int, port: int, steps: int, seed: int, result_path: str):
+    os.environ.update({'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port)})
+    dist.init_process_group(backend='gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(1)
+    try:
+        model = _tiny_model(seed)
+        model_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+        sharded = ShardedModel(model, rank, world_size)
+        optimizer = torch.optim.AdamW(sharded.parameter_groups(0.01), lr=1e-3)
+        batches = _verify_batches(seed, steps, 2 * world_size, model.config.vocab_size)
+
+        losses = []
+        for step in range(steps):
+            input_ids = batches[step, 2 * rank:2 * rank + 2]
+            loss = model(input_ids=input_ids, labels=input_ids, use_cache=False).loss
+            loss.backward()
+            sharded.clip_grad_norm_(1.0)
+            optimizer.step()
+            sharded.zero_grad()
+            losses.append(_all_reduce_sum([loss.item()])[0] / world_size)
+
+        if rank == 0:
+            with open(result_path, 'w') as f:
+                json.dump({'losses': losses, 'shard_bytes': sharded.shard_bytes(), 'model_bytes': model_bytes}, f)
+    finally:
+        dist.destroy_process_group()
+
+
+def verify_sharded_training(world_size: int = 2, steps: int = 3, seed: int = 0) -> Dict:
+    """
+    Train a tiny random GPT-OSS model for a few AdamW steps on world_size localhost gloo
+    ranks (each on its half of every batch) and unsharded on the full batches, and compare
+    the per-step losses
+    """
+    from vitalis.training.data_parallel import _free_port
+    from vitalis.training.lean_optimizers import decay_parameter_groups
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_path = os.path.join(tmp_dir, 'sharded.json')
+        mp.start_processes(
+            _verify_rank,
+            args=(world_size, _free_port(), steps, seed, result_path),
+            nprocs=world_size,
+            join=True,
+            start_method='spawn'
+        )
+        with open(result_path, 'r') as f:
+            sharded = json.load(f)
+
+    model = _tiny_model(seed)
+    optimizer = torch.optim.AdamW(decay_parameter_groups(model, 0.01), lr=1e-3)
+    batches = _verify_batches(seed, steps, 2 * world_size, model.config.vocab_size)
+    reference = []
+    for step in range(steps):
+        loss = model(input_ids=batches[step], labels=batches[step], use_cache=False).loss
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        reference.append(loss.item())
+
+    return {
+        'world_size': world_size,
+        'reference_losses': reference,
+        'sharded_losses': sharded['losses'],
+        'loss_max_abs_diff': max(abs(a - b) for a, b in zip(reference, sharded['losses'])),
+        'shard_fraction': sharded['shard_bytes'] / sharded['model_bytes'],
+    }
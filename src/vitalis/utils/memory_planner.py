@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Pre-flight Memory Planner
+Predicts peak RAM for weights, gradients, optimizer state, activations and KV cache from
+config.json and model.safetensors.index.json alone, so a load strategy is chosen before
+any weights are read
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+GB = 1024 ** 3
+
+# Bytes per parameter; MXFP4 packs two 4-bit values per byte plus one UE8 scale per 32 values
+DTYPE_BYTES = {
+    'float32': 4.0,
+    'float16': 2.0,
+    'bfloat16': 2.0,
+    'mxfp4': 0.5 + 1 / 32,
+}
+
+# Optimizer state tensors kept per trainable parameter, in the parameter dtype
+OPTIMIZER_STATES = {
+    'adamw': 2,
+    'sgd': 1,
+    'adafactor': 0,
+    'adamw_offload': 0,
+}
+
+# Optimizers whose state does not follow the parameter dtype: bytes per trainable parameter
+OPTIMIZER_STATE_BYTES = {
+    # Two float8 moments plus two float32 scales per 256-value block
+    'adamw_8bit': 2 + 8 / 256,
+}
+
+# Fraction of physical memory a plan may use, leaving room for the OS and the Python runtime
+DEFAULT_HEADROOM = 0.85
+
+
+def dtype_name(dtype) -> str:
+    """'bfloat16' for torch.bfloat16, 'bfloat16', 'bf16' and similar spellings"""
+    name = str(dtype).replace('torch.', '').lower()
+    return {'bf16': 'bfloat16', 'fp16': 'float16', 'half': 'float16', 'fp32': 'float32', 'float': 'float32'}.get(name, name)
+
+
+class MemoryPlanner:
+    """
+    Memory model of a GPT-OSS style mixture-of-experts checkpoint
+
+    Parameter counts come from config.json; the safetensors index total_size is used
+    to check them against the checkpoint on disk. Activation figures are estimates of
+    the tensors autograd keeps per layer, not measurements
+    """
+
+    def __init__(self, model_path: str):
+        self.model_path = Path(model_path)
+        with open(self.model_path / 'config.json', 'r') as f:
+            self.config = json.load(f)
+
+        self.index_total_size = None
+        index_path = self.model_path / 'model.safetensors.index.json'
+        if index_path.exists():
+            with open(index_path, 'r') as f:
+                self.index_total_size = json.load(f).get('metadata', {}).get('total_size')
+
+        c = self.config
+        self.vocab_size = c['vocab_size']
+        self.hidden_size = c['hidden_size']
+        self.num_layers = c['num_hidden_layers']
+        self.num_heads = c['num_attention_heads']
+        self.num_kv_heads = c.get('num_key_value_heads', self.num_heads)
+        self.head_dim = c.get('head_dim', self.hidden_size // self.num_heads)
+        self.num_experts = c.get('num_local_experts', 0)
+        self.experts_per_token = c.get('num_experts_per_tok', c.get('experts_per_token', 0))
+        self.intermediate_size = c['intermediate_size']
+        self.layer_types = c.get('layer_types') or ['full_attention'] * self.num_layers
+        self.sliding_window = c.get('sliding_window')
+        self.quant_method = (c.get('quantization_config') or {}).get('quant_method')
+
+        self.params = self._count_parameters()
+        if self.index_total_size is not None:
+            predicted = self.checkpoint_bytes()
+            if abs(predicted - self.index_total_size) > 0.01 * self.index_total_size:
+                logging.warning(
+                    f"WARNING Planner parameter model predicts {predicted / GB:.2f} GB on disk but the "
+                    f"safetensors index reports {self.index_total_size / GB:.2f} GB; estimates may be off"
+                )
+
+    def _count_parameters(self) -> Dict[str, int]:
+        h, nh, kv, hd = self.hidden_size, self.num_heads, self.num_kv_heads, self.head_dim
+        e, i = self.num_experts, self.intermediate_size
+        bias = 1 if self.config.get('attention_bias', False) else 0
+
+        attention = (h * nh * hd + bias * nh * hd) + 2 * (h * kv * hd + bias * kv * hd) \
+            + (nh * hd * h + bias * h) + nh  # q, k, v, o (+ biases) and attention sinks
+        router = e * h + e
+        expert_bias = e * 2 * i + e * h
+        expert_weights = e * h * 2 * i + e * i * h  # gate_up_proj and down_proj
+        norms = 2 * h
+
+        embeddings = self.vocab_size * h
+        lm_head = 0 if self.config.get('tie_word_embeddings', False) else self.vocab_size * h
+
+        return {
+            'embeddings': embeddings + lm_head,
+            'attention': self.num_layers * attention,
+            'router': self.num_layers * router,
+            'norms': self.num_layers * norms + h,
+            'expert_bias': self.num_layers * expert_bias,
+            'expert_weights': self.num_layers * expert_weights,
+        }
+
+    @property
+    def total_parameters(self) -> int:
+        return sum(self.params.values())
+
+    def checkpoint_bytes(self) -> int:
+        """Size of the checkpoint as stored: expert weights quantized when quant_method is mxfp4"""
+        expert_dtype = 'mxfp4' if self.quant_method == 'mxfp4' else 'bfloat16'
+        dense = self.total_parameters - self.params['expert_weights']
+        return int(dense * DTYPE_BYTES['bfloat16'] + self.params['expert_weights'] * DTYPE_BYTES[expert_dtype])
+
+    def weight_bytes(self, dtype: str) -> int:
+        """Resident weights when loaded as dtype; 'mxfp4' keeps experts packed and the rest in bfloat16"""
+        dtype = dtype_name(dtype)
+        if dtype == 'mxfp4':
+            return self.checkpoint_bytes()
+        return int(self.total_parameters * DTYPE_BYTES[dtype])
+
+    def lora_parameters(self, rank: int, targets: Sequence[str]) -> int:
+        """Trainable LoRA parameters (A and B matrices) for the attention projections in targets"""
+        h, q_out, kv_out = self.hidden_size, self.num_heads * self.head_dim, self.num_kv_heads * self.head_dim
+        shapes = {
+            'q_proj': (h, q_out),
+            'k_proj': (h, kv_out),
+            'v_proj': (h, kv_out),
+            'o_proj': (q_out, h),
+        }
+        total = 0
+        for target in targets:
+            if target not in shapes:
+                logging.warning(f"WARNING Memory planner has no shape for LoRA target '{target}'; not counted")
+                continue
+            fan_in, fan_out = shapes[target]
+            total += rank * (fan_in + fan_out)
+        return total * self.num_layers
+
+    def _attention_span(self, layer_type: str, seq_len: int) -> int:
+        if layer_type == 'sliding_attention' and self.sliding_window:
+            return min(seq_len, self.sliding_window)
+        return seq_len
+
+    def kv_cache_bytes(self, batch_size: int, context_length: int, dtype: str = 'bfloat16') -> int:
+        """Keys and values for every layer; sliding-window layers only keep the last window"""
+        per_token = 2 * self.num_kv_heads * self.head_dim * DTYPE_BYTES[dtype_name(dtype)]
+        return int(sum(
+            batch_size * self._attention_span(layer_type, context_length) * per_token
+            for layer_type in self.layer_types
+        ))
+
+    def _mlp_activation_bytes(self, batch_size: int, seq_len: int, act_bytes: float) -> float:
+        """Tensors the MoE MLP of one layer keeps for backward"""
+        tokens = batch_size * seq_len
+        k, i = self.experts_per_token, self.intermediate_size
+        router = tokens * self.num_experts * 4  # router logits in float32
+        experts = tokens * k * (self.hidden_size + 2 * i + i) * act_bytes  # routed inputs, gate_up output, activation
+        return router + experts
+
+    def _layer_activation_bytes(self, batch_size: int, seq_len: int, act_bytes: float, eager_attention: bool) -> float:
+        """Tensors one decoder layer keeps for backward when it is not checkpointed"""
+        tokens = batch_size * seq_len
+        h, q_out, kv_out = self.hidden_size, self.num_heads * self.head_dim, self.num_kv_heads * self.head_dim
+
+        hidden = tokens * (4 * h + 2 * q_out + 2 * kv_out) * act_bytes  # norms, residuals, q/k/v/o inputs
+        scores = 0.0
+        if eager_attention:
+            # Eager attention materializes scores and probabilities over the full sequence
+            scores = 2 * batch_size * self.num_heads * seq_len * seq_len * act_bytes
+        return hidden + self._mlp_activation_bytes(batch_size, seq_len, act_bytes) + scores
+
+    def plan(self, mode: str = 'full', dtype: str = 'bfloat16', batch_size: int = 1, seq_len: int = 1024,
+             gradient_checkpointing: Union[bool, str, Dict] = True, lora_rank: int = 8, lora_targets: Sequence[str] = ('q_proj', 'v_proj'),
+             optimizer: str = 'adamw', loss_mode: str = 'standard', loss_chunk_size: int = 256,
+             eager_attention: bool = True, kv_cache_length: Optional[int] = None) -> Dict:
+        """
+        Peak memory prediction in bytes per component
+
+        mode is 'full' (all parameters trainable), 'lora' (adapters only) or 'serve'
+        (inference with a KV cache of kv_cache_length tokens, seq_len by default).
+        gradient_checkpointing takes a policy as accepted by resolve_checkpoint_policy
+        """
+        from vitalis.training.checkpoint_policy import (
+            CHECKPOINT_LAYER, CHECKPOINT_MOE_MLP, describe_checkpoint_modes, resolve_checkpoint_policy
+        )
+
+        dtype = dtype_name(dtype)
+        act_dtype = 'bfloat16' if dtype == 'mxfp4' else dtype
+        act_bytes = DTYPE_BYTES[act_dtype]
+        tokens = batch_size * seq_len
+        components = {'weights': self.weight_bytes(dtype)}
+
+        if mode == 'serve':
+            context = kv_cache_length or seq_len
+            components['kv_cache'] = self.kv_cache_bytes(batch_size, context, act_dtype)
+            # A prefill pass over the prompt without autograd holds one layer at a time
+            components['activations'] = self._layer_activation_bytes(batch_size, seq_len, act_bytes, eager_attention)
+            components['logits'] = batch_size * self.vocab_size * 4
+        else:
+            if mode == 'lora':
+                trainable = self.lora_parameters(lora_rank, lora_targets)
+                trainable_bytes = trainable * DTYPE_BYTES[act_dtype]
+            elif mode == 'full':
+                if dtype == 'mxfp4':
+                    raise ValueError("Full fine-tuning needs dequantized weights; use bfloat16 or float32")
+                trainable = self.total_parameters
+                trainable_bytes = self.weight_bytes(dtype)
+            else:
+                raise ValueError(f"Unknown planning mode '{mode}', expected 'full', 'lora' or 'serve'")
+
+            components['gradients'] = trainable_bytes
+            if optimizer in OPTIMIZER_STATE_BYTES:
+                components['optimizer_state'] = int(trainable * OPTIMIZER_STATE_BYTES[optimizer])
+            else:
+                components['optimizer_state'] = trainable_bytes * OPTIMIZER_STATES.get(optimizer, 2)
+
+            layer_bytes = self._layer_activation_bytes(batch_size, seq_len, act_bytes, eager_attention)
+            mlp_bytes = self._mlp_activation_bytes(batch_size, seq_len, act_bytes)
+            checkpoint_input = tokens * self.hidden_size * act_bytes
+            per_mode = {
+                None: layer_bytes,
+                # Checkpointed layers keep only their input; one layer is recomputed at a time
+                CHECKPOINT_LAYER: checkpoint_input,
+                CHECKPOINT_MOE_MLP: layer_bytes - mlp_bytes + checkpoint_input,
+            }
+            modes = resolve_checkpoint_policy(gradient_checkpointing, self.layer_types)
+            components['activations'] = sum(per_mode[m] for m in modes)
+            if CHECKPOINT_LAYER in modes:
+                components['activations'] += layer_bytes
+            elif CHECKPOINT_MOE_MLP in modes:
+                components['activations'] += mlp_bytes
+
+            # float32 logits and their gradient, or one chunk of supervised positions at a time
+            logit_rows = min(loss_chunk_size, tokens) if loss_mode == 'chunked' else tokens
+            components['logits'] = 2 * logit_rows * self.vocab_size * 4
+
+        components = {name: int(value) for name, value in components.items()}
+        return {
+            'mode': mode,
+            'dtype': dtype,
+            'batch_size': batch_size,
+            'seq_len': seq_len,
+            'gradient_checkpointing': describe_checkpoint_modes(modes) if mode != 'serve' else 'off',
+            'trainable_parameters': 0 if mode == 'serve' else trainable,
+            'components': components,
+            'peak_bytes': sum(components.values()),
+        }
+
+
+def workload_from_config(config: Dict, mode: str, batch_size: Optional[int] = None,
+                         seq_len: Optional[int] = None) -> Dict:
+    """MemoryPlanner.plan keyword arguments for a training config (full or LoRA trainer)"""
+    return {
+        'mode': mode,
+        'batch_size': batch_size or config.get('batch_size', 1),
+        'seq_len': seq_len or config.get('max_length', 1024),
+        'gradient_checkpointing': config.get('gradient_checkpointing', True),
+        'lora_rank': config.get('lora_r', 8),
+        'lora_targets': config.get('lora_target_modules', ['q_proj', 'v_proj']),
+        'optimizer': config.get('optimizer', 'adamw'),
+        'loss_mode': config.get('loss_mode', 'standard'),
+        'loss_chunk_size': config.get('loss_chunk_size', 256),
+    }
+
+
+def available_memory_bytes(headroom: float = DEFAULT_HEADROOM) -> int:
+    """Usable memory for a plan: the smaller of available RAM and a headroom share of total RAM"""
+    import psutil
+
+    memory = psutil.virtual_memory()
+    return int(min(memory.available, memory.total * headroom))
+
+
+def select_strategy(planner: MemoryPlanner, strategies: List[Dict], workload: Dict,
+                    budget_bytes: Optional[int] = None) -> Optional[Dict]:
+    """
+    First strategy whose predicted peak fits the budget, or None
+
+    Each strategy needs a 'torch_dtype' (torch dtype or name); workload holds the
+    keyword arguments of MemoryPlanner.plan. The chosen strategy gets its plan under 'plan'
+    """
+    budget_bytes = budget_bytes if budget_bytes is not None else available_memory_bytes()
+    for strategy in strategies:
+        plan = planner.plan(dtype=dtype_name(strategy['torch_dtype']), **workload)
+        fits = plan['peak_bytes'] <= budget_bytes
+        logging.info(
+            f"{'COMPLETED' if fits else 'FAILED'} Memory plan for {strategy['name']}: "
+            f"{plan['peak_bytes'] / GB:.1f} GB predicted, {budget_bytes / GB:.1f} GB available"
+        )
+        if fits:
+            return dict(strategy, plan=plan)
+    return None
+
+
+def format_plan(plan: Dict) -> List[str]:
+    """Human-readable lines for a plan"""
+    lines = [
+        f"{plan['mode']} / {plan['dtype']} / batch {plan['batch_size']} x {plan['seq_len']} tokens"
+        f"{'' if plan['gradient_checkpointing'] == 'off' else ' / checkpointing ' + plan['gradient_checkpointing']}"
+    ]
+    for name, value in plan['components'].items():
+        lines.append(f"   {name:<16} {value / GB:8.2f} GB")
+    lines.append(f"   {'peak':<16} {plan['peak_bytes'] / GB:8.2f} GB")
+    return lines